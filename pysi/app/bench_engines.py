@@ -0,0 +1,380 @@
+# pysi/app/bench_engines.py
+# 計画エンジンのヘッドレス・ベンチマーク（GUI / DB なし）
+#
+# - 合成ツリー: OUT（root → … → 葉）と IN（MOM → … → 葉）を depth × fanout で作り、
+#               葉の demand S に lot を週あたり lots_per_week 個（ポアソン）積む。休暇週は vacation_density の確率で各ノードに付与
+# - 計測対象: run_engine / run_engine_safenet の各 mode、propagate_postorder_with_calcP2S、Pipeline.run
+#             Pipeline は run_once と同じく pysi.plugins を読み込んだ bus で走らせ、出力は一時ディレクトリへ
+#             各 mode は前段（MODES の手前の mode）を済ませたツリー上で計測する（準備は計測外）
+# - 結果   : wall time（repeat 回の最小 / 中央値）、tracemalloc のピーク、lots/sec を JSON で出力
+# - 基準比較: --baseline（別名 --compare）の JSON と比べ、wall / peak が tolerance を超えて悪化したケースを報告（終了コード 1）
+#
+#使い方
+#
+#python -m pysi.app.bench_engines --depth 2 3 4 --fanout 3 --years 2 --out out/bench/latest.json
+#python -m pysi.app.bench_engines --depth 3 --save-baseline out/bench/baseline.json
+#python -m pysi.app.bench_engines --depth 3 --compare out/bench/baseline.json --tolerance 0.2
+#python -m pysi.app.bench_engines --case pipeline --no-plugins --work-dir out/bench/_pipeline
+
+from __future__ import annotations
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pysi.network.node_base import PlanNode
+from pysi.plan import engines
+from pysi.plan.operations import propagate_postorder_with_calcP2S
+
+# run_engine の mode（この順に前段を済ませてから計測する）
+MODES = (
+    "outbound_backward_leaf_to_MOM",
+    "inbound_MOM_leveling_vs_capacity",
+    "inbound_backward_MOM_to_leaf",
+    "inbound_forward_leaf_to_MOM",
+    "outbound_forward_push_DAD_to_buffer",
+    "outbound_backward_pull_buffer_to_leaf",
+)
+RUNNERS = {
+    "run_engine": engines.run_engine,
+    "run_engine_safenet": engines.run_engine_safenet,
+}
+PRODUCT = "BENCH"
+WEEKS_PER_YEAR = 53   # エンジン側（connect_outbound2inbound など）が 53 * plan_range で回すため
+
+
+@dataclass(frozen=True)
+class BenchSpec:
+    """合成ツリーの形"""
+    depth: int = 3                  # root から葉までの段数
+    fanout: int = 3                 # 各ノードの子の数
+    years: int = 2                  # 計画期間（週数 = 53 * years）
+    lots_per_week: float = 4.0      # 葉 1 つあたりの週平均 lot 数
+    vacation_density: float = 0.0   # 各ノード・各週が休暇週になる確率
+    seed: int = 0
+    plan_year_st: int = 2025
+
+    @property
+    def weeks(self) -> int:
+        return WEEKS_PER_YEAR * self.years
+
+    @property
+    def label(self) -> str:
+        return f"d{self.depth}f{self.fanout}y{self.years}l{self.lots_per_week:g}v{self.vacation_density:g}"
+
+
+# ----------------------------
+# 合成ツリー
+# ----------------------------
+def _grow(root: PlanNode, prefix: str, spec: BenchSpec, rng: random.Random) -> List[PlanNode]:
+    """root の下に depth 段 × fanout のツリーを作り、全ノードを返す"""
+    nodes = [root]
+    level = [root]
+    for d in range(1, spec.depth + 1):
+        nxt = []
+        for i, parent in enumerate(level):
+            for k in range(spec.fanout):
+                ch = PlanNode(f"{prefix}{d}_{i * spec.fanout + k}")
+                parent.add_child(ch)
+                nxt.append(ch)
+        nodes.extend(nxt)
+        level = nxt
+    for n in nodes:
+        n.leadtime = rng.randint(1, 3)
+        n.SS_days = 7 * rng.randint(1, 3)
+        if spec.vacation_density > 0:
+            n.long_vacation_weeks = [w for w in range(spec.weeks) if rng.random() < spec.vacation_density]
+    return nodes
+
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    # Knuth 法（lam は小さい前提）
+    if lam <= 0:
+        return 0
+    L, k, p = pow(2.718281828459045, -lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= L:
+            return k
+        k += 1
+
+
+def build_synthetic_trees(spec: BenchSpec) -> Tuple[PlanNode, PlanNode, int]:
+    """(out_root, in_root, 投入 lot 数) を返す。lot_ID は NODE-PRODUCT-YYYYWWNNNN 形式"""
+    rng = random.Random(spec.seed)
+    out_root = PlanNode("supply_point")
+    in_root = PlanNode("MOM")
+    out_nodes = _grow(out_root, "OUT", spec, rng)
+    _grow(in_root, "IN", spec, rng)
+    out_root.set_plan_range_by_weeks(spec.weeks, spec.plan_year_st)
+    in_root.set_plan_range_by_weeks(spec.weeks, spec.plan_year_st)
+
+    total = 0
+    for leaf in (n for n in out_nodes if not n.children):
+        pSi = []
+        for w in range(spec.weeks):
+            y, ww = spec.plan_year_st + w // WEEKS_PER_YEAR, w % WEEKS_PER_YEAR + 1
+            k = _poisson(rng, spec.lots_per_week)
+            pSi.append([f"{leaf.name}-{PRODUCT}-{y:04d}{ww:02d}{s:04d}" for s in range(1, k + 1)])
+            total += k
+        leaf.set_S2psi(pSi)
+    # MOM の平準化キャパ（週平均の到着 lot 数程度）
+    leaves = spec.fanout ** spec.depth
+    in_root.nx_capacity = max(1, int(round(spec.lots_per_week * leaves)))
+    return out_root, in_root, total
+
+
+# ----------------------------
+# 計測
+# ----------------------------
+class _SyntheticIO:
+    """Pipeline.run 用の最小 I/O（合成ツリーをそのまま返す）"""
+
+    def __init__(self, root) -> None:
+        self.root = root
+
+    def load_all(self, spec):
+        return {}
+
+    def build_tree(self, raw):
+        return self.root
+
+    def derive_params(self, raw):
+        return {}
+
+    def collect_result(self, root, params=None):
+        return {"root": root}
+
+    def to_series_df(self, result, horizon=0):
+        import pandas as pd
+        return pd.DataFrame()
+
+
+def _plugin_bus(plugins: bool):
+    """Pipeline 用の HookBus。plugins=True なら run_once と同じく pysi.plugins を読み込んだグローバル bus"""
+    from pysi.core.hooks import core as hooks_core
+    if not plugins:
+        return hooks_core.HookBus()
+    # @action/@filter は import 時にグローバル hooks へ登録される（読み込みログは捨てる）
+    with contextlib.redirect_stdout(io.StringIO()):
+        hooks_core.autoload_plugins("pysi.plugins")
+    return hooks_core.hooks
+
+
+def _case_fn(case: str, spec: BenchSpec, *, out_dir: str = "",
+             plugins: bool = True) -> Callable[[PlanNode, PlanNode], Any]:
+    if case == "propagate_postorder_with_calcP2S":
+        return lambda out_root, in_root: propagate_postorder_with_calcP2S(out_root)
+    if case == "pipeline":
+        from pysi.core.pipeline import Pipeline
+        cal = {"weeks": spec.weeks, "iso_year_start": spec.plan_year_st, "iso_week_start": 1}
+        bus = _plugin_bus(plugins)
+
+        def run(out_root, in_root):
+            return Pipeline(bus, _SyntheticIO(out_root)).run("", "bench", dict(cal), out_dir=out_dir)
+        return run
+    runner, mode = case.split(":", 1)
+    fn = RUNNERS[runner]
+    return lambda out_root, in_root: fn(out_root, in_root, None, mode)
+
+
+def _prepare(case: str, spec: BenchSpec) -> Tuple[PlanNode, PlanNode, int]:
+    out_root, in_root, lots = build_synthetic_trees(spec)
+    if ":" in case:
+        mode = case.split(":", 1)[1]
+        for m in MODES[:MODES.index(mode)]:
+            engines.run_engine_safenet(out_root, in_root, None, m)
+    return out_root, in_root, lots
+
+
+def default_cases() -> List[str]:
+    cases = [f"{r}:{m}" for r in RUNNERS for m in MODES]
+    return cases + ["propagate_postorder_with_calcP2S", "pipeline"]
+
+
+def bench_case(case: str, spec: BenchSpec, *, repeat: int = 3, memory: bool = True,
+               work_dir: Optional[str] = None, plugins: bool = True) -> Dict[str, Any]:
+    """
+    1 ケースを repeat 回計測（毎回ツリーを作り直す）。エンジンの print は捨てる
+    work_dir: Pipeline の out_dir（None なら一時ディレクトリを作って最後に消す）
+    plugins : Pipeline ケースで pysi.plugins を読み込む（False なら素の HookBus）
+    """
+    walls: List[float] = []
+    rec: Dict[str, Any] = {"case": case, "spec": spec.label, "error": None}
+    sink = io.StringIO()
+    try:
+        with contextlib.ExitStack() as stack:
+            if work_dir is None:
+                work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="pysi_bench_"))
+            fn = _case_fn(case, spec, out_dir=work_dir, plugins=plugins)
+            stack.enter_context(contextlib.redirect_stdout(sink))
+            for _ in range(max(1, repeat)):
+                out_root, in_root, lots = _prepare(case, spec)
+                gc.collect()
+                t0 = time.perf_counter()
+                fn(out_root, in_root)
+                walls.append(time.perf_counter() - t0)
+                sink.seek(0)
+                sink.truncate()
+            peak = None
+            if memory:
+                out_root, in_root, lots = _prepare(case, spec)
+                gc.collect()
+                tracemalloc.start()
+                try:
+                    fn(out_root, in_root)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+    except Exception as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+        return rec
+    best = min(walls)
+    rec.update({
+        "lots": lots,
+        "wall_s": best,
+        "wall_median_s": statistics.median(walls),
+        "peak_kib": None if peak is None else peak / 1024.0,
+        "lots_per_s": (lots / best) if best > 0 else None,
+    })
+    return rec
+
+
+def run_benchmarks(specs: List[BenchSpec], cases: Optional[List[str]] = None, *,
+                   repeat: int = 3, memory: bool = True, work_dir: Optional[str] = None,
+                   plugins: bool = True,
+                   progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    cases = cases or default_cases()
+    results: Dict[str, Dict[str, Any]] = {}
+    for spec in specs:
+        for case in cases:
+            rec = bench_case(case, spec, repeat=repeat, memory=memory,
+                             work_dir=work_dir, plugins=plugins)
+            results[f"{case}@{spec.label}"] = rec
+            if progress:
+                progress(_fmt(rec))
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "plugins": plugins,
+            "specs": [asdict(s) for s in specs],
+        },
+        "results": results,
+    }
+
+
+def _fmt(rec: Dict[str, Any]) -> str:
+    if rec.get("error"):
+        return f"[ERR ] {rec['case']}@{rec['spec']}: {rec['error']}"
+    peak = "-" if rec["peak_kib"] is None else f"{rec['peak_kib']:.0f}KiB"
+    return (f"[OK  ] {rec['case']}@{rec['spec']}: {rec['wall_s'] * 1e3:.1f}ms "
+            f"peak={peak} lots/s={rec['lots_per_s'] or 0:.0f}")
+
+
+# ----------------------------
+# 基準との比較
+# ----------------------------
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], *,
+                        tolerance: float = 0.25, min_wall_s: float = 0.005) -> List[Dict[str, Any]]:
+    """
+    baseline より悪化したケースの一覧（同じキーのケースだけ比較）。
+    - wall_s  : base * (1 + tolerance) を超え、かつ min_wall_s 以上（極小ケースの揺れは無視）
+    - peak_kib: base * (1 + tolerance) を超えた
+    - 基準で動いていたケースがエラーになった
+    """
+    out = []
+    base = baseline.get("results", {})
+    for key, cur in report.get("results", {}).items():
+        ref = base.get(key)
+        if not ref or ref.get("error"):
+            continue
+        if cur.get("error"):
+            out.append({"case": key, "metric": "error", "baseline": None, "current": cur["error"]})
+            continue
+        for metric in ("wall_s", "peak_kib"):
+            b, c = ref.get(metric), cur.get(metric)
+            if b is None or c is None:
+                continue
+            if metric == "wall_s" and c < min_wall_s:
+                continue
+            if c > b * (1 + tolerance):
+                out.append({"case": key, "metric": metric, "baseline": b, "current": c,
+                            "ratio": c / b if b else None})
+    return out
+
+
+def _write_json(path: str, obj: Dict[str, Any]) -> None:
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def _main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="PSI planning engine benchmark")
+    ap.add_argument("--depth", type=int, nargs="+", default=[3])
+    ap.add_argument("--fanout", type=int, nargs="+", default=[3])
+    ap.add_argument("--years", type=int, default=2)
+    ap.add_argument("--lots", type=float, default=4.0, help="葉 1 つあたりの週平均 lot 数")
+    ap.add_argument("--vacation", type=float, default=0.0, help="休暇週の密度（0..1）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--case", action="append", help="計測するケース（既定: 全 mode + propagate + pipeline）")
+    ap.add_argument("--no-memory", action="store_true", help="tracemalloc によるピーク計測を省く")
+    ap.add_argument("--out", help="結果 JSON の出力先")
+    ap.add_argument("--baseline", "--compare", dest="baseline", help="比較する基準 JSON")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--save-baseline", help="今回の結果を基準として保存")
+    ap.add_argument("--work-dir", help="Pipeline ケースの出力先（既定: 一時ディレクトリ）")
+    ap.add_argument("--no-plugins", action="store_true", help="Pipeline ケースで pysi.plugins を読み込まない")
+    args = ap.parse_args(argv)
+
+    base = BenchSpec(years=args.years, lots_per_week=args.lots,
+                     vacation_density=args.vacation, seed=args.seed)
+    specs = [replace(base, depth=d, fanout=f) for d in args.depth for f in args.fanout]
+    report = run_benchmarks(specs, args.case, repeat=args.repeat, memory=not args.no_memory,
+                            work_dir=args.work_dir, plugins=not args.no_plugins,
+                            progress=lambda s: print(s, file=sys.stderr))
+    if args.out:
+        _write_json(args.out, report)
+    if args.save_baseline:
+        _write_json(args.save_baseline, report)
+    if not args.out and not args.save_baseline:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regs = compare_to_baseline(report, baseline, tolerance=args.tolerance)
+        for r in regs:
+            if r["metric"] == "error":
+                print(f"[REGRESSION] {r['case']}: {r['current']}", file=sys.stderr)
+            else:
+                print(f"[REGRESSION] {r['case']}: {r['metric']} {r['baseline']:.4g} -> "
+                      f"{r['current']:.4g} (x{r['ratio']:.2f})", file=sys.stderr)
+        if regs:
+            return 1
+        print(f"[OK] no regression vs {args.baseline} (tolerance={args.tolerance:g})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
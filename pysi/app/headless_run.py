@@ -9,7 +9,8 @@ Tkinter → Web(React/Next.js) or Qt：GUIは orchestrator（CLI/関数） を
  '''
 from pysi.db.apply_schema import apply_schema
 from pysi.db.calendar_sync import sync_calendar_iso
-from pysi.io.psi_io_adapters import _open, get_scenario_id, load_leaf_S_and_compute, write_both_layers
+from pysi.io.lot_bucket_reader import ensure_covering_indexes
+from pysi.io.psi_io_adapters import _open, get_scenario_id, load_leaf_S_and_compute, write_nodes_to_lot_bucket
 from pysi.etl.etl_monthly_to_lots import run_etl
 from pysi.network.factory import factory  # あなたのネットワークビルダ
 from pysi.plan.run_pass import run_idempotent_demand_pass
@@ -20,6 +21,7 @@ CSV = "data/S_month_data.csv"
 apply_schema(DB, "pysi/db/schema.sql")
 run_etl(DB, CSV, SCENARIO, default_lot_size=50)
 conn = _open(DB)
+ensure_covering_indexes(conn)   # lot_bucket / lot の covering index（スキーマ作成時に 1 回）
 weeks = sync_calendar_iso(conn, scenario_name=SCENARIO, csv_path=CSV)
 sid = get_scenario_id(conn, SCENARIO)
 # 2) ツリー生成（製品指定はfactory側で）
@@ -28,5 +30,5 @@ root = factory(data_dir="data", product_name=None, direction="outbound")
 for leaf in [n for n in getattr(root, "children", []) or [] if not n.children]:
     load_leaf_S_and_compute(conn, scenario_id=sid, node_obj=leaf, product_name=leaf.sku.product_name if hasattr(leaf, "sku") else "RICE")
 run_idempotent_demand_pass(root)
-write_both_layers(conn, scenario_id=sid, node_obj=root, product_name="RICE", replace_slice=True)
+write_nodes_to_lot_bucket(conn, scenario_id=sid, nodes=[root], product_name="RICE")  # 従来どおり root のみ
 print("DONE")
@@ -54,9 +54,22 @@ def compile_narrative_to_yaml(narr_path: str, scenario: str, db: str) -> str:
     }
     y = yaml.safe_dump(cfg, sort_keys=False, allow_unicode=True)
     return y
+def compile_narratives_to_sweep(narr_paths, scenario: str, db: str) -> str:
+    """複数の narrative を 1 つの sweep YAML（variants）にまとめる（pysi.app.scenario_batch 用）"""
+    import os
+    variants = []
+    for p in narr_paths:
+        cfg = yaml.safe_load(compile_narrative_to_yaml(p, scenario, db))
+        variants.append({"name": os.path.splitext(os.path.basename(p))[0], "actions": cfg["actions"]})
+    cfg = {"scenario": scenario, "db": db, "mode": "leaf", "variants": variants}
+    return yaml.safe_dump(cfg, sort_keys=False, allow_unicode=True)
 if __name__ == "__main__":
     # 使い方: python -m pysi.app.narrative_compiler narrative.txt Baseline var/psi.sqlite > scenario.yaml
     if len(sys.argv) < 4:
-        print("usage: narrative_compiler.py <narrative.txt> <scenario_name> <db_path>", file=sys.stderr)
+        print("usage: narrative_compiler.py <narrative.txt>... <scenario_name> <db_path>", file=sys.stderr)
         sys.exit(1)
-    print(compile_narrative_to_yaml(sys.argv[1], sys.argv[2], sys.argv[3]))
+    # 複数: python -m pysi.app.narrative_compiler a.txt b.txt Baseline var/psi.sqlite > sweep.yaml
+    if len(sys.argv) > 4:
+        print(compile_narratives_to_sweep(sys.argv[1:-2], sys.argv[-2], sys.argv[-1]))
+    else:
+        print(compile_narrative_to_yaml(sys.argv[1], sys.argv[2], sys.argv[3]))
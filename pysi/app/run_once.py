@@ -6,6 +6,7 @@
 #calendar は cfg["calendar"] があれば優先、なければ weeks/iso_year_start/iso_week_start を拾って正規化。
 #scenario_id は scenario_id → scenario → "" の順でフォールバック。
 #out_dir は out_dir → out → "out" の順でフォールバック。
+#cfg["profile"]=True でフック/プラグイン/段ごとの計測を有効化（out_dir に profile.csv / profile.json）。
 
 # pysi/app/run_once.py
 
@@ -55,6 +56,8 @@ def run_once(cfg: Dict[str, Any],
     # ---- HookBus を用意 & グローバルへ設定
     bus = bus or HookBus(logger=logger)
     set_global(bus)
+    if cfg.get("profile"):
+        bus.enable_profiler()  # out_dir に profile.csv / profile.json を出力
 
     # ---- プラグインを読み込み（GUI側でも読むなら二重ロードに注意）
     plugins_dir = cfg.get("plugins_dir") or cfg.get("plugins")
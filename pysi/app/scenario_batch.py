@@ -0,0 +1,303 @@
+# pysi/app/scenario_batch.py
+# scenario_runner の YAML / narrative を N 個まとめて並列に流すバッチ
+#
+# 旧: run_from_yaml を 1 シナリオずつ実行（同じ DB を書き換えるので what-if は順番待ち）
+# 新: 各バリアントに base DB のクローン（SQLite backup API）を 1 つずつ用意し、
+#     ProcessPoolExecutor の worker でクローン上の run_from_yaml → save_run_results を実行。
+#     結果（summary / node 明細）は親プロセスが base DB の scenario_run /
+#     scenario_result_summary / scenario_result_node へまとめて書き込む（書き手は親 1 つだけ）
+#
+# - クローンは workdir（既定: /dev/shm があればそこ＝メモリ上のファイル）に置き、終わったら消す（keep=True で残す）
+#   run_etl / save_run_results / 価格・原価ローダは DB をパスで開くため、":memory:" ではなくファイルにしている
+# - sweep YAML: 共通キー + variants: [{name, actions, ...}, ...]（actions は共通分の後ろに足す）
+# - narrative(.txt) は narrative_compiler で YAML 相当へ変換してから 1 バリアントとして扱う
+#
+#使い方
+#
+#python -m pysi.app.scenario_batch --config sweep.yaml --jobs 8
+#python -m pysi.app.scenario_batch --config a.yaml b.yaml what_if.txt --db var/psi.sqlite --scenario Baseline
+#
+#from pysi.app.scenario_batch import expand_variants, run_batch
+#results = run_batch(expand_variants(cfg), base_db="var/psi.sqlite", jobs=8)
+
+from __future__ import annotations
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional
+
+from pysi.evaluate.frame_cache import invalidate_frames
+
+# scenario_result_node の保存列（save_run_results と同じ並び）
+NODE_COLS = (
+    "product_name", "node_name",
+    "price", "offering_price_ASIS", "offering_price_TOBE",
+    "revenue", "profit", "cost",
+    "logistics_costs", "warehouse_cost", "manufacturing_overhead",
+    "direct_materials_costs", "tax_portion",
+)
+SUMMARY_COLS = ("total_revenue", "total_cost", "total_profit", "profit_ratio")
+
+
+# ----------------------------
+# バリアントの組み立て
+# ----------------------------
+def expand_variants(cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    sweep YAML（共通キー + variants）を run_from_yaml 用の cfg のリストへ展開する。
+    variants が無ければ cfg 自身を 1 バリアントとして返す。
+    """
+    variants = cfg.get("variants")
+    base = {k: v for k, v in cfg.items() if k != "variants"}
+    if not variants:
+        one = copy.deepcopy(base)
+        one.setdefault("name", str(one.get("scenario", "variant")))
+        return [one]
+    out = []
+    for i, v in enumerate(variants):
+        c = copy.deepcopy(base)
+        v = copy.deepcopy(v or {})
+        acts = list(c.get("actions") or []) + list(v.pop("actions", None) or [])
+        c.update(v)
+        c["actions"] = acts
+        c.setdefault("name", f"variant_{i + 1:03d}")
+        out.append(c)
+    return out
+
+
+def load_variants(paths: Iterable[str], *, db: Optional[str] = None,
+                  scenario: Optional[str] = None) -> List[Dict[str, Any]]:
+    """YAML（単体 / sweep）と narrative(.txt) を読み込んでバリアントのリストにする"""
+    import yaml
+    out: List[Dict[str, Any]] = []
+    for p in paths:
+        stem = os.path.splitext(os.path.basename(p))[0]
+        if p.lower().endswith(".txt"):
+            from pysi.app.narrative_compiler import compile_narrative_to_yaml
+            if not scenario:
+                raise ValueError(f"narrative {p} requires --scenario")
+            cfg = yaml.safe_load(compile_narrative_to_yaml(p, scenario, db or ""))
+            cfg["name"] = stem
+        else:
+            with open(p, "r", encoding="utf-8") as f:
+                cfg = yaml.safe_load(f) or {}
+            if not cfg.get("variants"):
+                cfg.setdefault("name", stem)
+        if db:
+            cfg["db"] = db
+        if scenario:
+            cfg.setdefault("scenario", scenario)
+        out.extend(expand_variants(cfg))
+    # 名前の重複は連番で区別（クローンファイル名・レポート出力先に使うため）
+    seen: Dict[str, int] = {}
+    for c in out:
+        n = str(c["name"])
+        seen[n] = seen.get(n, 0) + 1
+        if seen[n] > 1:
+            c["name"] = f"{n}_{seen[n]}"
+    return out
+
+
+# ----------------------------
+# クローン
+# ----------------------------
+def default_workdir() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+
+
+def clone_db(base_db: str, dst_path: str) -> str:
+    """base_db を dst_path へ backup API で複製（WAL 中でも一貫したスナップショットになる）"""
+    src = sqlite3.connect(f"file:{os.path.abspath(base_db)}?mode=ro", uri=True)
+    try:
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        dst = sqlite3.connect(dst_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return dst_path
+
+
+def _safe_name(s: str) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(s))
+
+
+# ----------------------------
+# worker
+# ----------------------------
+def _read_results(db_path: str, run_id: str) -> Dict[str, Any]:
+    con = sqlite3.connect(db_path)
+    try:
+        summary = con.execute(
+            f"SELECT {','.join(SUMMARY_COLS)} FROM scenario_result_summary WHERE run_id=?", (run_id,)
+        ).fetchone()
+        nodes = con.execute(
+            f"SELECT {','.join(NODE_COLS)} FROM scenario_result_node WHERE run_id=?", (run_id,)
+        ).fetchall()
+    finally:
+        con.close()
+    return {"summary": list(summary) if summary else None, "nodes": [list(r) for r in nodes]}
+
+
+def _run_variant(cfg: Dict[str, Any], base_db: str, workdir: str, keep: bool) -> Dict[str, Any]:
+    """1 バリアント: クローン → run_from_yaml → save_run_results → 結果を読み戻して返す"""
+    from pysi.app.scenario_runner import run_from_yaml
+    from pysi.io.psi_io_adapters import get_scenario_id
+    from pysi.scenario.store import save_run_results
+
+    name = str(cfg["name"])
+    clone = os.path.join(workdir, f"{_safe_name(name)}.sqlite")
+    rec: Dict[str, Any] = {"name": name, "scenario": cfg.get("scenario"), "clone": clone,
+                           "error": None, "summary": None, "nodes": []}
+    t0 = time.perf_counter()
+    log = io.StringIO()
+    try:
+        clone_db(base_db, clone)
+        run_cfg = copy.deepcopy(cfg)
+        run_cfg["db"] = clone
+        rep = run_cfg.get("report")
+        if rep:
+            rep["outdir"] = os.path.join(rep.get("outdir", "var/report"), _safe_name(name))
+        with contextlib.redirect_stdout(log):
+            out = run_from_yaml(run_cfg)
+        con = sqlite3.connect(clone)
+        try:
+            sid = get_scenario_id(con, run_cfg["scenario"])
+        finally:
+            con.close()
+        run_id = save_run_results(clone, scenario_id=sid, label=name)
+        rec.update(_read_results(clone, run_id))
+        rec["scenario_id"] = sid
+        rec["weeks"] = out.get("weeks")
+        rec["reports"] = out.get("reports", [])
+    except Exception as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        rec["elapsed_s"] = time.perf_counter() - t0
+        rec["log"] = log.getvalue()[-4000:]
+        invalidate_frames(clone)
+        if not keep:
+            for suffix in ("", "-wal", "-shm"):
+                with contextlib.suppress(OSError):
+                    os.remove(clone + suffix)
+    return rec
+
+
+# ----------------------------
+# 集約（親プロセスのみが base DB に書く）
+# ----------------------------
+def _store_result(con: sqlite3.Connection, rec: Dict[str, Any], cfg: Dict[str, Any]) -> Optional[str]:
+    from pysi.scenario.store import create_run
+    if rec.get("error") or rec.get("summary") is None:
+        return None
+    note = json.dumps({"batch": True, "actions": cfg.get("actions") or []}, ensure_ascii=False)
+    run_id = create_run(con, rec.get("scenario_id"), label=rec["name"], note=note)
+    con.execute(
+        f"INSERT INTO scenario_result_summary(run_id,{','.join(SUMMARY_COLS)}) VALUES(?,?,?,?,?)",
+        (run_id, *rec["summary"]),
+    )
+    if rec["nodes"]:
+        con.executemany(
+            f"INSERT INTO scenario_result_node(run_id,{','.join(NODE_COLS)}) "
+            f"VALUES(?{',?' * len(NODE_COLS)})",
+            [(run_id, *r) for r in rec["nodes"]],
+        )
+    return run_id
+
+
+def run_batch(variants: List[Dict[str, Any]], *, base_db: Optional[str] = None,
+              jobs: Optional[int] = None, workdir: Optional[str] = None,
+              keep: bool = False, store: bool = True) -> List[Dict[str, Any]]:
+    """
+    variants（run_from_yaml 用 cfg のリスト）を並列実行し、結果を base DB へ集約する。
+    - base_db : 省略時は各 cfg["db"]（全バリアントで同じであること）
+    - jobs    : worker 数（1 ならプロセスを起こさず逐次実行）
+    - store   : False なら base DB へは書かず結果だけ返す
+    返り値は variants と同じ順の結果（run_id / summary / elapsed_s / error ...）。
+    """
+    if not variants:
+        return []
+    dbs = {c.get("db") for c in variants} if base_db is None else {base_db}
+    if len(dbs) != 1 or None in dbs:
+        raise ValueError(f"variants must share one base db (got {sorted(map(str, dbs))})")
+    base_db = dbs.pop()
+    if not os.path.exists(base_db):
+        raise FileNotFoundError(base_db)
+    root = tempfile.mkdtemp(prefix="pysi_batch_", dir=workdir or default_workdir())
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(variants)
+    con = sqlite3.connect(base_db) if store else None
+    try:
+        def _done(i: int, rec: Dict[str, Any]) -> None:
+            if con is not None:
+                try:
+                    with con:
+                        rec["run_id"] = _store_result(con, rec, variants[i])
+                except Exception as e:
+                    rec["error"] = rec.get("error") or f"store: {type(e).__name__}: {e}"
+            results[i] = rec
+
+        if jobs == 1:
+            for i, cfg in enumerate(variants):
+                _done(i, _run_variant(cfg, base_db, root, keep))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as ex:
+                futs = {ex.submit(_run_variant, cfg, base_db, root, keep): i
+                        for i, cfg in enumerate(variants)}
+                for f in as_completed(futs):
+                    _done(futs[f], f.result())
+    finally:
+        if con is not None:
+            con.close()
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return results  # type: ignore[return-value]
+
+
+def _main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="run scenario variants in parallel")
+    ap.add_argument("--config", nargs="+", required=True, help="YAML / sweep YAML / narrative .txt")
+    ap.add_argument("--db", help="base DB（YAML の db を上書き）")
+    ap.add_argument("--scenario", help="narrative 用のシナリオ名（YAML に無い場合の既定）")
+    ap.add_argument("--jobs", type=int, default=None)
+    ap.add_argument("--workdir", help="クローンの置き場（既定: /dev/shm または一時ディレクトリ）")
+    ap.add_argument("--keep", action="store_true", help="クローン DB を消さずに残す")
+    ap.add_argument("--no-store", action="store_true", help="base DB へ結果を書き込まない")
+    ap.add_argument("--out", help="結果 JSON の出力先")
+    args = ap.parse_args(argv)
+
+    variants = load_variants(args.config, db=args.db, scenario=args.scenario)
+    t0 = time.perf_counter()
+    results = run_batch(variants, base_db=args.db, jobs=args.jobs, workdir=args.workdir,
+                        keep=args.keep, store=not args.no_store)
+    wall = time.perf_counter() - t0
+    for r in results:
+        if r["error"]:
+            print(f"[ERR ] {r['name']}: {r['error']}", file=sys.stderr)
+        else:
+            rev, cst, prf, prr = r["summary"]
+            print(f"[OK  ] {r['name']}: run_id={r.get('run_id')} revenue={rev:,.0f} "
+                  f"profit={prf:,.0f} ({prr:.1%}) {r['elapsed_s']:.1f}s", file=sys.stderr)
+    cpu = sum(r["elapsed_s"] for r in results)
+    print(f"[INFO] {len(results)} variants in {wall:.1f}s (sum of runs {cpu:.1f}s)", file=sys.stderr)
+    if args.out:
+        slim = [{k: v for k, v in r.items() if k not in ("nodes", "log")} for r in results]
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(slim, f, ensure_ascii=False, indent=2, default=str)
+    return 1 if any(r["error"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -146,6 +146,9 @@ def run_from_yaml(cfg: Dict[str,Any]) -> Dict[str,Any]:
     # アクション適用（C/V/M）
     for act in (cfg.get("actions") or []):
         _apply_action(conn, sid, act)
+    if cfg.get("actions"):
+        from pysi.evaluate.frame_cache import invalidate_frames
+        invalidate_frames(db)   # leadtime_set などで node_product を書いた
     # 計算：葉へS注入→冪等パス→書戻し
     mode = cfg.get("mode","leaf")
     if mode == "leaf":
@@ -187,10 +190,15 @@ def run_from_yaml(cfg: Dict[str,Any]) -> Dict[str,Any]:
     return out
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--config", required=True, help="YAML scenario file")
+    ap.add_argument("--config", required=True, nargs="+", help="YAML scenario file(s)")
+    ap.add_argument("--jobs", type=int, default=None, help="複数シナリオ / variants を並列実行（pysi.app.scenario_batch）")
     args = ap.parse_args()
     import yaml
-    cfg = yaml.safe_load(open(args.config, "r", encoding="utf-8"))
+    cfg = yaml.safe_load(open(args.config[0], "r", encoding="utf-8")) if len(args.config) == 1 else {}
+    if len(args.config) > 1 or args.jobs is not None or cfg.get("variants"):
+        from pysi.app.scenario_batch import _main as batch_main
+        argv = ["--config", *args.config] + (["--jobs", str(args.jobs)] if args.jobs else [])
+        raise SystemExit(batch_main(argv))
     run_from_yaml(cfg)
 if __name__ == "__main__":
     main()
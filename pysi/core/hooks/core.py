@@ -3,11 +3,15 @@
 # 使い方の要点：
 # run_once(cfg) の先頭で bus = HookBus(logger=logger) を作成 → set_global(bus) を呼ぶ → その後にプラグインをロード。
 # これにより、デコレータ方式（@action/@filter）と register(bus)方式のプラグインが同じBusに集まります。
+# フック/プラグイン別の所要時間は bus.enable_profiler() で計測（Pipeline が out_dir に profile.csv/json を出力）。
 
 from __future__ import annotations
 import importlib, pkgutil, traceback, sys
 from dataclasses import dataclass, field
-from typing import Any, Callable, Dict, List
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .profiler import HookProfiler
 
 # ---- HookBus ---------------------------------------------------------------
 
@@ -24,16 +28,40 @@ class HookBus:
     def __init__(self, logger=None) -> None:
         self._actions: Dict[str, List[_CB]] = {}
         self._filters: Dict[str, List[_CB]] = {}
+        # 実行用のコンパイル済みチェーン（name -> ((fn, src), ...)）。登録時にだけ作り直す
+        self._action_chain: Dict[str, Tuple[Tuple[Callback, str], ...]] = {}
+        self._filter_chain: Dict[str, Tuple[Tuple[Callback, str], ...]] = {}
+        # 計測（None なら計測なし。有効時はフック/プラグイン別に時間・回数・例外を記録）
+        self.profiler: Optional[HookProfiler] = None
         self.logger = logger
 
     # -- register -------------------------------------------------------------
     def add_action(self, name: str, fn: Callback, priority: int = 50) -> None:
         self._actions.setdefault(name, []).append(_CB(priority, fn, _src_of(fn)))
         self._actions[name].sort()
+        self._action_chain[name] = _compile(self._actions[name])
 
     def add_filter(self, name: str, fn: Callback, priority: int = 50) -> None:
         self._filters.setdefault(name, []).append(_CB(priority, fn, _src_of(fn)))
         self._filters[name].sort()
+        self._filter_chain[name] = _compile(self._filters[name])
+
+    # -- timing / profiling (opt-in) -----------------------------------------
+    def enable_profiler(self, on: bool = True) -> Optional[HookProfiler]:
+        """フック/プラグイン別の計測を開始（on=False で停止）。開始時は新しい集計になる。"""
+        self.profiler = HookProfiler() if on else None
+        return self.profiler
+
+    def enable_timing(self, on: bool = True) -> None:
+        """フック別の呼び出し回数・所要時間の計測（enable_profiler の別名）"""
+        self.enable_profiler(on)
+
+    def hook_timings(self) -> Dict[str, Dict[str, float]]:
+        """{name: {"calls": n, "total_s": sec}}（購読者のいないフックは数えない）"""
+        if self.profiler is None:
+            return {}
+        return {r["hook"]: {"calls": r["calls"], "total_s": r["total_s"]}
+                for r in self.profiler.summary()["hooks"]}
 
     # -- run ------------------------------------------------------------------
     def do_action(self, name: str, **ctx: Any) -> None:
@@ -42,21 +70,46 @@ class HookBus:
         - AttributeError（典型: obj.get が無い等）は犯人プラグイン特定のため詳細ログを出し、再送出して早期に気付けるようにする
         - その他の例外は従来どおり握り潰してコア継続（ログは出力）
         """
-        for cb in sorted(self._actions.get(name, [])):
+        chain = self._action_chain.get(name)
+        if not chain:
+            return
+        if self.profiler is not None:
+            self._do_action_profiled(name, chain, ctx)
+            return
+        for fn, src in chain:
             try:
-                cb.fn(**ctx)
-            except AttributeError as e:
+                fn(**ctx)
+            except AttributeError:
                 # ここで犯人を特定できる詳細トレースを出す
-                print(
-                    f"[HOOK ERROR] action={name} plugin="
-                    f"{getattr(cb.fn, '__module__', '?')}.{getattr(cb.fn, '__name__', '?')}"
-                )
-                traceback.print_exc()
                 # AttributeError は再送出して落として原因を表面化
+                _report_attribute_error("action", name, fn)
                 raise
             except Exception:
                 # それ以外は従来どおりログして継続
-                _print_exc(f"[hooks] action '{name}' failed in {cb.src}", logger=self.logger)
+                _print_exc(f"[hooks] action '{name}' failed in {src}", logger=self.logger)
+
+    def _do_action_profiled(self, name: str, chain, ctx: Dict[str, Any]) -> None:
+        prof = self.profiler
+        t0 = perf_counter()
+        errors = 0
+        try:
+            for fn, src in chain:
+                t1 = perf_counter()
+                try:
+                    fn(**ctx)
+                except AttributeError:
+                    errors += 1
+                    prof.record_callback(name, src, perf_counter() - t1, error=True)
+                    _report_attribute_error("action", name, fn)
+                    raise
+                except Exception:
+                    errors += 1
+                    prof.record_callback(name, src, perf_counter() - t1, error=True)
+                    _print_exc(f"[hooks] action '{name}' failed in {src}", logger=self.logger)
+                else:
+                    prof.record_callback(name, src, perf_counter() - t1)
+        finally:
+            prof.record_hook(name, perf_counter() - t0, errors)
 
     def apply_filters_OLD(self, name: str, value: Any, **ctx: Any) -> Any:
         out = value
@@ -70,27 +123,54 @@ class HookBus:
 
 
     def apply_filters(self, name: str, value: Any, **ctx: Any) -> Any:
+        chain = self._filter_chain.get(name)
+        if not chain:
+            return value
+        if self.profiler is not None:
+            return self._apply_filters_profiled(name, chain, value, ctx)
         out = value
-        for cb in self._filters.get(name, []):
+        for fn, src in chain:
             try:
-                out = cb.fn(out, **ctx)
+                out = fn(out, **ctx)
             except AttributeError:
                 # ここで犯人を特定
-                print(
-                    f"[HOOK ERROR] filter={name} plugin="
-                    f"{getattr(cb.fn, '__module__', '?')}.{getattr(cb.fn, '__name__', '?')}"
-                )
-                traceback.print_exc()
                 # AttributeError は再送出（早く直すべき型の不一致）
+                _report_attribute_error("filter", name, fn)
                 raise
             except Exception:
-                _print_exc(f"[hooks] filter '{name}' failed in {cb.src}", logger=self.logger)
+                _print_exc(f"[hooks] filter '{name}' failed in {src}", logger=self.logger)
+        return out
+
+    def _apply_filters_profiled(self, name: str, chain, value: Any, ctx: Dict[str, Any]) -> Any:
+        prof = self.profiler
+        t0 = perf_counter()
+        errors = 0
+        out = value
+        try:
+            for fn, src in chain:
+                t1 = perf_counter()
+                try:
+                    out = fn(out, **ctx)
+                except AttributeError:
+                    errors += 1
+                    prof.record_callback(name, src, perf_counter() - t1, error=True)
+                    _report_attribute_error("filter", name, fn)
+                    raise
+                except Exception:
+                    errors += 1
+                    prof.record_callback(name, src, perf_counter() - t1, error=True)
+                    _print_exc(f"[hooks] filter '{name}' failed in {src}", logger=self.logger)
+                else:
+                    prof.record_callback(name, src, perf_counter() - t1)
+        finally:
+            prof.record_hook(name, perf_counter() - t0, errors)
         return out
 
 
 
 
 
+
 # ---- decorators ------------------------------------------------------------
 
 def action(name: str, priority: int = 50) -> Callable[[Callback], Callback]:
@@ -125,11 +205,22 @@ def autoload_plugins(package: str = "pysi.plugins") -> None:
 
 # ---- utils -----------------------------------------------------------------
 
+def _compile(cbs: List[_CB]) -> Tuple[Tuple[Callback, str], ...]:
+    """優先度順に並んだ _CB を実行用の (fn, src) タプル列に固める"""
+    return tuple((cb.fn, cb.src) for cb in cbs)
+
 def _src_of(fn: Callback) -> str:
     mod = getattr(fn, "__module__", "?")
     name = getattr(fn, "__name__", "?")
     return f"{mod}:{name}"
 
+def _report_attribute_error(kind: str, name: str, fn: Callback) -> None:
+    print(
+        f"[HOOK ERROR] {kind}={name} plugin="
+        f"{getattr(fn, '__module__', '?')}.{getattr(fn, '__name__', '?')}"
+    )
+    traceback.print_exc()
+
 def _print_exc(msg: str, logger=None) -> None:
     if logger is not None:
         logger.exception(msg)
@@ -0,0 +1,119 @@
+# pysi/core/hooks/profiler.py
+# HookBus / Pipeline 用の簡易プロファイラ
+#
+# - フック名 × プラグイン(src) ごとに 呼び出し回数 / 所要時間 / 例外数 を記録
+# - Pipeline.run の段（timebase, data_load, tree_build, psi_build, weekly_loop, exporters）を計測
+# - write_report(out_dir) で <out_dir>/profile.csv と profile.json を出力（kpi.csv の隣）
+#
+# 無効時（bus.profiler is None）は HookBus 側の分岐 1 回だけでコストは実質ゼロ。
+#
+#使い方
+#
+#prof = bus.enable_profiler()
+#Pipeline(bus, io, logger).run(...)   # out_dir に profile.csv / profile.json が出る
+#print(prof.summary()["hooks"])
+
+from __future__ import annotations
+import csv
+import json
+import os
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Tuple
+
+REPORT_CSV = "profile.csv"
+REPORT_JSON = "profile.json"
+
+
+class HookProfiler:
+    """フック/プラグイン/段ごとの [calls, seconds, errors] を溜める入れ物"""
+
+    def __init__(self) -> None:
+        # (hook, src) -> [calls, seconds, errors]
+        self._cb: Dict[Tuple[str, str], List[float]] = {}
+        # hook -> [calls, seconds, errors]（フック全体。購読者の合計より外側で計測）
+        self._hooks: Dict[str, List[float]] = {}
+        # stage -> [calls, seconds]
+        self._stages: Dict[str, List[float]] = {}
+        self._stage_order: List[str] = []
+
+    # -- 記録 -----------------------------------------------------------------
+    def record_callback(self, hook: str, src: str, seconds: float, error: bool = False) -> None:
+        rec = self._cb.get((hook, src))
+        if rec is None:
+            rec = self._cb[(hook, src)] = [0, 0.0, 0]
+        rec[0] += 1
+        rec[1] += seconds
+        if error:
+            rec[2] += 1
+
+    def record_hook(self, hook: str, seconds: float, errors: int = 0) -> None:
+        rec = self._hooks.get(hook)
+        if rec is None:
+            rec = self._hooks[hook] = [0, 0.0, 0]
+        rec[0] += 1
+        rec[1] += seconds
+        rec[2] += errors
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            rec = self._stages.get(name)
+            if rec is None:
+                rec = self._stages[name] = [0, 0.0]
+                self._stage_order.append(name)
+            rec[0] += 1
+            rec[1] += perf_counter() - t0
+
+    def reset(self) -> None:
+        self.__init__()
+
+    # -- 集計 -----------------------------------------------------------------
+    def summary(self) -> Dict[str, List[Dict[str, Any]]]:
+        """{"stages": [...], "hooks": [...], "plugins": [...], "callbacks": [...]}（時間の降順）"""
+        plugins: Dict[str, List[float]] = {}
+        for (_, src), (n, t, e) in self._cb.items():
+            rec = plugins.setdefault(src, [0, 0.0, 0])
+            rec[0] += n; rec[1] += t; rec[2] += e
+
+        def rows(d, key):
+            out = [{key: k, "calls": int(v[0]), "total_s": v[1], "errors": int(v[2])}
+                   for k, v in d.items()]
+            out.sort(key=lambda r: (-r["total_s"], str(r[key])))
+            return out
+
+        callbacks = [{"hook": h, "src": s, "calls": int(v[0]), "total_s": v[1], "errors": int(v[2])}
+                     for (h, s), v in self._cb.items()]
+        callbacks.sort(key=lambda r: (-r["total_s"], r["hook"], r["src"]))
+        return {
+            "stages": [{"stage": s, "calls": int(self._stages[s][0]), "total_s": self._stages[s][1]}
+                       for s in self._stage_order],
+            "hooks": rows(self._hooks, "hook"),
+            "plugins": rows(plugins, "src"),
+            "callbacks": callbacks,
+        }
+
+    def write_report(self, out_dir: str) -> Dict[str, str]:
+        """<out_dir>/profile.csv（縦持ち）と profile.json を書く。戻り値は出力パス。"""
+        os.makedirs(out_dir, exist_ok=True)
+        summ = self.summary()
+        p_json = os.path.join(out_dir, REPORT_JSON)
+        with open(p_json, "w", encoding="utf-8") as f:
+            json.dump(summ, f, ensure_ascii=False, indent=2)
+
+        p_csv = os.path.join(out_dir, REPORT_CSV)
+        with open(p_csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["kind", "name", "src", "calls", "total_s", "errors"])
+            for r in summ["stages"]:
+                w.writerow(["stage", r["stage"], "", r["calls"], f"{r['total_s']:.6f}", ""])
+            for r in summ["hooks"]:
+                w.writerow(["hook", r["hook"], "", r["calls"], f"{r['total_s']:.6f}", r["errors"]])
+            for r in summ["plugins"]:
+                w.writerow(["plugin", "", r["src"], r["calls"], f"{r['total_s']:.6f}", r["errors"]])
+            for r in summ["callbacks"]:
+                w.writerow(["callback", r["hook"], r["src"], r["calls"], f"{r['total_s']:.6f}", r["errors"]])
+        return {"csv": p_csv, "json": p_json}
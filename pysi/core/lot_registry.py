@@ -0,0 +1,245 @@
+# pysi/core/lot_registry.py
+# lot の属性（出所ノード / 製品 / ISO 年・週 / 連番 / 賞味期限週）を整数ハンドルで引く列指向の台帳
+#
+# 旧: 年別集計・検証・出荷先判定のたびに lot_ID 文字列を部分一致や末尾スライスで解析
+#     （count_lots_yyyy は 年 × 全 lot の `yyyy in lot` 走査）
+# 新: lot は LotInterner のハンドル（PSIStore と同じ番号）で識別し、属性は numpy の列に 1 回だけ格納。
+#     - mint()        : 連番 lot をまとめて発番（文字列解析なし）
+#     - handles_of()  : 既存の lot_ID を登録（未解析のものだけ末尾 10 桁を 1 回解析）
+#     - parse_lot / count_lots_by_year_of : 登録せずに解析・年別集計（検証や単発の集計用）
+#   台帳と interner は持ち主（計画 / PSIStore のツリー）が作って持つ。プロセス共有の台帳は置かない
+#     - counts_by_year / counts_by_origin / counts_by_week / select : ベクトル化した集計・抽出
+#     - set_expiry / fefo_order : FEFO 用の期限週
+#
+# lot_ID 仕様は pysi.plan.validators と同じ:
+#   新: NODE-PRODUCT-YYYYWWNNNN / 旧: NODEYYYYWWNNNN（末尾 10 桁が数字）
+#
+#使い方
+#
+#reg = LotRegistry(root._psi_interner)               # attach_psi_store したツリーと同じハンドル
+#lots = reg.mint("CS_JPN", "RICE", 2026, 5, 12)      # ["CS_JPN-RICE-2026050001", ...]
+#h = reg.handles_of(lot for wk in psi for lot in wk[0])
+#reg.counts_by_year(h)                               # {2026: 12, ...}
+
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .psi_store import LotInterner
+
+LOT_SEP = "-"   # pysi.plan.validators.LOT_SEP と同じ
+NO_CODE = -1    # 製品なし（旧フォーマット）/ 期限なし / 解析不能
+
+
+def parse_lot(lot_id: str, sep: str = LOT_SEP) -> Optional[Tuple[str, Optional[str], int, int, int]]:
+    """(node, product_or_None, year, week, seq)。pysi.plan.validators.parse_lot_id と同じ規則（不正なら None）"""
+    if not isinstance(lot_id, str):
+        return None
+    tail = lot_id[-10:]
+    if len(tail) != 10 or not tail.isdigit():
+        return None
+    head = lot_id[:-10]
+    if sep in head:
+        parts = head.split(sep)
+        node, product = parts[0], (parts[1] if len(parts) >= 2 else None)
+    else:
+        node, product = head, None
+    return node, product, int(tail[:4]), int(tail[4:6]), int(tail[6:])
+
+
+def count_lots_by_year_of(lot_ids: Iterable[str]) -> Dict[int, int]:
+    """lot_ID 列の年別件数（解析不能は数えない）。interner には登録しない"""
+    out: Dict[int, int] = {}
+    for lot_id in lot_ids:
+        if isinstance(lot_id, str) and len(lot_id) >= 10 and lot_id[-10:].isdigit():
+            y = int(lot_id[-10:-6])
+            out[y] = out.get(y, 0) + 1
+    return out
+
+
+class LotRegistry:
+    """ハンドル h の行に lot 属性を持つ列指向表。行は interner のハンドル順。"""
+
+    _COLUMNS = (("_node", np.int32), ("_prod", np.int32), ("_year", np.int16),
+                ("_week", np.int8), ("_seq", np.int32), ("_expiry", np.int32))
+
+    def __init__(self, interner: Optional[LotInterner] = None, sep: str = LOT_SEP) -> None:
+        self.interner = interner if interner is not None else LotInterner()
+        self.sep = sep
+        self._n = 0          # 属性が埋まっている行数（= 解析済みハンドル数）
+        for col, dt in self._COLUMNS:
+            setattr(self, col, np.empty(0, dtype=dt))
+        self._node_names: List[str] = []
+        self._node_code: Dict[str, int] = {}
+        self._prod_names: List[str] = []
+        self._prod_code: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._n
+
+    # -- 内部: 列の確保とコード表 ------------------------------------------------
+    def _reserve(self, n: int) -> None:
+        cap = len(self._node)
+        if n <= cap:
+            return
+        new_cap = max(n, cap * 2, 1024)
+        for col, dt in self._COLUMNS:
+            old = getattr(self, col)
+            arr = np.full(new_cap, NO_CODE, dtype=dt)
+            arr[:cap] = old
+            setattr(self, col, arr)
+
+    def _code(self, name: Optional[str], names: List[str], codes: Dict[str, int]) -> int:
+        if name is None:
+            return NO_CODE
+        c = codes.get(name)
+        if c is None:
+            c = codes[name] = len(names)
+            names.append(name)
+        return c
+
+    def _parse(self, lot_id: str) -> Optional[Tuple[str, Optional[str], int, int, int]]:
+        return parse_lot(lot_id, self.sep)
+
+    def _sync(self) -> None:
+        """interner に増えたハンドル（PSIStore などが登録したもの）を解析して行を埋める"""
+        n = len(self.interner)
+        if n <= self._n:
+            return
+        self._reserve(n)
+        nc, pc = self._node_code, self._prod_code
+        nn, pn = self._node_names, self._prod_names
+        for h, lot_id in enumerate(self.interner.ids_of(range(self._n, n)), start=self._n):
+            rec = self._parse(lot_id)
+            if rec is None:
+                continue   # 列は NO_CODE のまま（_node < 0 が「解析不能」）
+            node, product, year, week, seq = rec
+            self._node[h] = self._code(node, nn, nc)
+            self._prod[h] = self._code(product, pn, pc)
+            self._year[h] = year
+            self._week[h] = week
+            self._seq[h] = seq
+        self._n = n
+
+    # -- 登録 -------------------------------------------------------------------
+    def mint(self, node: str, product: Optional[str], iso_year: int, iso_week: int,
+             count: int, *, start_seq: int = 1, expiry_week: Optional[int] = None) -> List[str]:
+        """
+        (node, product, 年, 週) の lot を連番で count 件発番して lot_ID を返す。
+        属性は発番時の値をそのまま列に入れる（文字列の解析はしない）。
+        """
+        if count <= 0:
+            return []
+        self._sync()
+        head = f"{node}{self.sep}{product}{self.sep}" if product else str(node)
+        yw = f"{int(iso_year):04d}{int(iso_week):02d}"
+        seqs = range(int(start_seq), int(start_seq) + int(count))
+        ids = [f"{head}{yw}{s:04d}" for s in seqs]
+        hs = np.asarray(self.interner.intern_many(ids), dtype=np.int64)
+        n = len(self.interner)
+        self._reserve(n)
+        self._node[hs] = self._code(str(node), self._node_names, self._node_code)
+        self._prod[hs] = self._code(product or None, self._prod_names, self._prod_code)
+        self._year[hs] = int(iso_year)
+        self._week[hs] = int(iso_week)
+        self._seq[hs] = np.fromiter(seqs, dtype=np.int32, count=len(ids))
+        if expiry_week is not None:
+            self._expiry[hs] = int(expiry_week)
+        self._n = n
+        return ids
+
+    def handles_of(self, lot_ids: Iterable[str]) -> np.ndarray:
+        """lot_ID 列 → ハンドル配列（未登録は登録し、属性を 1 回だけ解析）"""
+        hs = np.asarray(self.interner.intern_many(lot_ids), dtype=np.int64)
+        self._sync()
+        return hs
+
+    def lot_info(self, lot_id: str) -> Optional[Tuple[str, Optional[str], int, int, int]]:
+        """(node, product_or_None, year, week, seq)。解析不能なら None（未登録の lot は登録せずに解析）"""
+        h = self.interner.lookup(lot_id)
+        if h is None:
+            return self._parse(lot_id)
+        self._sync()
+        node = int(self._node[h])
+        if node < 0:
+            return None
+        prod = int(self._prod[h])
+        return (self._node_names[node], self._prod_names[prod] if prod >= 0 else None,
+                int(self._year[h]), int(self._week[h]), int(self._seq[h]))
+
+    # -- 列の参照 ---------------------------------------------------------------
+    def is_valid(self, handles: Sequence[int]) -> np.ndarray:
+        return self._node[np.asarray(handles, dtype=np.int64)] >= 0
+
+    def years(self, handles: Sequence[int]) -> np.ndarray:
+        return self._year[np.asarray(handles, dtype=np.int64)]
+
+    def weeks(self, handles: Sequence[int]) -> np.ndarray:
+        return self._week[np.asarray(handles, dtype=np.int64)]
+
+    def origin_names(self, handles: Sequence[int]) -> List[Optional[str]]:
+        names = self._node_names
+        return [names[c] if c >= 0 else None
+                for c in self._node[np.asarray(handles, dtype=np.int64)].tolist()]
+
+    # -- 集計 -------------------------------------------------------------------
+    @staticmethod
+    def _count(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if keys.size == 0:
+            return keys, np.zeros(0, dtype=np.int64)
+        return np.unique(keys, return_counts=True)
+
+    def counts_by_year(self, handles: Sequence[int]) -> Dict[int, int]:
+        h = np.asarray(handles, dtype=np.int64)
+        h = h[self._node[h] >= 0]
+        k, c = self._count(self._year[h])
+        return dict(zip(k.tolist(), c.tolist()))
+
+    def counts_by_origin(self, handles: Sequence[int]) -> Dict[str, int]:
+        h = np.asarray(handles, dtype=np.int64)
+        codes = self._node[h]
+        k, c = self._count(codes[codes >= 0])
+        names = self._node_names
+        return {names[i]: n for i, n in zip(k.tolist(), c.tolist())}
+
+    def counts_by_week(self, handles: Sequence[int]) -> Dict[Tuple[int, int], int]:
+        h = np.asarray(handles, dtype=np.int64)
+        h = h[self._node[h] >= 0]
+        k, c = self._count(self._year[h].astype(np.int32) * 100 + self._week[h])
+        return {(int(yw) // 100, int(yw) % 100): n for yw, n in zip(k.tolist(), c.tolist())}
+
+    def select(self, handles: Sequence[int], *, year: Optional[int] = None,
+               week: Optional[int] = None, origin: Optional[str] = None,
+               product: Optional[str] = None) -> np.ndarray:
+        """条件に合うハンドルだけを元の順序で返す"""
+        h = np.asarray(handles, dtype=np.int64)
+        mask = self._node[h] >= 0
+        if year is not None:
+            mask &= self._year[h] == int(year)
+        if week is not None:
+            mask &= self._week[h] == int(week)
+        if origin is not None:
+            mask &= self._node[h] == self._node_code.get(origin, -2)
+        if product is not None:
+            mask &= self._prod[h] == self._prod_code.get(product, -2)
+        return h[mask]
+
+    # -- FEFO -------------------------------------------------------------------
+    def set_expiry(self, handles: Sequence[int], expiry_week) -> None:
+        """期限週をまとめて設定（expiry_week はスカラーまたは handles と同じ長さ）"""
+        h = np.asarray(handles, dtype=np.int64)
+        self._sync()
+        self._expiry[h] = np.asarray(expiry_week, dtype=np.int32)
+
+    def expiry_of(self, handles: Sequence[int]) -> np.ndarray:
+        return self._expiry[np.asarray(handles, dtype=np.int64)]
+
+    def fefo_order(self, lot_ids: Sequence[str]) -> List[str]:
+        """期限週の早い順（期限なしは末尾）に並べた lot_ID。同じ期限内は元の順序"""
+        if not lot_ids:
+            return list(lot_ids)
+        exp = self._expiry[self.handles_of(lot_ids)].astype(np.int64)
+        exp[exp < 0] = np.iinfo(np.int64).max
+        return [lot_ids[i] for i in np.argsort(exp, kind="stable").tolist()]
+
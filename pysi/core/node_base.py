@@ -9,6 +9,11 @@ from collections import defaultdict
 from pysi.utils.file_io import read_tree_file
 
 from pysi.plan.operations import *
+#@251110 ADD: 配列バックエンド（PSIStore）
+from pysi.core.psi_store import LotInterner, PSIStore, bucket_counts
+from pysi.core.inventory_roll import roll_inventory
+from pysi.evaluate.tree_cost_eval import evaluate_nodes_cost
+from pysi.core.shift_map import compile_shift_map, apply_shift_map
 #from pysi.plan.operations import calcS2P, set_S2psi, get_set_childrenP2S2psi, shiftS2P_LV
 
 
@@ -22,70 +27,61 @@ from pysi.plan.operations import *
 #@250820 copied from pysi.pla.operations
 # 同一node内のS2Pの処理
 def shiftS2P_LV(psiS, shift_week, lv_week):  # LV:long vacations
-    # ss = safety_stock_week
-    sw = shift_week
+    # backward planningで需要を降順でシフト
+    # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする（シフト先は表で一括計算）
     plan_len = len(psiS) - 1  # -1 for week list position
-    for w in range(plan_len, sw, -1):  # backward planningで需要を降順でシフト
-        # my_list = [1, 2, 3, 4, 5]
-        # for i in range(2, len(my_list)):
-        #    my_list[i] = my_list[i-1] + my_list[i-2]
-        # 0:S
-        # 1:CO
-        # 2:I
-        # 3:P
-        eta_plan = w - sw  # sw:shift week (includung safty stock)
-        eta_shift = check_lv_week_bw(lv_week, eta_plan)  # ETA:Estimate Time Arrival
-        # リスト追加 extend
-        # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする
-        psiS[eta_shift][3].extend(psiS[w][0])  # P made by shifting S with
+    smap = compile_shift_map(len(psiS), shift_week, lv_week, "bw")  # ETA:Estimate Time Arrival
+    apply_shift_map(psiS, psiS, smap, range(plan_len, shift_week, -1), 0, 3)  # P made by shifting S
     return psiS
 # ************************************
 # checking constraint to inactive week , that is "Long Vacation"
 # ************************************
 def check_lv_week_bw(const_lst, check_week):
     num = check_week
-    if const_lst == []:
-        pass
-    else:
-        while num in const_lst:
+    if const_lst:
+        lv = set(const_lst)
+        while num in lv:
             num -= 1
     return num
 def check_lv_week_fw(const_lst, check_week):
     num = check_week
-    if const_lst == []:
-        pass
-    else:
-        while num in const_lst:
+    if const_lst:
+        lv = set(const_lst)
+        while num in lv:
             num += 1
     return num
 # ****************************
 # after demand leveling / planning outbound supply
 # ****************************
 def shiftS2P_LV_replace(psiS, shift_week, lv_week):  # LV:long vacations
-    # ss = safety_stock_week
-    sw = shift_week
     plan_len = len(psiS) - 1  # -1 for week list position
     for w in range(plan_len):  # foreward planningでsupplyのp [w][3]を初期化
         # psiS[w][0] = [] # S active
         psiS[w][1] = []  # CO
         psiS[w][2] = []  # I
         psiS[w][3] = []  # P
-    for w in range(plan_len, sw, -1):  # backward planningでsupplyを降順でシフト
-        # my_list = [1, 2, 3, 4, 5]
-        # for i in range(2, len(my_list)):
-        #    my_list[i] = my_list[i-1] + my_list[i-2]
-        # 0:S
-        # 1:CO
-        # 2:I
-        # 3:P
-        eta_plan = w - sw  # sw:shift week ( including safty stock )
-        eta_shift = check_lv_week_bw(lv_week, eta_plan)  # ETA:Eatimate Time Arrival
-        # リスト追加 extend
-        # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする
-        psiS[eta_shift][3].extend(psiS[w][0])  # P made by shifting S with
+    # backward planningでsupplyを降順でシフト（シフト先は休暇補正済みの表から）
+    smap = compile_shift_map(len(psiS), shift_week, lv_week, "bw")  # ETA:Eatimate Time Arrival
+    apply_shift_map(psiS, psiS, smap, range(plan_len, shift_week, -1), 0, 3)  # P made by shifting S
     return psiS
-
 class Node:
+    #@251110 ADD: 差分再計画用の dirty フラグ
+    # 計画後に leadtime / SS_days / long_vacation_weeks を変えるときは set_plan_params() を使う。
+    # S の投入（set_S2psi）も dirty を立てる。S を直接編集したら mark_psi_dirty() を呼ぶ。
+    # （属性代入のフックは最頻出オブジェクトの全代入を遅くするので置かない）
+    _PLAN_PARAMS = ("leadtime", "SS_days", "long_vacation_weeks")
+    _psi_dirty = False
+    def mark_psi_dirty(self):
+        """S を直接編集したときなど、set_plan_params / set_S2psi を通らない変更の後に呼ぶ"""
+        self._psi_dirty = True
+    def set_plan_params(self, **params):
+        """leadtime / SS_days / long_vacation_weeks を更新し、値が変わったら dirty を立てる"""
+        for name, value in params.items():
+            if name not in self._PLAN_PARAMS:
+                raise TypeError(f"unknown plan parameter: {name}")
+            if getattr(self, name, None) != value:
+                setattr(self, name, value)
+                self._psi_dirty = True
     def __init__(self, name: str):
         self.name = name
         self.children: List['Node'] = []
@@ -526,7 +522,7 @@ class Node:
         # 既存の配列を保全したい場合に備えて待避
         old_d = getattr(self, "psi4demand", None)
         old_s = getattr(self, "psi4supply", None)
-        old_len = len(old_d) if isinstance(old_d, list) else 0
+        old_len = len(old_d) if old_d is not None else 0
         self.plan_year_st = int(plan_year_st)
         # plan_range は表示や既存互換のため保持（ロジックは配列長で回す）
         self.plan_range   = max(1, math.ceil(weeks_count / 53))
@@ -548,12 +544,68 @@ class Node:
             self.psi4demand = [[[], [], [], []] for _ in range(weeks_count)]
             self.psi4supply = [[[], [], [], []] for _ in range(weeks_count)]
         self.lot_counts = [0] * weeks_count
+        # PSIStore を使っていたノードは新しい器でも配列バックエンドに戻す
+        layers = getattr(self, "_psi_store_layers", None)
+        if layers:
+            self.attach_psi_store(layers, interner=getattr(self, "_psi_interner", None), recursive=False)
         # 子にも同じ weeks_count / plan_year_st を伝搬
         for child in self.children:
             child.set_plan_range_by_weeks(weeks_count, plan_year_st, preserve=preserve)
     # ユーティリティ（ループ長は常に実週長を返す）
     def plan_len(self) -> int:
         return len(self.psi4demand)
+    #@251110 ADD: PSIStore（配列バックエンド）への切替
+    _PSI_LAYER_ATTRS = {
+        "demand": "psi4demand",
+        "supply": "psi4supply",
+        "couple": "psi4couple",
+        "accume": "psi4accume",
+    }
+    def attach_psi_store(self, layers=("demand", "supply", "couple", "accume"),
+                         interner=None, recursive: bool = True):
+        """
+        psi4xxx を PSIStore に載せ替え、互換ビュー（psi[w][b]）を差し込む。
+        既存の lot_ID はそのまま引き継ぐ。数量は store.counts から O(1) で取れる。
+        interner を省略すると、このツリー専用の LotInterner を作って子にも渡す
+        （ツリーを捨てれば lot 表も一緒に解放される）。
+        """
+        if interner is None:
+            interner = getattr(self, "_psi_interner", None)
+        if interner is None:
+            interner = LotInterner()
+        self._psi_interner = interner
+        for layer in layers:
+            attr = self._PSI_LAYER_ATTRS[layer]
+            psi = getattr(self, attr, None)
+            if psi is None:
+                continue
+            if isinstance(getattr(psi, "store", None), PSIStore):
+                continue
+            setattr(self, attr, PSIStore.from_nested(psi, interner=interner).view())
+        self._psi_store_layers = tuple(layers)
+        if recursive:
+            for child in self.children:
+                child.attach_psi_store(layers, interner=interner, recursive=True)
+    def detach_psi_store(self, recursive: bool = True):
+        """PSIStore から従来の list-of-lists に戻す（pickle や旧ツール向け）"""
+        for attr in self._PSI_LAYER_ATTRS.values():
+            store = getattr(getattr(self, attr, None), "store", None)
+            if isinstance(store, PSIStore):
+                setattr(self, attr, store.to_nested())
+        self._psi_store_layers = None
+        self._psi_interner = None
+        if recursive:
+            for child in self.children:
+                child.detach_psi_store(recursive=True)
+    def compact_psi_store(self, recursive: bool = True):
+        """計画ステップの区切りでオーバーレイを CSR へ畳み込む"""
+        for attr in self._PSI_LAYER_ATTRS.values():
+            store = getattr(getattr(self, attr, None), "store", None)
+            if isinstance(store, PSIStore):
+                store.compact()
+        if recursive:
+            for child in self.children:
+                child.compact_psi_store(recursive=True)
     #@250818 ADD
     def set_plan_range_all_buffers(self, plan_range, plan_year_st):
         self.set_plan_range_lot_counts(plan_range, plan_year_st)
@@ -573,6 +625,23 @@ class Node:
             # 置き換えにしたい場合は次の1行に：
             # self.psi4demand[w][0] = list(pSi[w])
             self.psi4demand[w][0].extend(pSi[w])
+        self._psi_dirty = True
+    def lv_shift_map(self, kind: str = "S2P", n_weeks: Optional[int] = None):
+        """
+        このノードの休暇補正済み週シフト表（元の週 → シフト先の週の int 配列）。
+        S2P: round(SS_days/7) 週 手前へ / P2S: leadtime 週 後ろへ / P2childS: leadtime 週 手前へ
+        SS_days・leadtime・long_vacation_weeks が同じなら共有キャッシュから返る。
+        """
+        if n_weeks is None:
+            n_weeks = len(self.psi4demand)
+        lv_week = self.long_vacation_weeks
+        if kind == "S2P":
+            return compile_shift_map(n_weeks, int(round(self.SS_days / 7)), lv_week, "bw")
+        if kind == "P2S":
+            return compile_shift_map(n_weeks, self.leadtime, lv_week, "fw")
+        if kind == "P2childS":
+            return compile_shift_map(n_weeks, self.leadtime, lv_week, "bw")
+        raise ValueError(f"unknown shift kind={kind}")
     def calcS2P(self): # backward planning
         # **************************
         # Safety Stock as LT shift
@@ -683,83 +752,14 @@ class Node:
     # ******************************
     #@250818 ADD
     def set_lot_counts(self):
-        # supply の実長を基準にする
-        plan_len = len(self.psi4supply)
-        # lot_counts の長さを合わせる（足りなければ伸ばす／長ければ切る）
-        if len(getattr(self, "lot_counts", [])) != plan_len:
-            self.lot_counts = [0 for _ in range(plan_len)]
-        for w in range(plan_len):
-            self.lot_counts[w] = len(self.psi4supply[w][3])  # P
+        # supply の実長を基準にする（PSIStore なら counts 配列から O(1)/週）
+        self.lot_counts = bucket_counts(self.psi4supply, 3)  # P
         self.lot_counts_all = sum(self.lot_counts)
     def EvalPlanSIP_cost(self):
-        L = self.lot_counts_all    # nodeの全ロット数 # psi[w][3]=PO
-        # evaluated cost = Cost Structure X lot_counts
-        self.eval_cs_price_sales_shipped    = L * self.cs_price_sales_shipped
-        self.eval_cs_cost_total             = L * self.cs_cost_total
-        self.eval_cs_profit                 = L * self.cs_profit
-        self.eval_cs_marketing_promotion    = L * self.cs_marketing_promotion
-        self.eval_cs_sales_admin_cost       = L * self.cs_sales_admin_cost
-        self.eval_cs_SGA_total              = L * self.cs_SGA_total
-        self.eval_cs_logistics_costs        = L * self.cs_logistics_costs
-        self.eval_cs_warehouse_cost         = L * self.cs_warehouse_cost
-        self.eval_cs_direct_materials_costs = L * self.cs_direct_materials_costs
-        #self.eval_cs_custom_tax             = L * self.cs_custom_tax # STOP
-        #@ RUN
-        self.eval_cs_tax_portion            = L * self.cs_tax_portion
-        print(" L = self.lot_counts_all", L )
-        print("self.cs_price_sales_shipped   ", self.cs_price_sales_shipped    )
-        print("self.cs_cost_total            ", self.cs_cost_total             )
-        print("self.cs_profit                ", self.cs_profit                 )
-        print("self.cs_marketing_promotion   ", self.cs_marketing_promotion    )
-        print("self.cs_sales_admin_cost      ", self.cs_sales_admin_cost       )
-        print("self.cs_SGA_total             ", self.cs_SGA_total              )
-        print("self.cs_logistics_costs       ", self.cs_logistics_costs        )
-        print("self.cs_warehouse_cost        ", self.cs_warehouse_cost         )
-        print("self.cs_direct_materials_costs", self.cs_direct_materials_costs )
-        #@STOP normalize_costで定義済み
-        # ****************************
-        # custom_tax = materials_cost imported X custom_tariff
-        # ****************************
-        #self.eval_cs_tax_portion            = self.eval_cs_direct_materials_costs * self.customs_tariff_rate
-        self.eval_cs_purchase_total_cost    = L * self.cs_purchase_total_cost
-        self.eval_cs_prod_indirect_labor    = L * self.cs_prod_indirect_labor
-        self.eval_cs_prod_indirect_others   = L * self.cs_prod_indirect_others
-        self.eval_cs_direct_labor_costs     = L * self.cs_direct_labor_costs
-        self.eval_cs_depreciation_others    = L * self.cs_depreciation_others
-        self.eval_cs_manufacturing_overhead = L * self.cs_manufacturing_overhead
-        # 在庫係数の計算
-        I_total_qty_planned, I_total_qty_init = self.I_lot_counts_all()
-        if I_total_qty_init == 0:
-            I_cost_coeff = 0
-        else:
-            I_cost_coeff =  I_total_qty_planned / I_total_qty_init
-        print("self.name",self.name)
-        print("I_total_qty_planned", I_total_qty_planned)
-        print("I_total_qty_init", I_total_qty_init)
-        print("I_cost_coeff", I_cost_coeff)
-        # 在庫の増減係数を掛けてセット
-        print("self.eval_cs_warehouse_cost", self.eval_cs_warehouse_cost)
-        self.eval_cs_warehouse_cost *= ( 1 + I_cost_coeff )
-        print("self.eval_cs_warehouse_cost", self.eval_cs_warehouse_cost)
-        self.eval_cs_cost_total = (
-            self.eval_cs_marketing_promotion +
-            self.eval_cs_sales_admin_cost +
-            #self.eval_cs_SGA_total +
-            #self.eval_cs_custom_tax +
-            self.eval_cs_tax_portion +
-            self.eval_cs_logistics_costs +
-            self.eval_cs_warehouse_cost +
-            self.eval_cs_direct_materials_costs +
-            #self.eval_cs_purchase_total_cost +
-            self.eval_cs_prod_indirect_labor +
-            self.eval_cs_prod_indirect_others +
-            self.eval_cs_direct_labor_costs +
-            self.eval_cs_depreciation_others #@END +
-            #self.eval_cs_manufacturing_overhead
-        )
-        # profit = revenue - cost
-        self.eval_cs_profit = self.eval_cs_price_sales_shipped - self.eval_cs_cost_total
-        return self.eval_cs_price_sales_shipped, self.eval_cs_profit
+        # evaluated cost = Cost Structure X lot_counts（L = self.lot_counts_all）
+        # 計算式はツリー一括評価（pysi.evaluate.tree_cost_eval）と共通
+        res = evaluate_nodes_cost([self], count_lots=False)
+        return float(res.revenue[0]), float(res.profit[0])
     # *****************************
     # ここでCPU_LOTsを抽出する
     # *****************************
@@ -796,17 +796,8 @@ class Node:
     # ******************************
     #@250818 UPDATE
     def calcPS2I4demand(self):
-        plan_len = len(self.psi4demand)
-        for w in range(1, plan_len):
-            s  = self.psi4demand[w][0]
-            co = self.psi4demand[w][1]
-            i0 = self.psi4demand[w - 1][2]
-            i1 = self.psi4demand[w][2]
-            p  = self.psi4demand[w][3]
-            # I(n-1)+P(n)-S(n) を順序は気にせず差分で表現
-            work = i0 + p
-            diff_list = [x for x in work if x not in s]
-            self.psi4demand[w][2] = diff_list
+        # I(n-1)+P(n)-S(n) を FIFO 順で（S は set 化して 1 パス）
+        roll_inventory(self.psi4demand)
     # *********************************
     # #@250626 TEST DATA DUMP4ALLOCATION
     # *********************************
@@ -824,30 +815,8 @@ class Node:
             print("s = self.psi4demand[w][0]", w, s, "&[w][3]", p, "&[w][2]", i1)
     #@250818 UPDATE
     def calcPS2I4supply(self):
-        plan_len = len(self.psi4supply)
-        for w in range(1, plan_len):
-            s  = self.psi4supply[w][0]
-            co = self.psi4supply[w][1]
-            i0 = self.psi4supply[w - 1][2]
-            i1 = self.psi4supply[w][2]
-            p  = self.psi4supply[w][3]
-            def fifo_lot_diff(i0: list, p: list, s: list) -> list:
-                work = i0 + p  # 順序保持
-                result, used = [], set()
-                for lot in work:
-                    if lot not in s and lot not in used:
-                        result.append(lot); used.add(lot)
-                return result
-            diff_list = fifo_lot_diff(i0, p, s)
-            self.psi4supply[w][2] = diff_list
-            if self.name == "DADCAL":
-                if w < 58:
-                    print("s, co, i0, i1, p ", w)
-                    print("s" , w, s )
-                    print("co", w, co)
-                    print("i0", w, i0)
-                    print("i1", w, diff_list)
-                    print("p" , w, p )
+        # 供給側は i0 + p の重複を先着 1 件に寄せる（旧 fifo_lot_diff と同じ）
+        roll_inventory(self.psi4supply, dedup=True)
     #@250818 UPDATE
     def calcPS2I_decouple4supply(self):
         # まず長さを揃える：supply を demand に合わせる
@@ -859,15 +828,7 @@ class Node:
         for w in range(plan_len):
             self.psi4supply[w][0] = self.psi4demand[w][0].copy()
         # その上で supply 側の PS→I を計算
-        for w in range(1, plan_len):
-            s  = self.psi4supply[w][0]
-            co = self.psi4supply[w][1]
-            i0 = self.psi4supply[w - 1][2]
-            i1 = self.psi4supply[w][2]
-            p  = self.psi4supply[w][3]
-            work = i0 + p
-            diff_list = [x for x in work if x not in s]
-            self.psi4supply[w][2] = diff_list
+        roll_inventory(self.psi4supply)
     def calcS2P(self): # backward planning
         # **************************
         # Safety Stock as LT shift
@@ -915,11 +876,8 @@ class Node:
         lot_all_demand = 0
         # どちらも参照するので min（両者を同長に保っているなら len(self.psi4demand) でもOK）
         plan_len = min(len(self.psi4demand), len(self.psi4supply))
-        lot_counts_I_supply = [0] * plan_len
-        lot_counts_I_demand = [0] * plan_len
-        for w in range(plan_len):
-            lot_counts_I_supply[w] = len(self.psi4supply[w][2])  # I
-            lot_counts_I_demand[w] = len(self.psi4demand[w][2])  # I
+        lot_counts_I_supply = bucket_counts(self.psi4supply, 2)[:plan_len]  # I
+        lot_counts_I_demand = bucket_counts(self.psi4demand, 2)[:plan_len]  # I
         if self.name == "HAM":
             print("lot_counts_I_supply", lot_counts_I_supply)
         lot_all_supply = sum(lot_counts_I_supply)
@@ -4,7 +4,7 @@
 
 from __future__ import annotations
 from typing import Dict, List, Tuple, Callable, Any
-from .psi_state import PSI_S, PSI_CO, PSI_I, PSI_P
+from .psi_state import PSI_S, PSI_CO, PSI_I, PSI_P, as_event_queue, move_lots
 
 # ===== demand_generate.py と同じ規約を流用 =====
 LOT_SEP = "-"  # node/product に使わない安全な区切り
@@ -104,21 +104,14 @@ def _normalize_lot_ids(lots: List[Any]) -> List[str]:
     return out
 
 # ---- PSI 操作（リストの移動: list-of-IDs前提）---------------------------------
-def _move_ids(src_list: List[str], dst_list: List[str], ids: List[str]) -> None:
+def _move_ids(src_list: List[str], dst_list: List[str], ids: List[str]) -> int:
     """
-    src_list から ids を個数分だけ“1個ずつ”削除し、dst_list に同数追加する。
-    （multiset のように扱う）
+    src_list から ids を個数分だけ削除し、dst_list に同数追加する（multiset）。
+    src_list は 1 パスで詰め直す（list.remove の繰り返しはしない）。
+    戻り値: src_list に見つからなかった lot 数（dst には冪等性優先でそのまま積む）
     """
-    if not ids:
-        return
     # CO や P は「週 from」に積まれているはずなので、そこから剥がすイメージ
-    for lid in ids:
-        try:
-            src_list.remove(lid)  # 初回一致のみ除去（1個だけ）
-        except ValueError:
-            # 見つからなければスキップ（冪等性を優先）
-            pass
-        dst_list.append(lid)
+    return move_lots(src_list, dst_list, ids)
 
 # ---- demand 層: shipments → S と CO(→Iは settle で) --------------------------
 def commit_shipments_to_demand_psi(alloc: dict, state: dict, params: dict, **ctx):
@@ -156,9 +149,9 @@ def commit_shipments_to_demand_psi(alloc: dict, state: dict, params: dict, **ctx
         if psi_dst is not None:
             psi_dst[w_ship][PSI_CO].extend(ids)
 
-        # 4) 到着イベントを積む
+        # 4) 到着イベントを積む（to_week 別キュー）
         arr_w = w_ship + int(lt_edge.get((src, dst, sku), 0))
-        state["scheduled"].append({
+        as_event_queue(state).append({
             "type": "receive_demand",
             "dst": dst,
             "sku": sku,
@@ -211,9 +204,9 @@ def commit_replenishment_to_supply_psi(alloc: dict, state: dict, params: dict, *
             psi_node[w_order][PSI_P].extend(ids)
             psi_node[w_order][PSI_CO].extend(ids)
 
-        # 生産完了イベント
+        # 生産完了イベント（to_week 別キュー）
         done_w = w_order + int(prod_lead.get((node, sku), 0))
-        state["scheduled"].append({
+        as_event_queue(state).append({
             "type": "produce_supply",
             "node": node,
             "sku": sku,
@@ -223,20 +216,22 @@ def commit_replenishment_to_supply_psi(alloc: dict, state: dict, params: dict, *
         })
 
 # ---- 週頭のイベント決済（CO/P → I）-------------------------------------------
-def settle_scheduled_events_dual(state: dict, week_idx: int):
+def settle_scheduled_events_dual(state: dict, week_idx: int) -> int:
     """
-    週頭に scheduled を走査し、to_week == week_idx のイベントを決済。
+    週頭に to_week == week_idx のイベントだけを取り出して決済。
       - demand: CO[from] → I[to]
       - supply: (P[from],CO[from]) → I[to]
+    state["scheduled"] が旧形式の list[dict] でも、初回に ScheduledEvents へ変換して受け付ける。
+    戻り値: 移動元バケツに見つからなかった lot 数の合計。
+            累計は state["settle_missing_lots"] にも積む（黙って捨てない）。
     """
+    events = as_event_queue(state).pop_week(week_idx)
+    if not events:
+        return 0
+    missing = 0
     psiD = state["psi_demand"]
     psiS = state["psi_supply"]
-    rest = []
-    for ev in state.get("scheduled", []):
-        if int(ev.get("to_week", -1)) != int(week_idx):
-            rest.append(ev)
-            continue
-
+    for ev in events:
         lots: List[str] = list(ev.get("lots", []))
         if not lots:
             continue
@@ -247,7 +242,7 @@ def settle_scheduled_events_dual(state: dict, week_idx: int):
             psi = psiD.get((dst, sku))
             if psi is not None:
                 # CO[w_from] から I[w_to] へIDを移動
-                _move_ids(psi[w_from][PSI_CO], psi[w_to][PSI_I], lots)
+                missing += _move_ids(psi[w_from][PSI_CO], psi[w_to][PSI_I], lots)
 
         elif ev["type"] == "produce_supply":
             node = ev["node"]; sku = ev["sku"]
@@ -255,7 +250,9 @@ def settle_scheduled_events_dual(state: dict, week_idx: int):
             psi = psiS.get((node, sku))
             if psi is not None:
                 # P[w_from] / CO[w_from] から I[w_to] へIDを移動
-                _move_ids(psi[w_from][PSI_P],  psi[w_to][PSI_I], lots)
-                _move_ids(psi[w_from][PSI_CO], psi[w_to][PSI_I], lots)
+                missing += _move_ids(psi[w_from][PSI_P],  psi[w_to][PSI_I], lots)
+                missing += _move_ids(psi[w_from][PSI_CO], psi[w_to][PSI_I], lots)
 
-    state["scheduled"] = rest
+    if missing:
+        state["settle_missing_lots"] = int(state.get("settle_missing_lots", 0)) + missing
+    return missing
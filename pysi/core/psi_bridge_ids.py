@@ -1,7 +1,7 @@
 # pysi/core/psi_bridge_ids.py
 # 「idリストだけ」で PSI を回すブリッジ。数量は len(list) で計算。
 
-from .psi_state import PSI_S, PSI_CO, PSI_I, PSI_P
+from .psi_state import PSI_S, PSI_CO, PSI_I, PSI_P, as_event_queue, remove_lots
 
 def _mk_syn_id(seed: str) -> str:
     # 実行ごとに安定させたいなら別生成器に差し替え可
@@ -36,17 +36,9 @@ def _ids_or_synth(lots, qty: float, node: str, sku: str, week: int, lot_size: fl
     base = f"{node}:{sku}:{week}:{qty}:{lot_size}"
     return [_mk_syn_id(f"{base}:{i}") for i in range(n)]
 
-def _remove_ids(bucket: list[str], ids: list[str]):
-    """bucket から ids を削除（最初の一致を順次取り除く）"""
-    if not bucket or not ids:
-        return
-    # O(n*m)だが、V0R7流の高速実装は別途（set/map）最適化で
-    for lid in ids:
-        try:
-            idx = bucket.index(lid)
-            bucket.pop(idx)
-        except ValueError:
-            pass
+def _remove_ids(bucket: list[str], ids: list[str]) -> int:
+    """bucket から ids を削除（最初の一致から出現回数ぶん・1パス）。戻り値は欠損数"""
+    return remove_lots(bucket, ids)
 
 def _append_ids(bucket: list[str], ids: list[str]):
     if ids:
@@ -79,7 +71,7 @@ def commit_shipments_to_demand_psi_ids(alloc: dict, state: dict, params: dict):
             _append_ids(psi_dst[w_ship][PSI_CO], ids)
 
         arr_w = w_ship + int(lt_edge.get((src, dst, sku), 0))
-        state["scheduled"].append({
+        as_event_queue(state).append({
             "type": "receive_demand",
             "dst": dst, "sku": sku,
             "from_week": w_ship, "to_week": arr_w,
@@ -120,7 +112,7 @@ def commit_replenishment_to_supply_psi_ids(alloc: dict, state: dict, params: dic
         _append_ids(psi_node[w_order][PSI_CO], ids)
 
         done_w = w_order + int(prod_lead.get((node, sku), 0))
-        state["scheduled"].append({
+        as_event_queue(state).append({
             "type": "produce_supply",
             "node": node, "sku": sku,
             "from_week": w_order, "to_week": done_w,
@@ -129,26 +121,29 @@ def commit_replenishment_to_supply_psi_ids(alloc: dict, state: dict, params: dic
 
 def settle_scheduled_events_ids(state: dict, week_idx: int):
     """
-    週頭のイベント決済（idリストを CO/P → I へ移す）
+    週頭のイベント決済（idリストを CO/P → I へ移す）。当週のイベントだけを取り出す。
+    戻り値: 移動元に見つからなかった lot 数
     """
+    events = as_event_queue(state).pop_week(week_idx)
+    if not events:
+        return 0
+    missing = 0
     psiD, psiS = state["psi_demand"], state["psi_supply"]
-    rest = []
-    for ev in state.get("scheduled", []):
-        if ev["to_week"] != week_idx:
-            rest.append(ev)
-            continue
+    for ev in events:
         lots = ev.get("lots", [])
         if ev["type"] == "receive_demand":
             key = (ev["dst"], ev["sku"])
             psi = psiD.get(key)
             if psi:
-                _remove_ids(psi[ev["from_week"]][PSI_CO], lots)
+                missing += _remove_ids(psi[ev["from_week"]][PSI_CO], lots)
                 _append_ids(psi[ev["to_week"]][PSI_I], lots)
         elif ev["type"] == "produce_supply":
             key = (ev["node"], ev["sku"])
             psi = psiS.get(key)
             if psi:
-                _remove_ids(psi[ev["from_week"]][PSI_P],  lots)
-                _remove_ids(psi[ev["from_week"]][PSI_CO], lots)
+                missing += _remove_ids(psi[ev["from_week"]][PSI_P],  lots)
+                missing += _remove_ids(psi[ev["from_week"]][PSI_CO], lots)
                 _append_ids(psi[ev["to_week"]][PSI_I], lots)
-    state["scheduled"] = rest
+    if missing:
+        state["settle_missing_lots"] = int(state.get("settle_missing_lots", 0)) + missing
+    return missing
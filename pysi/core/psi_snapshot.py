@@ -0,0 +1,317 @@
+# pysi/core/psi_snapshot.py
+# ツリー（またはフォレスト）の PSI レイヤだけを取る列指向スナップショット
+#
+# 旧: psi_backup = copy.deepcopy(node) / psi_backup_to_file = pickle.dump(node)
+#     → Node グラフ全体（属性・親子参照・lot_ID リスト）をチェックポイントごとに複製
+# 新: セル（node × layer × 週 × [S, CO, I, P]）を CSR 形式で保持
+#     - lot_ID はスナップショット内で intern し、セルは int32 ハンドル列 + int64 offsets
+#     - セルごとの指紋 hash(tuple(cell)) を持ち、差分スナップショットは「変わったセルだけ」を保存
+#       （変わっていないセルは base を参照するので、what-if ごとにメモリが倍にならない）
+#     - restore は変わったセルだけを書き戻す。どのセルを調べるかはレイヤの持ち方で変わる
+#         PSIStore を attach したレイヤ: 取得時の mark() 以降の変更ログだけを見る（O(変更セル数)）
+#         素の list レイヤ             : 書き込みを検知できないので全セルの指紋を比べる（O(全 lot)）
+#       （ストアの差し替え・変更ログの切り詰め後も全走査に戻る）
+#     - save_snapshot / load_snapshot はディレクトリに .npy を並べるので np.load(mmap_mode="r") で開ける
+#
+#使い方
+#
+#s0 = take_snapshot(root)                 # 全量
+#... 計画を変更 ...
+#s1 = take_snapshot(root, base=s0)        # 差分（変わったセルだけ）
+#restore_snapshot(root, s0)               # s0 の状態へ戻す（戻り値: 書き戻したセル数）
+#save_snapshot(s1, "var/psi_backup.psisnap"); s = load_snapshot("var/psi_backup.psisnap")
+
+from __future__ import annotations
+import json
+import os
+import weakref
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .psi_store import LotInterner, PSIStore
+
+LAYERS = ("psi4demand", "psi4supply")
+N_BUCKETS = 4
+FORMAT_VERSION = 1
+MAX_DELTA_CHAIN = 16   # 差分がこれ以上連なったら全量を取り直す（cell() の探索を短く保つ）
+
+# index の 1 要素: (tree_key, node_name, layer, weeks)
+IndexEntry = Tuple[str, str, str, int]
+
+
+# ---- ツリー走査 ---------------------------------------------------------------
+def _forest(roots) -> List[Tuple[str, Any]]:
+    """root 単体なら [("", root)]、{key: root} なら key 昇順"""
+    if isinstance(roots, dict):
+        return [(str(k), r) for k, r in sorted(roots.items(), key=lambda x: str(x[0])) if r is not None]
+    return [("", roots)] if roots is not None else []
+
+
+def _walk(root) -> Iterator[Any]:
+    st = [root]
+    seen = set()
+    while st:
+        n = st.pop()
+        if n is None or id(n) in seen:
+            continue
+        seen.add(id(n))
+        yield n
+        st.extend(reversed(getattr(n, "children", []) or []))
+
+
+def _collect(roots, layers) -> Tuple[List[IndexEntry], List[Any], List[Any],
+                                     Dict[Tuple[str, str, str], Tuple[Any, Any]]]:
+    """
+    (index, cells, weeks, {(key, node, layer): (node, psi)})
+    cells はセルのリスト参照（複製しない）、weeks[i // 4] がセル i を持つ週の [S, CO, I, P]
+    """
+    index: List[IndexEntry] = []
+    cells: List[Any] = []
+    week_rows: List[Any] = []
+    owners: Dict[Tuple[str, str, str], Tuple[Any, Any]] = {}
+    for key, root in _forest(roots):
+        for n in _walk(root):
+            for layer in layers:
+                psi = getattr(n, layer, None)
+                if psi is None:
+                    continue
+                index.append((key, n.name, layer, len(psi)))
+                owners[(key, n.name, layer)] = (n, psi)
+                for week in psi:
+                    week_rows.append(week)
+                    cells.extend(week[b] for b in range(N_BUCKETS))
+    return index, cells, week_rows, owners
+
+
+def _layers(roots, layers) -> Tuple[List[IndexEntry], Dict[Tuple[str, str, str], Tuple[Any, Any]]]:
+    """_collect からセルの展開を除いたもの（restore はセルを必要な分だけ読む）"""
+    index: List[IndexEntry] = []
+    owners: Dict[Tuple[str, str, str], Tuple[Any, Any]] = {}
+    for key, root in _forest(roots):
+        for n in _walk(root):
+            for layer in layers:
+                psi = getattr(n, layer, None)
+                if psi is None:
+                    continue
+                index.append((key, n.name, layer, len(psi)))
+                owners[(key, n.name, layer)] = (n, psi)
+    return index, owners
+
+
+def _store_of(psi) -> Optional[PSIStore]:
+    store = getattr(psi, "store", None)
+    return store if isinstance(store, PSIStore) else None
+
+
+def _fingerprints(cells: Sequence[Any]) -> np.ndarray:
+    # プロセス内でのみ有効（str の hash はプロセスごとに変わる）
+    return np.fromiter((hash(tuple(c)) for c in cells), dtype=np.int64, count=len(cells))
+
+
+def _encode(cells: Sequence[Any]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    interner = LotInterner()
+    lens = np.fromiter((len(c) for c in cells), dtype=np.int64, count=len(cells))
+    offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(lens, out=offsets[1:])
+    handles = np.asarray(interner.intern_many(chain.from_iterable(cells)), dtype=np.int32)
+    return interner.ids_of(range(len(interner))), handles, offsets
+
+
+class _BlobStrings(Sequence):
+    """utf-8 連結バッファ + offsets を遅延デコードする lot_ID 表（mmap のまま使える）"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray) -> None:
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        o = self._offsets
+        return bytes(self._blob[o[i]:o[i + 1]]).decode("utf-8")
+
+
+# ---- スナップショット本体 -------------------------------------------------------
+class PSISnapshot:
+    """
+    PSI レイヤの不変スナップショット。
+    - 全量: 全セルを handles/offsets に持つ（changed is None）
+    - 差分: changed（昇順のセル番号）のセルだけを持ち、それ以外は base を参照
+    """
+
+    def __init__(self, layers: Sequence[str], index: List[IndexEntry],
+                 lot_ids: Sequence[str], handles: np.ndarray, offsets: np.ndarray,
+                 fp: Optional[np.ndarray] = None, base: Optional["PSISnapshot"] = None,
+                 changed: Optional[np.ndarray] = None) -> None:
+        self.layers = tuple(layers)
+        self.index = index
+        self.n_cells = sum(e[3] for e in index) * N_BUCKETS
+        self.lot_ids = lot_ids
+        self.handles = handles
+        self.offsets = offsets
+        self._fp = fp
+        self.base = base
+        self.changed = changed
+        self.depth = base.depth + 1 if base is not None else 0
+        # {(key, node, layer): (weakref(PSIStore), mark)}  取得時点の変更ログ位置（ストア付きレイヤだけ）
+        self.marks: Dict[Tuple[str, str, str], Tuple[Any, int]] = {}
+
+    def touched_cells(self, key: Tuple[str, str, str], psi) -> Optional[set]:
+        """このスナップショット以降に書き込まれたレイヤ内セル番号。分からなければ None（全走査）"""
+        ent = self.marks.get(key)
+        store = _store_of(psi)
+        if ent is None or store is None or ent[0]() is not store:
+            return None
+        return store.changed_since(ent[1])
+
+    @property
+    def is_delta(self) -> bool:
+        return self.changed is not None
+
+    @property
+    def nbytes(self) -> int:
+        """このスナップショット自身が持つ配列のバイト数（base 分は含まない。差分でも指紋は全セル分）"""
+        n = self.handles.nbytes + self.offsets.nbytes
+        if self._fp is not None:
+            n += self._fp.nbytes
+        if self.changed is not None:
+            n += self.changed.nbytes
+        return n
+
+    def _own_cell(self, k: int) -> List[str]:
+        ids, o = self.lot_ids, self.offsets
+        return [ids[h] for h in self.handles[o[k]:o[k + 1]].tolist()]
+
+    def cell(self, i: int) -> List[str]:
+        """セル番号 i の lot_ID リスト（新しいリストを返す）"""
+        snap = self
+        while snap.changed is not None:
+            k = int(np.searchsorted(snap.changed, i))
+            if k < len(snap.changed) and snap.changed[k] == i:
+                return snap._own_cell(k)
+            snap = snap.base
+        return snap._own_cell(i)
+
+    def fingerprints(self) -> np.ndarray:
+        """セルごとの指紋（ファイルから読んだ場合は初回にまとめて計算）"""
+        if self._fp is None:
+            self._fp = _fingerprints([self.cell(i) for i in range(self.n_cells)])
+        return self._fp
+
+    def flatten(self) -> "PSISnapshot":
+        """差分の連鎖を解いた全量スナップショット（保存用）"""
+        if not self.is_delta:
+            return self
+        cells = [self.cell(i) for i in range(self.n_cells)]
+        lot_ids, handles, offsets = _encode(cells)
+        full = PSISnapshot(self.layers, self.index, lot_ids, handles, offsets, fp=self._fp)
+        full.marks = self.marks
+        return full
+
+
+def take_snapshot(roots, layers: Sequence[str] = LAYERS,
+                  base: Optional[PSISnapshot] = None) -> PSISnapshot:
+    """
+    roots（root か {product: root}）の PSI レイヤを取る。
+    base と同じ構造（ノード・レイヤ・週数）なら、指紋の違うセルだけを持つ差分スナップショットになる。
+    """
+    index, cells, _, owners = _collect(roots, layers)
+    fp = _fingerprints(cells)
+    if (base is not None and base.depth < MAX_DELTA_CHAIN
+            and base.layers == tuple(layers) and base.index == index):
+        changed = np.nonzero(fp != base.fingerprints())[0]
+        lot_ids, handles, offsets = _encode([cells[i] for i in changed.tolist()])
+        snap = PSISnapshot(layers, index, lot_ids, handles, offsets, fp=fp, base=base, changed=changed)
+    else:
+        lot_ids, handles, offsets = _encode(cells)
+        snap = PSISnapshot(layers, index, lot_ids, handles, offsets, fp=fp)
+    for k, (_, psi) in owners.items():
+        store = _store_of(psi)
+        if store is not None:
+            snap.marks[k] = (weakref.ref(store), store.mark())
+    return snap
+
+
+def _restore_cells(psi, snap: PSISnapshot, start: int, weeks: int,
+                   touched: Optional[set]) -> int:
+    """1 レイヤ分（snap のセル番号 start から weeks*4 個）を戻す。touched が None なら全セルの指紋を比べる"""
+    want = snap.fingerprints()
+    if touched is None:
+        cur = [psi[w][b] for w in range(weeks) for b in range(N_BUCKETS)]
+        cand = np.nonzero(_fingerprints(cur) != want[start:start + weeks * N_BUCKETS])[0].tolist()
+    else:
+        cand = [j for j in sorted(touched)
+                if hash(tuple(psi[j // N_BUCKETS][j % N_BUCKETS])) != want[start + j]]
+    # セルのリストは週をまたいで共有されていることがあるので、その場で書き換えず差し替える
+    for j in cand:
+        w, b = divmod(j, N_BUCKETS)
+        psi[w][b] = snap.cell(start + j)
+    return len(cand)
+
+
+def restore_snapshot(roots, snap: PSISnapshot) -> int:
+    """
+    snap の状態へ roots を戻す（ノードは名前で突き合わせ、snap に無いノードは触らない）。
+    指紋が一致するセルはそのまま、違うセルだけ新しいリストで置き換える。戻り値は書き戻したセル数。
+    PSIStore 付きのレイヤは取得以降の変更ログにあるセルだけを調べる（素の list は全セル）。
+    週数が変わっているレイヤは丸ごと作り直す。
+    """
+    index, owners = _layers(roots, snap.layers)
+    cur = {(k, n, l): w for k, n, l, w in index}
+    written = 0
+    start = 0
+    for key, name, layer, weeks in snap.index:
+        span = start
+        start += weeks * N_BUCKETS
+        owner = owners.get((key, name, layer))
+        if owner is None:
+            continue
+        node, psi = owner
+        if cur[(key, name, layer)] != weeks:
+            setattr(node, layer, [[snap.cell(span + w * N_BUCKETS + b) for b in range(N_BUCKETS)]
+                                  for w in range(weeks)])
+            written += weeks * N_BUCKETS
+            continue
+        written += _restore_cells(psi, snap, span, weeks, snap.touched_cells((key, name, layer), psi))
+    return written
+
+
+# ---- ファイル（mmap 可能な .npy の集合） ---------------------------------------
+def snapshot_path(filename: str) -> str:
+    """旧バックアップ名（psi_backup.pkl など）に対応するスナップショットのディレクトリ名"""
+    return os.path.splitext(filename)[0] + ".psisnap"
+
+
+def save_snapshot(snap: PSISnapshot, path: str) -> str:
+    """path をディレクトリとして meta.json と .npy 群を書く（差分は全量に展開して保存）"""
+    full = snap.flatten()
+    os.makedirs(path, exist_ok=True)
+    encoded = [s.encode("utf-8") for s in full.lot_ids]
+    lot_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded)),
+              out=lot_offsets[1:])
+    np.save(os.path.join(path, "handles.npy"), np.asarray(full.handles, dtype=np.int32))
+    np.save(os.path.join(path, "offsets.npy"), np.asarray(full.offsets, dtype=np.int64))
+    np.save(os.path.join(path, "lot_blob.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(path, "lot_offsets.npy"), lot_offsets)
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": FORMAT_VERSION, "layers": list(full.layers),
+                   "index": [list(e) for e in full.index]}, f, ensure_ascii=False)
+    return path
+
+
+def load_snapshot(path: str, mmap: bool = True) -> PSISnapshot:
+    """save_snapshot の逆。mmap=True なら配列はファイルを memory-map したまま使う"""
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot version: {meta.get('version')}")
+    mode = "r" if mmap else None
+    arr = {k: np.load(os.path.join(path, f"{k}.npy"), mmap_mode=mode)
+           for k in ("handles", "offsets", "lot_blob", "lot_offsets")}
+    index = [(str(k), str(n), str(l), int(w)) for k, n, l, w in meta["index"]]
+    return PSISnapshot(meta["layers"], index, _BlobStrings(arr["lot_blob"], arr["lot_offsets"]),
+                       arr["handles"], arr["offsets"])
@@ -1,5 +1,7 @@
 # pysi/core/psi_state.py
 # PSI = 週配列 × [S, CO, I, P]、各要素は「lot_ID のリスト」だけ（数量は len(list) で算出）
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, List
 
 PSI_S, PSI_CO, PSI_I, PSI_P = 0, 1, 2, 3
 
@@ -7,20 +9,145 @@ def make_psi(n_weeks: int):
     # 週ごとに [S, CO, I, P] を用意。各バケツは list[str]（lot_ID の配列）
     return [[[], [], [], []] for _ in range(n_weeks)]
 
+
+# ---- バケツ操作（multiset: 同じ lot_ID が複数あれば複数回扱う）-----------------
+def remove_lots(bucket: List[str], ids: Iterable[str]) -> int:
+    """
+    bucket から ids を出現回数ぶん取り除く（先頭側の一致から・残りの順序は保持）。
+    1 パスで bucket を詰め直すので O(len(bucket) + len(ids))。
+    戻り値: bucket に見つからなかった lot 数（呼び出し側で監査に使う）
+    """
+    want: Dict[str, int] = {}
+    for lid in ids:
+        want[lid] = want.get(lid, 0) + 1
+    if not want:
+        return 0
+    if not bucket:
+        return sum(want.values())
+    kept: List[str] = []
+    for lid in bucket:
+        c = want.get(lid)
+        if c:
+            want[lid] = c - 1
+        else:
+            kept.append(lid)
+    bucket[:] = kept
+    return sum(want.values())
+
+
+def move_lots(src: List[str], dst: List[str], ids: Iterable[str]) -> int:
+    """
+    src から ids を一括で取り除き、dst に ids をそのまま追加する。
+    src に無い lot も dst には積む（従来の冪等な挙動）。戻り値は欠損数。
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    missing = remove_lots(src, ids)
+    dst.extend(ids)
+    return missing
+
+
+def take_lots(bucket: List[str], wanted: Iterable[str], limit: int) -> List[str]:
+    """
+    bucket から wanted に含まれる lot を先頭から最大 limit 個抜き出して返す（1 パス）。
+    """
+    wanted = set(wanted)
+    if limit <= 0 or not wanted or not bucket:
+        return []
+    taken: List[str] = []
+    kept: List[str] = []
+    for lid in bucket:
+        if len(taken) < limit and lid in wanted:
+            taken.append(lid)
+        else:
+            kept.append(lid)
+    if taken:
+        bucket[:] = kept
+    return taken
+
+
+class ScheduledEvents:
+    """
+    state["scheduled"] の受け皿。to_week ごとのバケットにイベント(dict)を積む。
+    - append/extend/iter/len は従来の list と同じ感覚で使える（plugins はそのまま push 可）
+    - pop_week(w) で当週ぶんだけ取り出す → 週次決済は O(当週イベント数)
+    """
+
+    def __init__(self, events: Iterable[Dict[str, Any]] = ()) -> None:
+        self._by_week: Dict[int, List[Dict[str, Any]]] = {}
+        self._n = 0
+        self.extend(events)
+
+    @staticmethod
+    def _week_of(ev: Dict[str, Any]) -> int:
+        try:
+            return int(ev.get("to_week", -1))
+        except Exception:
+            return -1
+
+    def append(self, ev: Dict[str, Any]) -> None:
+        self._by_week.setdefault(self._week_of(ev), []).append(ev)
+        self._n += 1
+
+    def extend(self, events: Iterable[Dict[str, Any]]) -> None:
+        for ev in events or ():
+            self.append(ev)
+
+    def pop_week(self, week: int) -> List[Dict[str, Any]]:
+        """to_week == week のイベントを登録順で取り出す（無ければ空）"""
+        evs = self._by_week.pop(int(week), None)
+        if not evs:
+            return []
+        self._n -= len(evs)
+        return evs
+
+    def peek_week(self, week: int) -> List[Dict[str, Any]]:
+        return list(self._by_week.get(int(week), ()))
+
+    def weeks(self) -> List[int]:
+        return sorted(self._by_week)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __bool__(self) -> bool:
+        return self._n > 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for w in sorted(self._by_week):
+            yield from self._by_week[w]
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+
+def as_event_queue(state: Dict[str, Any]) -> ScheduledEvents:
+    """
+    state["scheduled"] を ScheduledEvents に正規化して返す。
+    旧形式（list[dict]）が入っていれば一度だけ変換して差し替える。
+    """
+    q = state.get("scheduled")
+    if isinstance(q, ScheduledEvents):
+        return q
+    q = ScheduledEvents(q or [])
+    state["scheduled"] = q
+    return q
+
+
 def init_state(n_weeks: int, nodes_skus: list[tuple[str, str]]):
     """
     state:
       - psi_demand[(node, sku)] = week->[S,CO,I,P] （各バケツ list[str]）
       - psi_supply[(node, sku)] = 同上
-      - scheduled: 将来イベント（Iへの移管）を格納
+      - scheduled: 将来イベント（Iへの移管）を to_week 別に格納（ScheduledEvents）
     """
     state = {
         "psi_demand": {},
         "psi_supply": {},
-        "scheduled": []
+        "scheduled": ScheduledEvents()
     }
     for node, sku in nodes_skus:
         state["psi_demand"][(node, sku)] = make_psi(n_weeks)
         state["psi_supply"][(node, sku)] = make_psi(n_weeks)
     return state
-
@@ -0,0 +1,350 @@
+# pysi/core/psi_store.py
+# PSI の配列バックエンド（lot_ID を整数ハンドルに intern し、CSR 形式で保持）
+#
+# 従来: node.psi4demand = 週 × [S, CO, I, P] の list[list[list[str]]]
+#       → ノード数 × 週数 × 4 個の list オブジェクトと lot_ID 文字列参照が並ぶ
+# ここ: PSIStore = handles(int32) + offsets(int64) の CSR + 週×バケツの counts 配列
+#       → 数量問合せ（lot_counts / GUI グラフ）は counts[w, b] を読むだけ（O(1)）
+#
+# 互換: PSILayerView を node.psi4demand に差し込めば、既存コードの
+#       node.psi4demand[w][b].extend(...) / len(...) / = [...] がそのまま動く。
+#       変更されたセルだけ list[int] のオーバーレイに載り、compact() で CSR に畳み込む。
+#       書き込んだセル番号は変更ログに残り、mark() / changed_since() で「ある時点以降の変更セル」を出せる
+#       （psi_snapshot.restore_snapshot が全セルを見ずに済む）。
+
+from __future__ import annotations
+from collections.abc import MutableSequence
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+
+from .psi_state import PSI_S, PSI_CO, PSI_I, PSI_P
+
+N_BUCKETS = 4  # [S, CO, I, P]
+LOG_MIN = 4096  # 変更ログを捨てる長さの下限（小さいストアでも mark が直ぐ無効にならないように）
+
+
+# ---- lot_ID <-> handle ------------------------------------------------------
+class LotInterner:
+    """lot_ID(str) と整数ハンドルの相互変換表。ハンドルは 0 始まりの連番。"""
+
+    def __init__(self) -> None:
+        self._h_of: Dict[str, int] = {}
+        self._ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def intern(self, lot_id: str) -> int:
+        h = self._h_of.get(lot_id)
+        if h is None:
+            h = len(self._ids)
+            self._h_of[lot_id] = h
+            self._ids.append(lot_id)
+        return h
+
+    def intern_many(self, lot_ids: Iterable[str]) -> List[int]:
+        get, ids, h_of = self._h_of.get, self._ids, self._h_of
+        out: List[int] = []
+        for lid in lot_ids:
+            h = get(lid)
+            if h is None:
+                h = len(ids)
+                h_of[lid] = h
+                ids.append(lid)
+            out.append(h)
+        return out
+
+    def lookup(self, lot_id: str) -> Optional[int]:
+        """intern 済みならハンドル、未登録なら None（登録はしない）"""
+        return self._h_of.get(lot_id)
+
+    def id_of(self, handle: int) -> str:
+        return self._ids[handle]
+
+    def ids_of(self, handles: Iterable[int]) -> List[str]:
+        ids = self._ids
+        return [ids[h] for h in handles]
+
+
+# ---- CSR ストア ------------------------------------------------------------
+class PSIStore:
+    """
+    1 ノード 1 レイヤ分の PSI（週 × [S, CO, I, P]）。
+    - 確定部: _handles / _offsets（セル番号 c = w*4 + b の CSR）
+    - 変更部: _overlay[c] = list[int]（書き込みのあったセルだけ。compact() で確定部へ）
+    - 数量  : _counts[w, b]（常に最新。len() はここを読む）
+    """
+
+    def __init__(self, weeks: int, interner: Optional[LotInterner] = None) -> None:
+        weeks = max(0, int(weeks))
+        self.weeks = weeks
+        # 表は持ち主（ストア / attach_psi_store したツリー）と一緒に捨てられる。プロセス共有はしない
+        self.interner = interner if interner is not None else LotInterner()
+        self._handles = np.zeros(0, dtype=np.int32)
+        self._offsets = np.zeros(weeks * N_BUCKETS + 1, dtype=np.int64)
+        self._counts = np.zeros((weeks, N_BUCKETS), dtype=np.int32)
+        self._overlay: Dict[int, List[int]] = {}
+        # 変更ログ（書き込みのあったセル番号の列）。スナップショット以降の変更を O(変更数) で出す
+        self._log: List[int] = []
+        self._log_start = 0   # _log[0] の通し番号（長くなったら捨てて進める）
+
+    # -- 生成 / 変換 ----------------------------------------------------------
+    @classmethod
+    def from_nested(cls, psi: Sequence[Sequence[Sequence[str]]],
+                    interner: Optional[LotInterner] = None) -> "PSIStore":
+        """既存の list[week][bucket] -> list[str] から一括構築する。"""
+        store = cls(len(psi), interner=interner)
+        intern_many = store.interner.intern_many
+        flat: List[int] = []
+        offsets = store._offsets
+        c = 0
+        for week in psi:
+            for b in range(N_BUCKETS):
+                bucket = week[b] if b < len(week) else ()
+                if bucket:
+                    flat.extend(intern_many(bucket))
+                c += 1
+                offsets[c] = len(flat)
+        store._handles = np.asarray(flat, dtype=np.int32)
+        store._counts[:, :] = np.diff(offsets).reshape(store.weeks, N_BUCKETS)
+        return store
+
+    def to_nested(self) -> List[List[List[str]]]:
+        """list[week][bucket] -> list[str] に戻す（DB 書戻しや pickle 互換用）"""
+        ids_of = self.interner.ids_of
+        return [[ids_of(self.handles(w, b)) for b in range(N_BUCKETS)]
+                for w in range(self.weeks)]
+
+    def view(self) -> "PSILayerView":
+        return PSILayerView(self)
+
+    # -- 参照 ----------------------------------------------------------------
+    def count(self, w: int, b: int) -> int:
+        return int(self._counts[w, b])
+
+    def counts(self, b: Optional[int] = None) -> np.ndarray:
+        """週 × バケツの数量配列（b 指定時はその列）。読み取り専用で返す。"""
+        arr = self._counts if b is None else self._counts[:, b]
+        v = arr.view()
+        v.flags.writeable = False
+        return v
+
+    def handles(self, w: int, b: int) -> Sequence[int]:
+        c = w * N_BUCKETS + b
+        ov = self._overlay.get(c)
+        if ov is not None:
+            return ov
+        return self._handles[self._offsets[c]:self._offsets[c + 1]]
+
+    def ids(self, w: int, b: int) -> List[str]:
+        return self.interner.ids_of(self.handles(w, b))
+
+    @property
+    def nbytes(self) -> int:
+        """確定部とオーバーレイの概算バイト数（メモリ比較用）"""
+        ov = sum(8 * len(v) + 56 for v in self._overlay.values())
+        return int(self._handles.nbytes + self._offsets.nbytes + self._counts.nbytes + ov)
+
+    # -- 更新 ----------------------------------------------------------------
+    def _cell(self, w: int, b: int) -> List[int]:
+        """書き込み用にセルをオーバーレイへ取り出す（copy-on-write）"""
+        c = w * N_BUCKETS + b
+        ov = self._overlay.get(c)
+        if ov is None:
+            ov = self._handles[self._offsets[c]:self._offsets[c + 1]].tolist()
+            self._overlay[c] = ov
+        return ov
+
+    def _sync(self, w: int, b: int) -> None:
+        c = w * N_BUCKETS + b
+        self._counts[w, b] = len(self._overlay[c])
+        log = self._log
+        log.append(c)
+        if len(log) > max(LOG_MIN, 2 * self.weeks * N_BUCKETS):
+            # 全セル数の 2 倍を超えたら捨てる（古い mark は changed_since が None を返す）
+            self._log_start += len(log)
+            self._log = []
+
+    # -- 変更ログ --------------------------------------------------------------
+    def mark(self) -> int:
+        """変更ログの現在位置（changed_since に渡す）"""
+        return self._log_start + len(self._log)
+
+    def changed_since(self, mark: int) -> Optional[Set[int]]:
+        """mark 以降に書き込みのあったセル番号 c = w*4+b の集合。ログを捨てた後なら None"""
+        i = mark - self._log_start
+        if i < 0:
+            return None
+        return set(self._log[i:])
+
+    def set_handles(self, w: int, b: int, handles: Iterable[int]) -> None:
+        self._overlay[w * N_BUCKETS + b] = list(handles)
+        self._sync(w, b)
+
+    def set_ids(self, w: int, b: int, lot_ids: Iterable[str]) -> None:
+        self.set_handles(w, b, self.interner.intern_many(lot_ids))
+
+    def extend_ids(self, w: int, b: int, lot_ids: Iterable[str]) -> None:
+        cell = self._cell(w, b)
+        cell.extend(self.interner.intern_many(lot_ids))
+        self._sync(w, b)
+
+    def clear(self, w: int, b: int) -> None:
+        self.set_handles(w, b, ())
+
+    def compact(self) -> None:
+        """オーバーレイを CSR に畳み込む。計画ステップの区切りで呼ぶ想定。"""
+        if not self._overlay:
+            return
+        n_cells = self.weeks * N_BUCKETS
+        lens = self._counts.reshape(n_cells).astype(np.int64)
+        new_offsets = np.zeros(n_cells + 1, dtype=np.int64)
+        np.cumsum(lens, out=new_offsets[1:])
+        new_handles = np.empty(int(new_offsets[-1]), dtype=np.int32)
+        old_h, old_o, ov = self._handles, self._offsets, self._overlay
+        for c in range(n_cells):
+            lo, hi = new_offsets[c], new_offsets[c + 1]
+            if lo == hi:
+                continue
+            cell = ov.get(c)
+            if cell is not None:
+                new_handles[lo:hi] = cell
+            else:
+                new_handles[lo:hi] = old_h[old_o[c]:old_o[c + 1]]
+        self._handles, self._offsets = new_handles, new_offsets
+        self._overlay = {}
+
+
+# ---- 互換ビュー（node.psi4demand[w][b] の見た目を保つ） -----------------------
+class PSIBucketView(MutableSequence):
+    """1 セル分の list[str] 互換ビュー。len() は counts を読むので O(1)。"""
+
+    __slots__ = ("_store", "_w", "_b")
+
+    def __init__(self, store: PSIStore, w: int, b: int) -> None:
+        self._store, self._w, self._b = store, w, b
+
+    def _ids(self) -> List[str]:
+        return self._store.ids(self._w, self._b)
+
+    def __len__(self) -> int:
+        return self._store.count(self._w, self._b)
+
+    def __bool__(self) -> bool:
+        return self._store.count(self._w, self._b) > 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids())
+
+    def __getitem__(self, i):
+        return self._ids()[i]
+
+    def __setitem__(self, i, v) -> None:
+        ids = self._ids()
+        ids[i] = v
+        self._store.set_ids(self._w, self._b, ids)
+
+    def __delitem__(self, i) -> None:
+        ids = self._ids()
+        del ids[i]
+        self._store.set_ids(self._w, self._b, ids)
+
+    def __contains__(self, lot_id) -> bool:
+        h = self._store.interner.lookup(lot_id)
+        return h is not None and h in self._store.handles(self._w, self._b)
+
+    def __add__(self, other) -> List[str]:
+        return self._ids() + list(other)
+
+    def __radd__(self, other) -> List[str]:
+        return list(other) + self._ids()
+
+    def __eq__(self, other) -> bool:
+        # list 互換の比較だけ受ける（文字列を 1 文字ずつ比べたり None で落ちたりしない）
+        if isinstance(other, PSIBucketView):
+            return self._ids() == other._ids()
+        if isinstance(other, (list, tuple)):
+            return self._ids() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(self._ids())
+
+    def insert(self, i: int, v: str) -> None:
+        ids = self._ids()
+        ids.insert(i, v)
+        self._store.set_ids(self._w, self._b, ids)
+
+    def append(self, v: str) -> None:
+        self._store.extend_ids(self._w, self._b, (v,))
+
+    def extend(self, vs: Iterable[str]) -> None:
+        self._store.extend_ids(self._w, self._b, list(vs))
+
+    def clear(self) -> None:
+        self._store.clear(self._w, self._b)
+
+    def copy(self) -> List[str]:
+        return self._ids()
+
+
+class PSIWeekView(Sequence):
+    """1 週分の [S, CO, I, P]。psi[w][b] = [...] の置換も受け付ける。"""
+
+    __slots__ = ("_store", "_w")
+
+    def __init__(self, store: PSIStore, w: int) -> None:
+        self._store, self._w = store, w
+
+    def __len__(self) -> int:
+        return N_BUCKETS
+
+    def __getitem__(self, b):
+        if isinstance(b, slice):
+            return [PSIBucketView(self._store, self._w, i) for i in range(N_BUCKETS)[b]]
+        if b < 0:
+            b += N_BUCKETS
+        if not 0 <= b < N_BUCKETS:
+            raise IndexError(b)
+        return PSIBucketView(self._store, self._w, b)
+
+    def __setitem__(self, b: int, lot_ids: Iterable[str]) -> None:
+        self._store.set_ids(self._w, b, list(lot_ids))
+
+
+class PSILayerView(Sequence):
+    """node.psi4demand の代わりに差し込むレイヤビュー。store 属性で本体に届く。"""
+
+    __slots__ = ("store",)
+
+    def __init__(self, store: PSIStore) -> None:
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store.weeks
+
+    def __getitem__(self, w):
+        if isinstance(w, slice):
+            return [PSIWeekView(self.store, i) for i in range(self.store.weeks)[w]]
+        if w < 0:
+            w += self.store.weeks
+        if not 0 <= w < self.store.weeks:
+            raise IndexError(w)
+        return PSIWeekView(self.store, w)
+
+    def __setitem__(self, w: int, week: Sequence[Iterable[str]]) -> None:
+        for b in range(N_BUCKETS):
+            self.store.set_ids(w, b, list(week[b]))
+
+
+# ---- helpers ---------------------------------------------------------------
+def bucket_counts(psi, b: int) -> List[int]:
+    """
+    週ごとのバケツ数量。PSILayerView なら counts 配列を直接、
+    従来の list-of-lists なら len() で数える（呼び出し側は区別不要）。
+    """
+    store = getattr(psi, "store", None)
+    if isinstance(store, PSIStore):
+        return store.counts(b).tolist()
+    return [len(week[b]) for week in psi]
@@ -0,0 +1,91 @@
+# pysi/core/shift_map.py
+# 長期休暇（long vacation）を考慮した週シフト表
+#
+# 旧: 週ごとに check_lv_week_bw/fw を呼び、`while num in const_lst`（list 探索）で休暇週を飛ばす
+#     → 1 週あたり O(連続休暇週数 × |lv_week|)
+# 新: 「元の週 w → 休暇を避けたシフト先の週」の int 配列を 1 回だけ作る（O(weeks + |lv_week|)）
+#     同じ (週数, オフセット, 休暇週, 方向) の表は共有キャッシュから返す。
+#
+#   bw: target(w) = w - offset を、休暇週なら手前（小さい週）へずらす  … S→P, 親P→子S
+#   fw: target(w) = w + offset を、休暇週なら後ろ（大きい週）へずらす  … P→S
+#
+# 範囲外（負の週など）の補正はしない（旧実装と同じ添字をそのまま返す）。
+
+from __future__ import annotations
+from functools import lru_cache
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+DIRECTIONS = ("bw", "fw")
+
+
+def _lv_key(lv_week) -> Tuple[int, ...]:
+    if not lv_week:
+        return ()
+    return tuple(sorted({int(x) for x in lv_week}))
+
+
+@lru_cache(maxsize=1024)
+def _compile(n_weeks: int, offset: int, lv: Tuple[int, ...], direction: str) -> np.ndarray:
+    src = np.arange(n_weeks, dtype=np.int64)
+    tgt = src - offset if direction == "bw" else src + offset
+    if n_weeks == 0 or not lv:
+        tgt.setflags(write=False)
+        return tgt
+
+    # 休暇週を飛ばすのは高々 len(lv) 週なので、その幅だけ余裕を持った窓で考える
+    L = len(lv)
+    lo = int(tgt.min()) - L - 1
+    hi = int(tgt.max()) + L + 1
+    vac = np.zeros(hi - lo + 1, dtype=bool)
+    lv_arr = np.asarray(lv, dtype=np.int64)
+    lv_arr = lv_arr[(lv_arr >= lo) & (lv_arr <= hi)]
+    vac[lv_arr - lo] = True
+
+    idx = np.arange(lo, hi + 1, dtype=np.int64)
+    if direction == "bw":
+        # 各週について「その週以下で最も近い稼働週」
+        free = np.maximum.accumulate(np.where(vac, lo, idx))
+    else:
+        # 各週について「その週以上で最も近い稼働週」
+        free = np.minimum.accumulate(np.where(vac, hi, idx)[::-1])[::-1]
+    out = free[tgt - lo]
+    out.setflags(write=False)
+    return out
+
+
+def compile_shift_map(n_weeks: int, offset: int, lv_week=None, direction: str = "bw") -> np.ndarray:
+    """
+    元の週 0..n_weeks-1 → 休暇補正後のシフト先週 の int64 配列（読み取り専用・共有）。
+    結果は check_lv_week_bw(lv_week, w - offset) / check_lv_week_fw(lv_week, w + offset) と同じ。
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f"direction must be one of {DIRECTIONS}")
+    return _compile(int(n_weeks), int(offset), _lv_key(lv_week), direction)
+
+
+def apply_shift_map(src_psi, dst_psi, shift_map: Sequence[int], weeks: Iterable[int],
+                    src_bucket: int, dst_bucket: int, *, extend: bool = True,
+                    min_target: Optional[int] = None) -> None:
+    """
+    src_psi[w][src_bucket] を dst_psi[shift_map[w]][dst_bucket] へまとめて移す（weeks の順に処理）。
+    - extend=True : 追記（S→P）
+    - extend=False: 置き換え（P→S。同じ先に複数来たら後勝ち＝旧ループと同じ）
+    - min_target  : これ未満のシフト先は捨てる（親P→子S の「etd_shift > 0」）
+    """
+    tgt = shift_map.tolist() if isinstance(shift_map, np.ndarray) else shift_map
+    if extend:
+        for w in weeks:
+            t = tgt[w]
+            if min_target is not None and t < min_target:
+                continue
+            lots = src_psi[w][src_bucket]
+            if lots:
+                dst_psi[t][dst_bucket].extend(lots)
+    else:
+        for w in weeks:
+            t = tgt[w]
+            if min_target is not None and t < min_target:
+                continue
+            dst_psi[t][dst_bucket] = src_psi[w][src_bucket]
@@ -11,6 +11,8 @@ from collections import defaultdict
 from pysi.utils.file_io import read_tree_file
 
 from pysi.plan.operations import *
+from pysi.core.shift_map import compile_shift_map, apply_shift_map
+from pysi.evaluate.tree_cost_eval import evaluate_tree_cost
 #from pysi.plan.operations import calcS2P, set_S2psi, get_set_childrenP2S2psi
 
 from pysi.core.node_base import Node, SKU
@@ -52,27 +54,15 @@ def get_nodes(root: Node) -> list[Node]:
 # after demand leveling / planning outbound supply
 # ****************************
 def shiftS2P_LV_replace(psiS, shift_week, lv_week):  # LV:long vacations
-    # ss = safety_stock_week
-    sw = shift_week
     plan_len = len(psiS) - 1  # -1 for week list position
     for w in range(plan_len):  # foreward planningでsupplyのp [w][3]を初期化
         # psiS[w][0] = [] # S active
         psiS[w][1] = []  # CO
         psiS[w][2] = []  # I
         psiS[w][3] = []  # P
-    for w in range(plan_len, sw, -1):  # backward planningでsupplyを降順でシフト
-        # my_list = [1, 2, 3, 4, 5]
-        # for i in range(2, len(my_list)):
-        #    my_list[i] = my_list[i-1] + my_list[i-2]
-        # 0:S
-        # 1:CO
-        # 2:I
-        # 3:P
-        eta_plan = w - sw  # sw:shift week ( including safty stock )
-        eta_shift = check_lv_week_bw(lv_week, eta_plan)  # ETA:Eatimate Time Arrival
-        # リスト追加 extend
-        # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする
-        psiS[eta_shift][3].extend(psiS[w][0])  # P made by shifting S with
+    # backward planningでsupplyを降順でシフト（シフト先は休暇補正済みの表から）
+    smap = compile_shift_map(len(psiS), shift_week, lv_week, "bw")  # ETA:Eatimate Time Arrival
+    apply_shift_map(psiS, psiS, smap, range(plan_len, shift_week, -1), 0, 3)  # P made by shifting S
     return psiS
 # ****************************
 # extract_subtree_by_product
@@ -157,65 +147,31 @@ def connect_outbound2inbound(root_node_outbound, root_node_inbound):
 # ************************************
 def check_lv_week_bw(const_lst, check_week):
     num = check_week
-    if const_lst == []:
-        pass
-    else:
-        while num in const_lst:
+    if const_lst:
+        lv = set(const_lst)
+        while num in lv:
             num -= 1
     return num
 def shift_P2childS_LV(node, child, safety_stock_week, lv_week):
-    # psiP = node.psi4demand
-    ss = safety_stock_week
+    # 親 P(w) → 子 S(w - ss) を休暇補正して置き換え（etd_shift > 0 のみ）
     plan_len = len(node.psi4demand) - 1  # -1 for week list position
-    #plan_len = len(psiP) - 1  # -1 for week list position
-    for w in range( (plan_len - 1), 0, -1):  # forward planningで確定Pを確定Sにシフト
-        # my_list = [1, 2, 3, 4, 5]
-        # for i in range(2, len(my_list)):
-        #    my_list[i] = my_list[i-1] + my_list[i-2]
-        # 0:S
-        # 1:CO
-        # 2:I
-        # 3:P
-        etd_plan = w - ss  # ss:safty stock
-        etd_shift = check_lv_week_bw(lv_week,etd_plan) #BW ETD:Eatimate TimeDep
-        # リスト追加 extend
-        # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする
-        # "child S" position made by shifting P with
-        #child.psi4supply[etd_shift][0] = node.psi4supply[w][3]
-        print("[etd_shift][0] [w][3]  ",child.name,etd_shift, "  ",node.name,w)
-        if etd_shift > 0:
-            child.psi4demand[etd_shift][0] = node.psi4demand[w][3]
-        else:
-            pass
-        #psi[etd_shift][0] = psiP[w][3]  # S made by shifting P with
-    #return psiP
-    #
-    #return psi
+    smap = compile_shift_map(len(node.psi4demand), safety_stock_week, lv_week, "bw")  #BW ETD
+    # "child S" position made by shifting P with
+    apply_shift_map(node.psi4demand, child.psi4demand, smap, range(plan_len - 1, 0, -1),
+                    3, 0, extend=False, min_target=1)
 def check_lv_week_fw(const_lst, check_week):
     num = check_week
-    if const_lst == []:
-        pass
-    else:
-        while num in const_lst:
+    if const_lst:
+        lv = set(const_lst)
+        while num in lv:
             num += 1
     return num
 # backward P2S ETD_shifting
 def shiftP2S_LV(psiP, safety_stock_week, lv_week):  # LV:long vacations
-    ss = safety_stock_week
     plan_len = len(psiP) - 1  # -1 for week list position
-    for w in range(plan_len - 1):  # forward planningで確定Pを確定Sにシフト
-        # my_list = [1, 2, 3, 4, 5]
-        # for i in range(2, len(my_list)):
-        #    my_list[i] = my_list[i-1] + my_list[i-2]
-        # 0:S
-        # 1:CO
-        # 2:I
-        # 3:P
-        etd_plan = w + ss  # ss:safty stock
-        etd_shift = check_lv_week_fw(lv_week, etd_plan)  # ETD:Eatimate TimeDep
-        # リスト追加 extend
-        # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする
-        psiP[etd_shift][0] = psiP[w][3]  # S made by shifting P with
+    # forward planningで確定Pを確定Sにシフト（ETD:Eatimate TimeDep は表で一括計算）
+    smap = compile_shift_map(len(psiP), safety_stock_week, lv_week, "fw")
+    apply_shift_map(psiP, psiP, smap, range(plan_len - 1), 3, 0, extend=False)  # S made by shifting P
     return psiP
 # P2S
 def calc_all_psiS2P2childS_preorder(node):
@@ -764,7 +720,9 @@ def eval_supply_chain_cash(node):
 # = eval_supply_chain_cash(self.root_node_outbound)
 def eval_supply_chain_cost(node, total_revenue=0, total_profit=0):
     """
-    Recursively evaluates the cost of the supply chain for a given node.
+    Evaluates the cost of the supply chain under the given node.
+    All nodes are evaluated at once (pysi.evaluate.tree_cost_eval); lot counts,
+    eval_cs_* fields and node.revenue / node.profit are written back to each node.
     Parameters:
         node (Node): The root node to start the evaluation.
         total_revenue (float): Accumulated total revenue (default 0).
@@ -772,19 +730,8 @@ def eval_supply_chain_cost(node, total_revenue=0, total_profit=0):
     Returns:
         Tuple[float, float]: Accumulated total revenue and total profit.
     """
-    # Count the number of lots for the node
-    node.set_lot_counts()
-    # Evaluate the current node's costs
-    node.revenue, node.profit = node.EvalPlanSIP_cost()
-    # Accumulate the revenue and profit
-    total_revenue += node.revenue
-    total_profit  += node.profit
-    # Recursively evaluate child nodes
-    for child in node.children:
-        total_revenue, total_profit = eval_supply_chain_cost(
-            child, total_revenue, total_profit
-        )
-    return total_revenue, total_profit
+    res = evaluate_tree_cost(node)
+    return total_revenue + res.total_revenue, total_profit + res.total_profit
 # *****************
 # network graph "node" "edge" process
 # *****************
@@ -8,14 +8,19 @@ ETL (Step 3): monthly_demand_stg → weekly_demand → lot
 """
 import argparse
 import ast
+import itertools
 import json
 import math
 import sqlite3
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Callable, Dict, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
 import numpy as np
 import pandas as pd
+from pysi.plan.demand_generate import (
+    attach_lots, flatten_lot_ids, monthly_to_weekly_values,
+)
+from pysi.io.lot_bucket_reader import LOT_TABLE, ensure_covering_indexes
 # -------------------------
 # 共有仕様（lot_id 形式など）
 # -------------------------
@@ -125,6 +130,42 @@ def lot_size_lookup_factory(conn: sqlite3.Connection) -> Callable[[str, str], in
         except Exception:
             return 1
     return f
+def lot_size_frame(conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    node_product.lot_size を (product_name, node_name, lot_size) の表で一括取得。
+    lot_size_lookup_factory の 1 行ずつ問い合わせる代わりに、週次表へ merge して使う。
+    """
+    rows = conn.execute(
+        """SELECT p.name, n.name, np.lot_size
+           FROM node_product np
+           JOIN node n ON n.id=np.node_id
+           JOIN product p ON p.id=np.product_id"""
+    ).fetchall()
+    return pd.DataFrame(rows, columns=["product_name", "node_name", "lot_size"])
+def _id_maps(conn: sqlite3.Connection, node_names: Iterable[str], product_names: Iterable[str]
+             ) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """ユニーク名ごとに 1 回だけ ensure_node / ensure_product して name→id を返す"""
+    # 出現順に ensure（新規 id の採番順は旧実装の行順と同じ）
+    node_ids = {n: ensure_node(conn, n) for n in dict.fromkeys(node_names)}
+    product_ids = {p: ensure_product(conn, p) for p in dict.fromkeys(product_names)}
+    return node_ids, product_ids
+CHUNK_ROWS = 50_000
+def _chunks(rows: Iterable[tuple], size: int = CHUNK_ROWS) -> Iterator[List[tuple]]:
+    buf: List[tuple] = []
+    for r in rows:
+        buf.append(r)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+def _executemany_chunked(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple],
+                         size: int = CHUNK_ROWS) -> int:
+    n = 0
+    for chunk in _chunks(rows, size):
+        conn.executemany(sql, chunk)
+        n += len(chunk)
+    return n
 # -------------------------
 # CSV 正規化（列ゆれ吸収）
 # -------------------------
@@ -173,70 +214,20 @@ def compute_plan_bounds(df_monthly: pd.DataFrame) -> PlanBounds:
     return PlanBounds(plan_year_st=y0, plan_range=(y1 - y0 + 1 + 1))
 def monthly_to_weekly_with_lots(
     df_monthly: pd.DataFrame,
-    lot_size_lookup: Callable[[str, str], int]
+    lot_size_lookup: Union[Callable[[str, str], int], pd.DataFrame, dict]
 ) -> Tuple[pd.DataFrame, PlanBounds]:
     """
-    - 月次を縦持ち→日次→ISO週集計
-    - S_lot = ceil(value / lot_size_lookup(prod,node))
+    - 月次 × (その月がその ISO 週に含む日数) で週次集計（日次展開なしの一括計算）
+    - S_lot = ceil(value / lot_size)（lot_size は (prod,node) 表を結合。callable ならユニーク組ごとに 1 回）
     - lot_id を NODE-PROD-YYYYWWNNNN で生成（週単位で 0001 リセット）
     戻り: df_weekly（iso_year, iso_week, value, S_lot, lot_id_list）, PlanBounds
     """
     bounds = compute_plan_bounds(df_monthly)
-    # 縦持ち
-    melt = df_monthly.melt(
-        id_vars=["product_name", "node_name", "year"],
-        var_name="month", value_name="value"
-    )
-    melt["month"] = melt["month"].str[1:].astype(int)
-    # 月→日→ISO週
-    frames = []
-    for _, r in melt.iterrows():
-        y, m, v = int(r["year"]), int(r["month"]), float(r["value"])
-        if v == 0:
-            continue
-        days = pd.Timestamp(y, m, 1).days_in_month
-        dates = pd.date_range(f"{y}-{m:02d}-01", periods=days, freq="D")
-        frames.append(pd.DataFrame({
-            "product_name": r["product_name"],
-            "node_name":    r["node_name"],
-            "date":         dates,
-            "value":        v
-        }))
-    if frames:
-        daily = pd.concat(frames, ignore_index=True)
-    else:
-        daily = pd.DataFrame(columns=["product_name","node_name","date","value"])
-    if daily.empty:
+    weekly = monthly_to_weekly_values(df_monthly)
+    if weekly.empty:
         cols = ["product_name","node_name","iso_year","iso_week","value","S_lot","lot_id_list"]
         return pd.DataFrame(columns=cols), bounds
-    iso = daily["date"].dt.isocalendar()
-    daily["iso_year"] = iso.year.astype(int)
-    daily["iso_week"] = iso.week.astype(int)
-    weekly = (
-        daily.groupby(["product_name","node_name","iso_year","iso_week"], as_index=False)["value"]
-        .sum()
-    )
-    # lot_size と S_lot
-    def _row_lot_size(row):
-        try:
-            return max(1, int(lot_size_lookup(row["product_name"], row["node_name"])))
-        except Exception:
-            return 1
-    weekly["lot_size"] = weekly.apply(_row_lot_size, axis=1)
-    weekly["S_lot"]    = (weekly["value"] / weekly["lot_size"]).apply(np.ceil).astype(int)
-    # lot_id 生成（週単位 0001 リセット）
-    def _mk_lots(row):
-        y   = int(row["iso_year"])
-        w   = int(row["iso_week"])
-        nn  = _sanitize_token(row["node_name"])
-        pn  = _sanitize_token(row["product_name"])
-        cnt = int(row["S_lot"])
-        if cnt <= 0:
-            return []
-        base = f"{nn}{LOT_SEP}{pn}{LOT_SEP}{y}{w:02d}"
-        return [f"{base}{i:04d}" for i in range(1, cnt+1)]
-    weekly["lot_id_list"] = weekly.apply(_mk_lots, axis=1)
-    return weekly, bounds
+    return attach_lots(weekly, lot_size_lookup), bounds
 # -------------------------
 # DB 書き込み（冪等）
 # -------------------------
@@ -246,87 +237,96 @@ def upsert_monthly_stg(conn: sqlite3.Connection, scenario_id: int, df_monthly: p
     事前に node/product を ensure し、node_product 行も最小作成（lot_sizeが未登録なら1）。
     """
     with conn:
-        for _, r in df_monthly.iterrows():
-            node_id = ensure_node(conn, r["node_name"])
-            product_id = ensure_product(conn, r["product_name"])
+        node_ids, product_ids = _id_maps(conn, df_monthly["node_name"], df_monthly["product_name"])
+        pairs = df_monthly[["node_name", "product_name"]].drop_duplicates()
+        for n, p in zip(pairs["node_name"], pairs["product_name"]):
             # node_product の骨だけ作る（lot_size未設定は 1）
-            upsert_node_product_params(conn, node_id, product_id)
-            vals = (
-                scenario_id, node_id, product_id, int(r["year"]),
-                float(r["m1"]),  float(r["m2"]),  float(r["m3"]),
-                float(r["m4"]),  float(r["m5"]),  float(r["m6"]),
-                float(r["m7"]),  float(r["m8"]),  float(r["m9"]),
-                float(r["m10"]), float(r["m11"]), float(r["m12"]),
-            )
-            conn.execute(
-                """INSERT INTO monthly_demand_stg
-                   (scenario_id,node_id,product_id,year,
-                    m1,m2,m3,m4,m5,m6,m7,m8,m9,m10,m11,m12)
-                   VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                   ON CONFLICT(scenario_id,node_id,product_id,year)
-                   DO UPDATE SET
-                     m1=excluded.m1, m2=excluded.m2, m3=excluded.m3, m4=excluded.m4,
-                     m5=excluded.m5, m6=excluded.m6, m7=excluded.m7, m8=excluded.m8,
-                     m9=excluded.m9, m10=excluded.m10, m11=excluded.m11, m12=excluded.m12
-                """,
-                vals,
-            )
+            upsert_node_product_params(conn, node_ids[n], product_ids[p])
+        months = df_monthly[[f"m{m}" for m in range(1, 13)]].to_numpy(dtype=float).tolist()
+        rows = (
+            (scenario_id, node_ids[n], product_ids[p], int(y), *ms)
+            for n, p, y, ms in zip(df_monthly["node_name"], df_monthly["product_name"],
+                                   df_monthly["year"], months)
+        )
+        _executemany_chunked(
+            conn,
+            """INSERT INTO monthly_demand_stg
+               (scenario_id,node_id,product_id,year,
+                m1,m2,m3,m4,m5,m6,m7,m8,m9,m10,m11,m12)
+               VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+               ON CONFLICT(scenario_id,node_id,product_id,year)
+               DO UPDATE SET
+                 m1=excluded.m1, m2=excluded.m2, m3=excluded.m3, m4=excluded.m4,
+                 m5=excluded.m5, m6=excluded.m6, m7=excluded.m7, m8=excluded.m8,
+                 m9=excluded.m9, m10=excluded.m10, m11=excluded.m11, m12=excluded.m12
+            """,
+            rows,
+        )
+def _lot_id_lists(df_weekly: pd.DataFrame) -> List[List[str]]:
+    """lot_id_list 列を list[str] の列に揃える（CSV 経由で文字列化されたものは literal_eval）"""
+    lists = []
+    for lots in df_weekly["lot_id_list"]:
+        if not isinstance(lots, list):
+            if isinstance(lots, str):
+                try:
+                    lots = ast.literal_eval(lots)
+                except Exception:
+                    lots = []
+            else:
+                lots = []
+        lists.append(lots)
+    return lists
 def upsert_weekly_and_lot(conn: sqlite3.Connection, scenario_id: int, df_weekly: pd.DataFrame):
     """
-    weekly_demand と lot を冪等UPSERT
+    weekly_demand と lot を冪等UPSERT（名前→id は一度だけ解決し、executemany をチャンクで流す）
+    lot は lot_id_list 列があればそれを正とし（呼び出し側で編集した lot も反映）、
+    無いときだけ S_lot から NODE-PRODUCT-YYYYWWNNNN を生成する。
     """
+    if df_weekly.empty:
+        return
+    ensure_covering_indexes(conn, (LOT_TABLE,))   # 読む側（lot_bucket_reader）は DDL を出さない
     with conn:
+        node_ids, product_ids = _id_maps(conn, df_weekly["node_name"], df_weekly["product_name"])
+        nid = df_weekly["node_name"].map(node_ids).astype(int).tolist()
+        pid = df_weekly["product_name"].map(product_ids).astype(int).tolist()
+        iso_year = df_weekly["iso_year"].astype(int).tolist()
+        iso_week = df_weekly["iso_week"].astype(int).tolist()
         # weekly_demand
-        w_rows = [
-            (
-                scenario_id,
-                ensure_node(conn, r["node_name"]),
-                ensure_product(conn, r["product_name"]),
-                int(r["iso_year"]), int(r["iso_week"]),
-                float(r["value"]),
-            )
-            for _, r in df_weekly.iterrows()
-        ]
-        conn.executemany(
+        _executemany_chunked(
+            conn,
             """INSERT INTO weekly_demand
                (scenario_id,node_id,product_id,iso_year,iso_week,value)
                VALUES(?,?,?,?,?,?)
                ON CONFLICT(scenario_id,node_id,product_id,iso_year,iso_week)
                DO UPDATE SET value=excluded.value
             """,
-            w_rows,
+            zip([scenario_id] * len(nid), nid, pid, iso_year, iso_week,
+                df_weekly["value"].astype(float).tolist()),
         )
         # lot（lot_id は UNIQUE 一意）
-        lot_rows = []
-        for _, r in df_weekly.iterrows():
-            node_id = ensure_node(conn, r["node_name"])
-            product_id = ensure_product(conn, r["product_name"])
-            iso_year = int(r["iso_year"])
-            iso_week = int(r["iso_week"])
-            lots = r["lot_id_list"]
-            if not isinstance(lots, list):
-                if isinstance(lots, str):
-                    try:
-                        lots = ast.literal_eval(lots)
-                    except Exception:
-                        lots = []
-                else:
-                    lots = []
-            for lot_id in lots:
-                lot_rows.append((scenario_id, node_id, product_id, iso_year, iso_week, lot_id))
-        if lot_rows:
-            conn.executemany(
-                """INSERT INTO lot(scenario_id,node_id,product_id,iso_year,iso_week,lot_id)
-                   VALUES(?,?,?,?,?,?)
-                   ON CONFLICT(lot_id) DO UPDATE SET
-                     scenario_id=excluded.scenario_id,
-                     node_id=excluded.node_id,
-                     product_id=excluded.product_id,
-                     iso_year=excluded.iso_year,
-                     iso_week=excluded.iso_week
-                """,
-                lot_rows,
-            )
+        if "lot_id_list" in df_weekly.columns:
+            lists = _lot_id_lists(df_weekly)
+            row_idx = np.repeat(np.arange(len(lists)), [len(x) for x in lists]).tolist()
+            lot_ids = list(itertools.chain.from_iterable(lists))
+        elif "S_lot" in df_weekly.columns:
+            row_idx, lot_ids = flatten_lot_ids(df_weekly)
+            row_idx = row_idx.tolist()
+        else:
+            raise ValueError("df_weekly needs a lot_id_list or S_lot column")
+        _executemany_chunked(
+            conn,
+            """INSERT INTO lot(scenario_id,node_id,product_id,iso_year,iso_week,lot_id)
+               VALUES(?,?,?,?,?,?)
+               ON CONFLICT(lot_id) DO UPDATE SET
+                 scenario_id=excluded.scenario_id,
+                 node_id=excluded.node_id,
+                 product_id=excluded.product_id,
+                 iso_year=excluded.iso_year,
+                 iso_week=excluded.iso_week
+            """,
+            ((scenario_id, nid[i], pid[i], iso_year[i], iso_week[i], lot_id)
+             for i, lot_id in zip(row_idx, lot_ids)),
+        )
 # -------------------------
 # メイン：CSV → STG → 週次 → lot
 # -------------------------
@@ -339,15 +339,14 @@ def run_etl(db_path: str, csv_path: str, scenario_name: str, default_lot_size: i
         # オプションで node_product.lot_size を一括上書き
         if default_lot_size is not None:
             # 先に node/product を作っておく
-            for _, r in df_monthly.iterrows():
-                nid = ensure_node(conn, r["node_name"])
-                pid = ensure_product(conn, r["product_name"])
-                upsert_node_product_params(conn, nid, pid, lot_size=int(default_lot_size))
+            node_ids, product_ids = _id_maps(conn, df_monthly["node_name"], df_monthly["product_name"])
+            pairs = df_monthly[["node_name", "product_name"]].drop_duplicates()
+            for n, p in zip(pairs["node_name"], pairs["product_name"]):
+                upsert_node_product_params(conn, node_ids[n], product_ids[p], lot_size=int(default_lot_size))
         # STG へ冪等投入
         upsert_monthly_stg(conn, scenario_id, df_monthly)
-        # 週次化＋lot_id生成（DBの lot_size を参照）
-        ls_lookup = lot_size_lookup_factory(conn)
-        df_weekly, _ = monthly_to_weekly_with_lots(df_monthly, ls_lookup)
+        # 週次化＋lot_id生成（DBの lot_size を表で一括取得して結合）
+        df_weekly, _ = monthly_to_weekly_with_lots(df_monthly, lot_size_frame(conn))
         # weekly_demand / lot へ冪等UPSERT
         upsert_weekly_and_lot(conn, scenario_id, df_weekly)
     print(f"[OK] ETL complete. scenario='{scenario_name}', rows_weekly={len(df_weekly)}")
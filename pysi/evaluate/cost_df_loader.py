@@ -60,7 +60,30 @@ def _validate_sum_r(df: pd.DataFrame, ratio_cols=RATIO_COLS, policy: str = "warn
 # =========================
 # メイン：DB -> cost_df
 # =========================
-def build_cost_df_from_sql(db_path: str, scenario_id: str | None = None) -> pd.DataFrame:
+def build_cost_df_from_sql(db_path: str, scenario_id: str | None = None,
+                           use_cache: bool = True) -> pd.DataFrame:
+    """
+    DB -> cost_df。入力表（node_product / price_tag / price_money_per_lot / product_edge / tariff）が
+    前回から変わっていなければ pysi.evaluate.frame_cache のフレームを再利用する（use_cache=False で毎回構築）。
+    """
+    if use_cache:
+        from pysi.evaluate.frame_cache import cached_frame
+        # SQL はシナリオに依存しないので scenario_id=None で共有（hooks にだけ scenario_id を渡す）
+        out_cost_df = cached_frame(db_path, "cost_df", lambda: _build_cost_df_from_sql(db_path))
+    else:
+        out_cost_df = _build_cost_df_from_sql(db_path)
+
+    #@261010 ADD for Hook and Plugin
+    from pysi.hooks.core import hooks
+    # df を返す直前
+    out_cost_df = hooks.apply_filters(
+    "cost_df", out_cost_df,
+    db_path=db_path, scenario_id=scenario_id, source="build_cost_df_from_sql")
+
+    return out_cost_df
+
+
+def _build_cost_df_from_sql(db_path: str) -> pd.DataFrame:
 #def build_cost_df_from_sql(db_path: str) -> pd.DataFrame:
 
     con = sqlite3.connect(db_path)
@@ -244,14 +267,6 @@ def build_cost_df_from_sql(db_path: str, scenario_id: str | None = None) -> pd.D
         warn2 = df.loc[over_cap, ["product_name","node_name"]].astype(str).agg(" / ".join, axis=1)
         print(f"[WARN] price capped to {MAX_PRICE_MULT}x parent:", list(warn2))
 
-
-    #@261010 ADD for Hook and Plugin
-    from pysi.hooks.core import hooks
-    # df を返す直前
-    out_cost_df = hooks.apply_filters(
-    "cost_df", out_cost_df,
-    db_path=db_path, scenario_id=scenario_id, source="build_cost_df_from_sql")
-
     return out_cost_df
 
 
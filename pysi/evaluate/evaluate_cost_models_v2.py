@@ -4,8 +4,10 @@
 # --------------------------------------------
 import csv
 import os
+from collections import deque
 import tkinter as tk
 from tkinter import filedialog, messagebox
+from pysi.evaluate.price_propagation import propagate_prices
 # --------------------------------------------
 # Utils
 # --------------------------------------------
@@ -50,10 +52,10 @@ def evaluate_price_TOBE(leaf_node, product_name, tariff_table):
 # 上流 -> 下流へ価格展開（RootからLeafへ）
 # --------------------------------------------
 def evaluate_price_ASIS(root_node, product_name, tariff_table):
-    queue = [root_node]
+    queue = deque([root_node])
     print(f"[ASIS Init] Root {root_node.name} offering_price = {root_node.offering_price_ASIS:.2f}")
     while queue:
-        node = queue.pop(0)
+        node = queue.popleft()
         for child in node.children:
             # 関税率を取得
             tariff_rate = get_tariff_rate(product_name, node.name, child.name, tariff_table)
@@ -183,7 +185,17 @@ def load_tariff_table_from_csv(filepath):
 # --------------------------------------------
 # 各製品について伝播実行
 # --------------------------------------------
-def run_price_and_cost_propagation(product_tree_dict, tariff_table):
+def run_price_and_cost_propagation(product_tree_dict, tariff_table, tobe_agg="last", verbose=False):
+    # 全製品を 1 パスで計算（共有する祖先を葉ごとに計算し直さない）
+    # tobe_agg: 子が複数のとき親 TOBE の決め方（"last" は旧実装の葉ごと上書きと同じ結果）
+    res = propagate_prices(product_tree_dict, tariff_table, tobe_agg=tobe_agg)
+    if verbose:
+        f = res.forest
+        for i, node in enumerate(f.nodes):
+            print(f"[Price] {f.products[i]} {node.name} : TOBE = {res.offering_price_TOBE[i]:.2f}"
+                  f" ASIS = {res.offering_price_ASIS[i]:.2f}")
+    return res
+def run_price_and_cost_propagation_OLD(product_tree_dict, tariff_table):
     for product_name, tree in product_tree_dict.items():
         leaf_nodes = find_leaf_nodes(tree)
         #leaf_nodes = find_leaf_nodes(tree.root_node_outbound)
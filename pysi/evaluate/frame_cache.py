@@ -0,0 +1,174 @@
+# pysi/evaluate/frame_cache.py
+# cost_df / offering price フレームのプロセス内キャッシュ
+#
+# 旧: build_offering_price_frame → build_cost_df_from_sql（node_product / price_tag / price_money_per_lot /
+#     product_edge / tariff の多段 JOIN）を、save_run_results や GUI の比較ポップアップが呼ぶたびに作り直す
+# 新: (db_path, 種類, scenario_id, 引数, データ版) をキーにフレームを保持し、入力表が変わっていなければ再利用する
+#
+# データ版:
+#   - 入力表に AFTER INSERT/UPDATE/DELETE トリガを張り、data_rev(table_name, rev) を加算する（表ごとの変更カウンタ）
+#   - トリガはスキーマ作成/移行時に ensure_change_counters() で張る（persist_all_psi / rebuild_pmpl / CLI --install）
+#   - 版の読み取りは読み取り専用接続の SELECT だけ（読む側では DDL を発行しない）
+#   - 版 = (PRAGMA schema_version, data_rev の全行)。表の作成/削除は schema_version で検知
+#   - PRAGMA data_version は接続ごとの値で、毎回接続を開き直すローダ間では比べられないため使わない
+#   - カウンタ未導入（または入力表の一部に未導入）の DB は DB / -wal ファイルの (mtime_ns, size) で代用
+# 明示的な無効化: 入力表を書く処理（rebuild_pmpl / persist_all_psi など）は invalidate_frames(db_path) を呼ぶ
+#
+#使い方
+#
+#from pysi.evaluate.frame_cache import cached_frame, invalidate_frames, frame_cache
+#df = cached_frame(db_path, "cost_df", lambda: _build(db_path), scenario_id=sid)
+#invalidate_frames(db_path)        # 入力を書き換えた後
+#print(frame_cache.stats())
+#
+#python -m pysi.evaluate.frame_cache --install var/psi.sqlite   # 既存 DB にカウンタを導入（移行）
+
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# cost_df / offering price が読む表
+INPUT_TABLES = (
+    "node_product",
+    "price_tag",
+    "price_money_per_lot",
+    "product_edge",
+    "tariff",
+    "scenario_price_tag",
+)
+REV_TABLE = "data_rev"
+_EVENTS = ("insert", "update", "delete")
+
+
+def _missing_counters(names, tables=INPUT_TABLES):
+    return [(t, ev) for t in tables if t in names for ev in _EVENTS
+            if f"trg_rev_{t}_{ev}" not in names]
+
+
+def ensure_change_counters(con: sqlite3.Connection, tables=INPUT_TABLES) -> None:
+    """data_rev と入力表のトリガを（無ければ）作成する。スキーマ作成/移行時・書き込み側で呼ぶ"""
+    names = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table','trigger')")}
+    todo = _missing_counters(names, tables)
+    if REV_TABLE in names and not todo:
+        return
+    with con:
+        con.execute(f"""
+            CREATE TABLE IF NOT EXISTS {REV_TABLE}(
+              table_name TEXT PRIMARY KEY,
+              rev INTEGER NOT NULL DEFAULT 0
+            )""")
+        for t, ev in todo:
+            con.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_rev_{t}_{ev} AFTER {ev.upper()} ON {t}
+                BEGIN
+                  INSERT INTO {REV_TABLE}(table_name, rev) VALUES('{t}', 1)
+                  ON CONFLICT(table_name) DO UPDATE SET rev = rev + 1;
+                END""")
+
+
+def _file_stamp(path: str) -> Tuple:
+    out = []
+    for p in (path, path + "-wal"):
+        try:
+            st = os.stat(p)
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+def data_version(db_path: str) -> Tuple:
+    """入力表のデータ版（変わっていなければ同じ値）。読み取り専用接続で SELECT するだけ"""
+    try:
+        con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=1.0)
+        try:
+            names = {r[0] for r in con.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table','trigger')")}
+            if REV_TABLE in names and not _missing_counters(names):
+                sv = con.execute("PRAGMA schema_version").fetchone()[0]
+                revs = tuple(con.execute(f"SELECT table_name, rev FROM {REV_TABLE} ORDER BY table_name"))
+                return ("rev", sv, revs)
+        finally:
+            con.close()
+    except sqlite3.Error:
+        pass
+    return ("stat",) + _file_stamp(db_path)
+
+
+class FrameCache:
+    """LRU のフレームキャッシュ。返すのは常にコピー（呼び出し側が書き換えても中身は変わらない）"""
+
+    def __init__(self, maxsize: int = 32) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple, Tuple[Tuple, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _path(db_path: Optional[str]) -> Optional[str]:
+        if not db_path or db_path == ":memory:" or str(db_path).startswith("file:"):
+            return None
+        p = os.path.abspath(db_path)
+        return p if os.path.exists(p) else None
+
+    def get_or_build(self, db_path: str, kind: str, builder: Callable[[], Any], *,
+                     scenario_id: Optional[Hashable] = None, params: Tuple = ()) -> Any:
+        path = self._path(db_path)
+        if path is None:                      # 未作成 / メモリ DB はキャッシュしない
+            return builder()
+        ver = data_version(path)
+        key = (path, kind, scenario_id, params)
+        with self._lock:
+            ent = self._data.get(key)
+            if ent is not None and ent[0] == ver:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return ent[1].copy()
+            self.misses += 1
+        df = builder()
+        # 構築中に入力が書き換わった場合も、構築前の版で登録しておけば次回は作り直しになる
+        with self._lock:
+            self._data[key] = (ver, df)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return df.copy()
+
+    def invalidate(self, db_path: Optional[str] = None, kind: Optional[str] = None) -> int:
+        """db_path / kind に一致するエントリを捨てる（両方 None なら全部）"""
+        path = os.path.abspath(db_path) if db_path else None
+        with self._lock:
+            drop = [k for k in self._data
+                    if (path is None or k[0] == path) and (kind is None or k[1] == kind)]
+            for k in drop:
+                del self._data[k]
+        return len(drop)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+frame_cache = FrameCache()
+
+
+def cached_frame(db_path: str, kind: str, builder: Callable[[], Any], *,
+                 scenario_id: Optional[Hashable] = None, params: Tuple = ()) -> Any:
+    return frame_cache.get_or_build(db_path, kind, builder, scenario_id=scenario_id, params=params)
+
+
+def invalidate_frames(db_path: Optional[str] = None, kind: Optional[str] = None) -> int:
+    return frame_cache.invalidate(db_path, kind)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="cost_df / offering price frame cache の変更カウンタ")
+    ap.add_argument("--install", metavar="DB", required=True, help="data_rev とトリガを導入する DB")
+    args = ap.parse_args()
+    with sqlite3.connect(args.install) as con:
+        ensure_change_counters(con)
+    print(f"[OK] change counters installed: {args.install}")
@@ -300,6 +300,37 @@ def build_offering_price_frame(
     prefer_calc_as_is: bool = True,
     tobe_mode: str = "root_scale",  # 'none' | 'root_scale'
     scenario_id: Optional[str] = None,  # ★ 追加：シナリオID（Noneなら通常読み）
+    use_cache: bool = True,
+) -> "pd.DataFrame":
+    """
+    製品×ノードの offering_price（ASIS/TOBE）。入力表が前回から変わっていなければ
+    pysi.evaluate.frame_cache のフレームを再利用する（use_cache=False で毎回構築）。
+    """
+    def _build():
+        return _build_offering_price_frame(db_path, prefer_calc_as_is, tobe_mode, scenario_id)
+
+    if use_cache:
+        from pysi.evaluate.frame_cache import cached_frame
+        df = cached_frame(db_path, "offering_price", _build, scenario_id=scenario_id,
+                          params=(bool(prefer_calc_as_is), tobe_mode))
+    else:
+        df = _build()
+
+    #@251010 ADD for Hook and Plugin
+    from pysi.hooks.core import hooks
+    # df を返す直前
+    df = hooks.apply_filters(
+        "offering_price_df", df,
+        db_path=db_path, scenario_id=scenario_id, source="build_offering_price_frame"
+    )
+    return df
+
+
+def _build_offering_price_frame(
+    db_path: str,
+    prefer_calc_as_is: bool = True,
+    tobe_mode: str = "root_scale",
+    scenario_id: Optional[str] = None,
 ) -> "pd.DataFrame":
     """
     製品×ノードの offering_price（ASIS/TOBE）を組み立てて返す。
@@ -452,14 +483,4 @@ def build_offering_price_frame(
     ]].copy()
 
     df = df.sort_values(["product_name", "depth", "node_name"], kind="mergesort").reset_index(drop=True)
-
-    #@251010 ADD for Hook and Plugin
-    from pysi.hooks.core import hooks
-    # df を返す直前
-    df = hooks.apply_filters(
-        "offering_price_df", df,
-        db_path=db_path, scenario_id=scenario_id, source="build_offering_price_frame"
-    )
-
-
     return df
@@ -6,6 +6,9 @@
 #
 ## すべて上書き（CSVの矛盾を消してクリーンにしたい時）
 #python -m pysi.evaluate.pmpl_propagate --db .\var\psi.sqlite --mode both --overwrite
+#
+## 多段伝播（ASIS の無い中間ノードも解決）＋ 前回以降に変わった製品だけ再計算
+#python -m pysi.evaluate.pmpl_propagate --db .\var\psi.sqlite --mode both --multilevel --incremental
 #GUI 側では build_cost_df_from_sql() の前に 一行呼べばOK：
 #from pysi.evaluate.pmpl_propagate import rebuild_pmpl
 #rebuild_pmpl(db_path, mode="both", overwrite=False)
@@ -25,7 +28,9 @@
 # pysi/evaluate/pmpl_propagate.py
 import sqlite3
 import argparse
+import json
 from typing import Iterable, Tuple, Dict, Any
+from pysi.evaluate.frame_cache import ensure_change_counters, invalidate_frames
 def _exec(conn: sqlite3.Connection, sql: str, args: Iterable[Tuple]=()):
     cur = conn.cursor()
     if args:
@@ -178,30 +183,307 @@ def propagate_inbound(conn: sqlite3.Connection, overwrite: bool=False) -> int:
         upserts.append((node, prod, dm, tf))
     _upsert_pmpl(conn, upserts, overwrite=overwrite)
     return len(upserts)
-def rebuild_pmpl(db_path: str, mode: str="both", overwrite: bool=False) -> Dict[str, Any]:
+# ---------- 多段伝播（再帰CTE + ステージング + 一括 upsert） ----------
+# 旧: propagate_outbound / propagate_inbound は 1 hop だけ（親ASIS → 子DM/関税）、_upsert_pmpl で 1 行ずつ
+# 新: OUT/IN とも 1 本の WITH RECURSIVE で多段を解決し、TEMP テーブルに溜めてから 1 文で upsert
+#   OUT: ASIS の無い中間ノードは親から導出して下流へ流す（evaluate_price_ASIS と同じ式）
+#          ASIS(child) = ASIS(parent) * (1 + rate) + ASIS(parent) * other(child) / 100
+#          other = node_product の cs_logistics_costs + cs_warehouse_cost + cs_fixed_cost + cs_profit
+#   IN : ASIS の無い部品はさらに下位の部品へ展開し、bom_qty と (1 + other/100 + rate) を掛けながら
+#        ASIS を持つ部品（または末端）まで辿って合計する（ASIS = DM * (1 + other/100) + 関税 と同じ）
+#   multilevel=False なら 1 hop のみ（旧 propagate_outbound / propagate_inbound と同じ値）
+#
+# 差分更新（incremental=True）:
+#   price_tag / tariff / product_edge / node_product のトリガで変更のあった製品を pmpl_dirty に記録し、
+#   次回はその製品だけ再計算する（初回はトリガを張ってから全製品を計算）
+#   前回のビルド条件（multilevel / overwrite / max_depth）を pmpl_build_meta に残し、
+#   条件が変わったときは dirty に関係なく全製品を計算し直す
+#   トリガは incremental=True で呼んだときだけ張る。外すときは drop_change_tracking(conn)
+PMPL_MAX_DEPTH = 32
+_TRACKED = {
+    # table: トリガの WHEN 条件（NEW/OLD の置き換え前）
+    "price_tag": "{r}.tag = 'ASIS'",
+    "tariff": None,
+    "product_edge": None,
+    "node_product": None,
+}
+_OTHER_COLS = ("cs_logistics_costs", "cs_warehouse_cost", "cs_fixed_cost", "cs_profit")
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+def ensure_change_tracking(conn: sqlite3.Connection) -> bool:
+    """pmpl_dirty とトリガを作成。既に張ってあれば True（= 前回以降の変更が記録されている）"""
+    installed = _table_exists(conn, "pmpl_dirty")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pmpl_dirty(
+          product_name TEXT NOT NULL,
+          mode TEXT NOT NULL CHECK(mode IN ('out','in')),
+          PRIMARY KEY(product_name, mode)
+        )""")
+    for table, cond in _TRACKED.items():
+        if not _table_exists(conn, table) or not _table_has_column(conn, table, "product_name"):
+            continue
+        for ev, refs in (("INSERT", ("NEW",)), ("UPDATE", ("OLD", "NEW")), ("DELETE", ("OLD",))):
+            when = ""
+            if cond:
+                when = "WHEN " + " OR ".join(cond.format(r=r) for r in refs)
+            vals = ",".join(f"({r}.product_name,'{m}')" for r in refs for m in ("out", "in"))
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_pmpl_{table}_{ev.lower()}
+                AFTER {ev} ON {table} {when}
+                BEGIN
+                  INSERT OR IGNORE INTO pmpl_dirty(product_name, mode) VALUES {vals};
+                END""")
+    conn.commit()
+    return installed
+def drop_change_tracking(conn: sqlite3.Connection) -> int:
+    """ensure_change_tracking で張ったトリガと pmpl_dirty / pmpl_build_meta を削除。戻り値は削除したトリガ数"""
+    names = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_pmpl_%'")]
+    with conn:
+        for name in names:
+            conn.execute(f'DROP TRIGGER IF EXISTS "{name}"')
+        conn.execute("DROP TABLE IF EXISTS pmpl_dirty")
+        conn.execute("DROP TABLE IF EXISTS pmpl_build_meta")
+    return len(names)
+def _build_params(*, multilevel: bool, overwrite: bool, max_depth: int) -> str:
+    return json.dumps({"multilevel": bool(multilevel), "overwrite": bool(overwrite),
+                       "max_depth": int(max_depth) if multilevel else 1}, sort_keys=True)
+def _last_build_params(conn: sqlite3.Connection, mode: str):
+    if not _table_exists(conn, "pmpl_build_meta"):
+        return None
+    row = conn.execute("SELECT params FROM pmpl_build_meta WHERE mode=?", (mode,)).fetchone()
+    return row[0] if row else None
+def _save_build_params(conn: sqlite3.Connection, mode: str, params: str) -> None:
+    """変更記録が有効な DB だけ、直近のビルド条件を残す"""
+    if not _table_exists(conn, "pmpl_dirty"):
+        return
+    with conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS pmpl_build_meta(
+                          mode TEXT PRIMARY KEY CHECK(mode IN ('out','in')), params TEXT NOT NULL)""")
+        conn.execute("INSERT OR REPLACE INTO pmpl_build_meta(mode, params) VALUES (?,?)", (mode, params))
+def _dirty_products(conn: sqlite3.Connection, mode: str) -> list[str]:
+    return [r[0] for r in conn.execute(
+        "SELECT product_name FROM pmpl_dirty WHERE mode=? ORDER BY product_name", (mode,))]
+def _clear_dirty(conn: sqlite3.Connection, mode: str, products) -> None:
+    if not _table_exists(conn, "pmpl_dirty"):
+        return
+    if products is None:
+        conn.execute("DELETE FROM pmpl_dirty WHERE mode=?", (mode,))
+    else:
+        conn.executemany("DELETE FROM pmpl_dirty WHERE mode=? AND product_name=?",
+                         [(mode, p) for p in products])
+def _node_other_cte(conn: sqlite3.Connection) -> str:
+    """node_product の cs_* 合計（無ければ空集合）"""
+    if _table_exists(conn, "node_product"):
+        cols = [c for c in _OTHER_COLS if _table_has_column(conn, "node_product", c)]
+        if cols:
+            expr = " + ".join(f"COALESCE({c},0.0)" for c in cols)
+            return f"SELECT node_name, product_name, {expr} AS other FROM node_product"
+    return "SELECT NULL AS node_name, NULL AS product_name, 0.0 AS other WHERE 0"
+def _stage_products(conn: sqlite3.Connection, products) -> str:
+    """対象製品の絞り込み条件（products=None なら全製品）"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _pmpl_products(product_name TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp._pmpl_products")
+    if products is None:
+        return "1"
+    conn.executemany("INSERT OR IGNORE INTO temp._pmpl_products VALUES (?)", [(p,) for p in products])
+    return "pe.product_name IN (SELECT product_name FROM temp._pmpl_products)"
+def _stage_outbound(conn: sqlite3.Connection, *, multilevel: bool, max_depth: int, where: str) -> None:
+    conn.execute(f"""
+    INSERT INTO temp._pmpl_stage(node_name, product_name, dm, tf)
+    WITH RECURSIVE
+    node_other AS ({_node_other_cte(conn)}),
+    walk(product_name, parent_name, child_name, p_asis, rate, depth) AS (
+      -- 起点: 1 hop モードは全エッジ、多段モードは ASIS を持つ親 / root から出るエッジ
+      SELECT pe.product_name, pe.parent_name, pe.child_name,
+             COALESCE(ptp.price, 0.0), COALESCE(t.tariff_rate, 0.0), 1
+        FROM product_edge pe
+        LEFT JOIN price_tag ptp
+          ON ptp.product_name = pe.product_name AND ptp.node_name = pe.parent_name AND ptp.tag = 'ASIS'
+        LEFT JOIN tariff t
+          ON t.product_name = pe.product_name AND t.from_node = pe.parent_name AND t.to_node = pe.child_name
+       WHERE pe.bound = 'OUT' AND ({where})
+         AND (:ml = 0 OR ptp.price > 0 OR NOT EXISTS (
+               SELECT 1 FROM product_edge up
+                WHERE up.product_name = pe.product_name AND up.bound = 'OUT'
+                  AND up.child_name = pe.parent_name))
+      UNION ALL
+      -- ASIS の無い子は導出 ASIS を持って孫へ
+      SELECT w.product_name, w.child_name, pe.child_name,
+             w.p_asis * (1 + w.rate) + w.p_asis * COALESCE(o.other, 0.0) / 100,
+             COALESCE(t.tariff_rate, 0.0), w.depth + 1
+        FROM walk w
+        JOIN product_edge pe
+          ON pe.product_name = w.product_name AND pe.bound = 'OUT' AND pe.parent_name = w.child_name
+        LEFT JOIN price_tag ptc
+          ON ptc.product_name = w.product_name AND ptc.node_name = w.child_name AND ptc.tag = 'ASIS'
+        LEFT JOIN node_other o
+          ON o.product_name = w.product_name AND o.node_name = w.child_name
+        LEFT JOIN tariff t
+          ON t.product_name = pe.product_name AND t.from_node = pe.parent_name AND t.to_node = pe.child_name
+       WHERE :ml = 1 AND w.depth < :max_depth AND (ptc.price IS NULL OR ptc.price <= 0)
+    ),
+    ranked AS (
+      -- 親が複数ある子は親名 → 深さの順で先頭を採用（決定的）
+      SELECT product_name, child_name, p_asis, rate,
+             ROW_NUMBER() OVER (PARTITION BY product_name, child_name
+                                ORDER BY parent_name, depth, p_asis) AS rn
+        FROM walk
+    )
+    SELECT child_name, product_name, p_asis, p_asis * rate FROM ranked WHERE rn = 1
+    """, {"ml": int(multilevel), "max_depth": int(max_depth)})
+def _stage_inbound(conn: sqlite3.Connection, *, multilevel: bool, max_depth: int, where: str) -> None:
+    bom = "COALESCE(pe.bom_qty, 1.0)" if _table_has_column(conn, "product_edge", "bom_qty") else "1.0"
+    conn.execute(f"""
+    INSERT INTO temp._pmpl_stage(node_name, product_name, dm, tf)
+    WITH RECURSIVE
+    node_other AS ({_node_other_cte(conn)}),
+    walk(product_name, node_name, frontier, r0, mult, depth) AS (
+      -- 起点: 親 ← 子 の各エッジ（r0 = 子→親の関税率、mult = bom_qty）
+      SELECT pe.product_name, pe.parent_name, pe.child_name,
+             COALESCE(t.tariff_rate, 0.0), {bom}, 1
+        FROM product_edge pe
+        LEFT JOIN tariff t
+          ON t.product_name = pe.product_name AND t.from_node = pe.child_name AND t.to_node = pe.parent_name
+       WHERE pe.bound = 'IN' AND ({where})
+      UNION ALL
+      -- ASIS の無い部品はその部品表へ展開
+      SELECT w.product_name, w.node_name, pe.child_name, w.r0,
+             w.mult * {bom} * (1 + COALESCE(o.other, 0.0) / 100 + COALESCE(t.tariff_rate, 0.0)),
+             w.depth + 1
+        FROM walk w
+        JOIN product_edge pe
+          ON pe.product_name = w.product_name AND pe.bound = 'IN' AND pe.parent_name = w.frontier
+        LEFT JOIN price_tag ptf
+          ON ptf.product_name = w.product_name AND ptf.node_name = w.frontier AND ptf.tag = 'ASIS'
+        LEFT JOIN node_other o
+          ON o.product_name = w.product_name AND o.node_name = w.frontier
+        LEFT JOIN tariff t
+          ON t.product_name = pe.product_name AND t.from_node = pe.child_name AND t.to_node = pe.parent_name
+       WHERE :ml = 1 AND w.depth < :max_depth AND (ptf.price IS NULL OR ptf.price <= 0)
+    )
+    SELECT w.node_name, w.product_name,
+           SUM( COALESCE(ptf.price, 0.0) * w.mult ),
+           SUM( COALESCE(ptf.price, 0.0) * w.r0 * w.mult )
+      FROM walk w
+      LEFT JOIN price_tag ptf
+        ON ptf.product_name = w.product_name AND ptf.node_name = w.frontier AND ptf.tag = 'ASIS'
+     GROUP BY w.product_name, w.node_name
+    """, {"ml": int(multilevel), "max_depth": int(max_depth)})
+def _merge_stage(conn: sqlite3.Connection, overwrite: bool) -> int:
+    """TEMP の _pmpl_stage を price_money_per_lot へ一括 upsert（overwrite=False は既存の正値を維持）"""
+    keep = "COALESCE(price_money_per_lot.{c}, 0.0) > 0.0 AND NOT :ow"
+    params = {"ow": int(overwrite)}
+    try:
+        conn.execute(f"""
+            INSERT INTO price_money_per_lot(node_name, product_name, direct_materials_costs, tariff_cost)
+            SELECT node_name, product_name, dm, tf FROM temp._pmpl_stage WHERE 1
+            ON CONFLICT(node_name, product_name) DO UPDATE SET
+              direct_materials_costs = CASE WHEN {keep.format(c='direct_materials_costs')}
+                                            THEN price_money_per_lot.direct_materials_costs
+                                            ELSE excluded.direct_materials_costs END,
+              tariff_cost = CASE WHEN {keep.format(c='tariff_cost')}
+                                 THEN price_money_per_lot.tariff_cost
+                                 ELSE excluded.tariff_cost END
+        """, params)
+    except sqlite3.OperationalError:
+        # (node_name, product_name) に一意制約の無い古い DB: UPDATE → 未登録分を INSERT
+        for c, v in (("direct_materials_costs", "dm"), ("tariff_cost", "tf")):
+            conn.execute(f"""
+                UPDATE price_money_per_lot
+                   SET {c} = (SELECT s.{v} FROM temp._pmpl_stage s
+                               WHERE s.node_name = price_money_per_lot.node_name
+                                 AND s.product_name = price_money_per_lot.product_name)
+                 WHERE EXISTS (SELECT 1 FROM temp._pmpl_stage s
+                                WHERE s.node_name = price_money_per_lot.node_name
+                                  AND s.product_name = price_money_per_lot.product_name)
+                   AND NOT ({keep.format(c=c)})
+            """, params)
+        conn.execute("""
+            INSERT INTO price_money_per_lot(node_name, product_name, direct_materials_costs, tariff_cost)
+            SELECT s.node_name, s.product_name, s.dm, s.tf FROM temp._pmpl_stage s
+             WHERE NOT EXISTS (SELECT 1 FROM price_money_per_lot m
+                                WHERE m.node_name = s.node_name AND m.product_name = s.product_name)
+        """)
+    return conn.execute("SELECT COUNT(*) FROM temp._pmpl_stage").fetchone()[0]
+def propagate_sql(conn: sqlite3.Connection, mode: str, *, overwrite: bool=False, multilevel: bool=True,
+                  products=None, max_depth: int=PMPL_MAX_DEPTH) -> int:
+    """
+    mode='out' | 'in' を 1 本の再帰CTEで計算し、ステージング経由で一括 upsert する。
+    products: 対象製品（None なら全製品）。戻り値は更新対象の行数。
+    """
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _pmpl_stage(
+          node_name TEXT, product_name TEXT, dm REAL, tf REAL,
+          PRIMARY KEY(node_name, product_name))""")
+    conn.execute("DELETE FROM temp._pmpl_stage")
+    where = _stage_products(conn, products)
+    stage = _stage_outbound if mode == "out" else _stage_inbound
+    with conn:
+        stage(conn, multilevel=multilevel, max_depth=max_depth, where=where)
+        n = _merge_stage(conn, overwrite)
+        _clear_dirty(conn, mode, products)
+    return n
+def rebuild_pmpl(db_path: str, mode: str="both", overwrite: bool=False,
+                 multilevel: bool=False, incremental: bool=False,
+                 max_depth: int=PMPL_MAX_DEPTH) -> Dict[str, Any]:
     """
     mode: 'out' | 'in' | 'both'
     overwrite: 既存PMPLを上書きするか（Falseなら空/0のみ更新）
+    multilevel: True なら再帰CTEで多段伝播（ASIS の無い中間ノードを導出）
+    incremental: True なら前回以降に price_tag / tariff / product_edge / node_product が変わった製品だけ再計算
+                 （再帰CTE版で実行。初回は変更記録用のトリガを張って全製品を計算。
+                  前回と multilevel / overwrite / max_depth が違えば全製品を計算し直す）
     """
     conn = sqlite3.connect(db_path)
     try:
         _ensure_tables(conn)
-        cnt_out = cnt_in = 0
-        if mode in ("out","both"):
-            cnt_out = propagate_outbound(conn, overwrite=overwrite)
-        if mode in ("in","both"):
-            cnt_in = propagate_inbound(conn, overwrite=overwrite)
-        return {"updated_out": cnt_out, "updated_in": cnt_in}
+        ensure_change_counters(conn)   # frame_cache の版カウンタ（書き込み側で張る）
+        modes = [m for m in ("out", "in") if mode in (m, "both")]
+        if not (multilevel or incremental):
+            cnt = {"out": 0, "in": 0}
+            params = _build_params(multilevel=False, overwrite=overwrite, max_depth=1)
+            if "out" in modes:
+                cnt["out"] = propagate_outbound(conn, overwrite=overwrite)
+                _save_build_params(conn, "out", params)
+            if "in" in modes:
+                cnt["in"] = propagate_inbound(conn, overwrite=overwrite)
+                _save_build_params(conn, "in", params)
+            return {"updated_out": cnt["out"], "updated_in": cnt["in"]}
+        tracked = ensure_change_tracking(conn) if incremental else False
+        params = _build_params(multilevel=multilevel, overwrite=overwrite, max_depth=max_depth)
+        res: Dict[str, Any] = {"updated_out": 0, "updated_in": 0}
+        for m in modes:
+            # ビルド条件が前回と違えば dirty は当てにならない → 全製品
+            same = _last_build_params(conn, m) == params
+            products = _dirty_products(conn, m) if (tracked and same) else None
+            if products == []:
+                res[f"products_{m}"] = []
+                continue
+            res[f"updated_{m}"] = propagate_sql(conn, m, overwrite=overwrite, multilevel=multilevel,
+                                                products=products, max_depth=max_depth)
+            res[f"products_{m}"] = products  # None = 全製品
+            _save_build_params(conn, m, params)
+        return res
     finally:
         conn.close()
+        invalidate_frames(db_path)   # price_money_per_lot を書いたので cost_df / offering price を捨てる
 # ---------- CLI ----------
 def _parse_args():
     p = argparse.ArgumentParser()
     p.add_argument("--db", required=True, help="Path to psi.sqlite")
     p.add_argument("--mode", default="both", choices=["out","in","both"])
     p.add_argument("--overwrite", action="store_true", help="Overwrite existing PMPL values")
+    p.add_argument("--multilevel", action="store_true", help="Resolve multi-level OUT/IN chains (recursive CTE)")
+    p.add_argument("--incremental", action="store_true", help="Only products changed since the last rebuild")
+    p.add_argument("--drop-tracking", action="store_true", help="Remove the incremental-mode triggers and exit")
     return p.parse_args()
 if __name__ == "__main__":
     args = _parse_args()
-    res = rebuild_pmpl(args.db, mode=args.mode, overwrite=args.overwrite)
+    if args.drop_tracking:
+        with sqlite3.connect(args.db) as _c:
+            print(f"[PMPL] dropped {drop_change_tracking(_c)} triggers")
+        raise SystemExit(0)
+    res = rebuild_pmpl(args.db, mode=args.mode, overwrite=args.overwrite,
+                       multilevel=args.multilevel, incremental=args.incremental)
     print(f"[PMPL] done. OUT={res['updated_out']}, IN={res['updated_in']}")
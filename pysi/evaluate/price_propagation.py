@@ -0,0 +1,242 @@
+# pysi/evaluate/price_propagation.py
+# TOBE / ASIS 価格伝播を全製品まとめて 1 パスで行う
+#
+# 旧: run_price_and_cost_propagation → 葉ごとに evaluate_price_TOBE で leaf→root を遡り、
+#     共有する祖先を葉の数だけ計算し直して上書き（O(葉 × 深さ)、1 hop ごとに print）。
+#     evaluate_price_ASIS は queue.pop(0) の BFS、関税率は hop ごとに tariff_table を引く
+# 新: 全製品ツリーを「深さ別の index 配列」を持つ 1 本のフォレスト配列に平坦化し、
+#     TOBE は最深段 → root、ASIS は root → 最深段へ、段ごとに numpy で一括計算（O(ノード数)）。
+#     関税率は TariffIndex（product → {(from, to): rate}）から構築時に 1 回だけ引く
+#
+# 複数の子が親の TOBE を別々に示すときの集約（tobe_agg）:
+#   "last"  : children の最後の子の値（旧実装で最後に上書きした葉の系列と同じ結果。既定）
+#   "first" : children の最初の子の値
+#   "min" / "max" / "mean" : 子の候補値の最小 / 最大 / 平均
+# いずれも children の並びだけで決まるので、実行順に依存しない。
+#
+# 計算式は旧実装と同じ（cs_* は price=100 とする比率）:
+#   other          = cs_logistics_costs + cs_warehouse_cost + cs_fixed_cost + cs_profit
+#   TOBE: parent   = child_TOBE * (1 - other/100) / (1 + rate(parent, child))
+#         tariff_cost(child) = rate * child_TOBE
+#   ASIS: direct_materials_costs(child) = parent_ASIS * (1 + rate)
+#         child_ASIS = direct_materials_costs + parent_ASIS * other / 100
+#         tariff_cost(child) = rate * parent_ASIS
+#
+#使い方
+#
+#from pysi.evaluate.price_propagation import propagate_prices
+#res = propagate_prices(prod_tree_dict_OT, tariff_table)          # ノードへ書き戻し
+#df  = propagate_prices(prod_tree_dict_OT, tariff_table, write_back=False).to_frame()
+
+from __future__ import annotations
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+TOBE_AGG = ("last", "first", "min", "max", "mean")
+OTHER_COST_ATTRS = ("cs_logistics_costs", "cs_warehouse_cost", "cs_fixed_cost", "cs_profit")
+
+
+class TariffIndex:
+    """(product, from_node, to_node) → 関税率 を製品ごとのハッシュに分けて持つ"""
+
+    def __init__(self) -> None:
+        self._by_product: Dict[str, Dict[Tuple[str, str], float]] = {}
+
+    @classmethod
+    def from_table(cls, tariff_table: Optional[Mapping[Tuple[str, str, str], float]]) -> "TariffIndex":
+        idx = cls()
+        for (prod, frm, to), rate in (tariff_table or {}).items():
+            idx._by_product.setdefault(prod, {})[(frm, to)] = float(rate)
+        return idx
+
+    def rate(self, product_name: str, from_node: str, to_node: str) -> float:
+        # get_tariff_rate と同じく問い合わせ側だけ strip する
+        m = self._by_product.get(product_name.strip())
+        if not m:
+            return 0.0
+        return m.get((from_node.strip(), to_node.strip()), 0.0)
+
+    def for_product(self, product_name: str) -> Dict[Tuple[str, str], float]:
+        return self._by_product.get(product_name.strip(), {})
+
+
+def _num(n, attr: str) -> float:
+    return float(getattr(n, attr, 0) or 0)
+
+
+class PriceForest:
+    """
+    product_tree_dict（{product: root}）を配列へ平坦化したもの。
+    行は製品ごとの BFS 順を製品順に連結した並び。levels[d] は深さ d の行番号。
+    ツリー形状と cs_* / 関税率が変わらない限り、価格だけ変えて何度でも evaluate できる。
+    """
+
+    def __init__(self, product_tree_dict: Mapping[str, Any], tariff_table=None) -> None:
+        tariff = tariff_table if isinstance(tariff_table, TariffIndex) else TariffIndex.from_table(tariff_table)
+        nodes: List[Any] = []
+        products: List[str] = []
+        parent: List[int] = []
+        depth: List[int] = []
+        rate: List[float] = []
+        first: List[bool] = []
+        last: List[bool] = []
+        for prod, root in product_tree_dict.items():
+            if root is None:
+                continue
+            rates = tariff.for_product(prod)
+            base = len(nodes)
+            nodes.append(root); products.append(prod); parent.append(-1); depth.append(0)
+            rate.append(0.0); first.append(False); last.append(False)
+            head = base
+            while head < len(nodes):                     # BFS（nodes 自体をキューに使う）
+                n = nodes[head]
+                kids = getattr(n, "children", None) or []
+                for k, ch in enumerate(kids):
+                    nodes.append(ch); products.append(prod); parent.append(head)
+                    depth.append(depth[head] + 1)
+                    rate.append(rates.get((n.name.strip(), ch.name.strip()), 0.0))
+                    first.append(k == 0); last.append(k == len(kids) - 1)
+                head += 1
+
+        self.nodes = nodes
+        self.products = products
+        self.parent = np.asarray(parent, dtype=np.int64)
+        self.depth = np.asarray(depth, dtype=np.int64)
+        self.rate = np.asarray(rate, dtype=np.float64)
+        self.is_first = np.asarray(first, dtype=bool)
+        self.is_last = np.asarray(last, dtype=bool)
+        self.is_root = self.parent < 0
+        self.is_leaf = np.ones(len(nodes), dtype=bool)
+        self.is_leaf[self.parent[~self.is_root]] = False
+        # 旧コードと同じ順に足す
+        o = np.zeros(len(nodes), dtype=np.float64)
+        for a in OTHER_COST_ATTRS:
+            o = o + np.fromiter((_num(n, a) for n in nodes), dtype=np.float64, count=len(nodes))
+        self.other = o
+        max_d = int(self.depth.max()) if len(nodes) else -1
+        order = np.argsort(self.depth, kind="stable")
+        cuts = np.searchsorted(self.depth[order], np.arange(max_d + 2))
+        self.levels = [order[cuts[d]:cuts[d + 1]] for d in range(max_d + 1)]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    # ---- TOBE（葉 → root）----
+    def eval_tobe(self, leaf_tobe: Optional[np.ndarray] = None, *, agg: str = "last") -> np.ndarray:
+        """
+        葉の TOBE（省略時はノードの offering_price_TOBE）から全ノードの TOBE を返す。
+        子を持つノードの値は子からの候補値を agg で集約したもので置き換える。
+        """
+        if agg not in TOBE_AGG:
+            raise ValueError(f"unknown tobe_agg={agg} (choose from {TOBE_AGG})")
+        if leaf_tobe is None:
+            leaf_tobe = np.fromiter((_num(n, "offering_price_TOBE") for n in self.nodes),
+                                    dtype=np.float64, count=len(self))
+        T = np.array(leaf_tobe, dtype=np.float64, copy=True)
+        for lv in reversed(self.levels[1:]):
+            par = self.parent[lv]
+            cand = T[lv] * (1 - self.other[lv] / 100) / (1 + self.rate[lv])
+            if agg == "last":
+                m = self.is_last[lv]
+                T[par[m]] = cand[m]
+            elif agg == "first":
+                m = self.is_first[lv]
+                T[par[m]] = cand[m]
+            else:
+                ps = np.unique(par)
+                if agg == "min":
+                    acc = np.full(len(self), np.inf); np.minimum.at(acc, par, cand)
+                elif agg == "max":
+                    acc = np.full(len(self), -np.inf); np.maximum.at(acc, par, cand)
+                else:
+                    acc = np.zeros(len(self)); np.add.at(acc, par, cand)
+                    acc[ps] /= np.bincount(par, minlength=len(self))[ps]
+                T[ps] = acc[ps]
+        return T
+
+    # ---- ASIS（root → 葉）----
+    def eval_asis(self, root_asis: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """root の ASIS（省略時はノードの offering_price_ASIS）から (ASIS, direct_materials_costs, tariff_cost)"""
+        n = len(self)
+        if root_asis is None:
+            root_asis = np.fromiter((_num(x, "offering_price_ASIS") for x in self.nodes),
+                                    dtype=np.float64, count=n)
+        A = np.array(root_asis, dtype=np.float64, copy=True)
+        dmc = np.zeros(n, dtype=np.float64)
+        tcost = np.zeros(n, dtype=np.float64)
+        for lv in self.levels[1:]:
+            P = A[self.parent[lv]]
+            r = self.rate[lv]
+            dmc[lv] = P * (1 + r)
+            A[lv] = dmc[lv] + P * self.other[lv] / 100
+            tcost[lv] = r * P
+        return A, dmc, tcost
+
+
+class PriceResult:
+    """propagate_prices の結果（行は PriceForest と同じ並び）"""
+
+    def __init__(self, forest: PriceForest, tobe: Optional[np.ndarray],
+                 asis: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> None:
+        self.forest = forest
+        self.offering_price_TOBE = tobe
+        self.offering_price_ASIS, self.direct_materials_costs, self.tariff_cost = (
+            asis if asis is not None else (None, None, None))
+        if asis is None and tobe is not None:
+            self.tariff_cost = forest.rate * tobe
+        self.tariff_rate = forest.rate
+
+    def write_back(self) -> None:
+        """旧実装と同じ属性をノードへ書く（TOBE は子を持つノードのみ、ASIS 系は root 以外）"""
+        f = self.forest
+        T = None if self.offering_price_TOBE is None else self.offering_price_TOBE.tolist()
+        A = None if self.offering_price_ASIS is None else self.offering_price_ASIS.tolist()
+        D = None if self.direct_materials_costs is None else self.direct_materials_costs.tolist()
+        C = None if self.tariff_cost is None else self.tariff_cost.tolist()
+        R = self.tariff_rate.tolist()
+        is_root = f.is_root.tolist()
+        is_leaf = f.is_leaf.tolist()
+        for i, n in enumerate(f.nodes):
+            if T is not None and not is_leaf[i]:
+                n.offering_price_TOBE = T[i]
+            if is_root[i]:
+                continue
+            n.tariff_rate = R[i]
+            if C is not None:
+                n.tariff_cost = C[i]
+            if A is not None:
+                n.direct_materials_costs = D[i]
+                n.offering_price_ASIS = A[i]
+
+    def to_frame(self):
+        import pandas as pd
+        f = self.forest
+        cols: Dict[str, Any] = {
+            "product_name": f.products,
+            "node_name": [n.name for n in f.nodes],
+            "depth": f.depth,
+            "tariff_rate": self.tariff_rate,
+        }
+        for k in ("offering_price_TOBE", "offering_price_ASIS", "direct_materials_costs", "tariff_cost"):
+            v = getattr(self, k)
+            if v is not None:
+                cols[k] = v
+        return pd.DataFrame(cols)
+
+
+def propagate_prices(product_tree_dict: Mapping[str, Any], tariff_table=None, *,
+                     tobe: bool = True, asis: bool = True, tobe_agg: str = "last",
+                     write_back: bool = True) -> PriceResult:
+    """
+    全製品の TOBE（葉 → root）と ASIS（root → 葉）を 1 パスずつで計算する。
+    tariff_table は {(product, from, to): rate} または TariffIndex。
+    tobe と asis を両方行うと tariff_cost は ASIS 側の値になる（旧 run_price_and_cost_propagation と同じ）。
+    """
+    forest = PriceForest(product_tree_dict, tariff_table)
+    T = forest.eval_tobe(agg=tobe_agg) if tobe else None
+    A = forest.eval_asis() if asis else None
+    res = PriceResult(forest, T, A)
+    if write_back:
+        res.write_back()
+    return res
@@ -0,0 +1,176 @@
+# pysi/evaluate/tree_cost_eval.py
+# ツリー（フォレスト）全ノードのコスト評価を配列でまとめて行う
+#
+# 旧: eval_supply_chain_cost → node.set_lot_counts() / node.EvalPlanSIP_cost() をノードごとに再帰呼び出し
+#     （eval_cs_* を 1 項目ずつ L * cs_* で計算し、ノードごとにデバッグ出力）
+# 新: 全ノードの lot 数・在庫数と cs_* 比率を (ノード × 項目) の行列に集め、
+#     eval_cs_* / 在庫係数 / cost_total / profit を数回の配列演算で計算する。
+#     結果は CostEvalResult に保持し、write_back() でノード属性へ書き戻す（遅延可）。
+#
+# 計算式は Node.EvalPlanSIP_cost と同じ:
+#   eval_cs_x        = L * cs_x                      （L = lot_counts_all = 供給 P の総ロット数）
+#   eval_cs_warehouse_cost *= 1 + I_supply / I_demand（I_demand = 0 のときは係数 0）
+#   eval_cs_cost_total = COST_TOTAL_FIELDS の合計
+#   eval_cs_profit     = eval_cs_price_sales_shipped - eval_cs_cost_total
+
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from pysi.core.psi_store import bucket_counts
+
+# L を掛ける cs_* 項目（この順で行列の列になる）
+EVAL_FIELDS = (
+    "price_sales_shipped",
+    "cost_total",
+    "profit",
+    "marketing_promotion",
+    "sales_admin_cost",
+    "SGA_total",
+    "logistics_costs",
+    "warehouse_cost",
+    "direct_materials_costs",
+    "tax_portion",
+    "purchase_total_cost",
+    "prod_indirect_labor",
+    "prod_indirect_others",
+    "direct_labor_costs",
+    "depreciation_others",
+    "manufacturing_overhead",
+)
+# eval_cs_cost_total に積む項目（SGA_total / purchase_total_cost / manufacturing_overhead は二重計上になるので除く）
+COST_TOTAL_FIELDS = (
+    "marketing_promotion",
+    "sales_admin_cost",
+    "tax_portion",
+    "logistics_costs",
+    "warehouse_cost",
+    "direct_materials_costs",
+    "prod_indirect_labor",
+    "prod_indirect_others",
+    "direct_labor_costs",
+    "depreciation_others",
+)
+_COL = {f: i for i, f in enumerate(EVAL_FIELDS)}
+
+
+def _iter_preorder(roots) -> Iterator[Any]:
+    """root / [root, ...] / {key: root} を前順（親 → 子、children の順）で列挙"""
+    if isinstance(roots, dict):
+        roots = list(roots.values())
+    elif not isinstance(roots, (list, tuple)):
+        roots = [roots]
+    for root in roots:
+        st = [root]
+        while st:
+            n = st.pop()
+            if n is None:
+                continue
+            yield n
+            st.extend(reversed(getattr(n, "children", []) or []))
+
+
+class CostEvalResult:
+    """評価結果の入れ物。行は nodes の順（ツリー評価では前順）"""
+
+    def __init__(self, nodes: List[Any], lot_counts: Optional[List[List[int]]],
+                 L: np.ndarray, I_supply: np.ndarray, I_demand: np.ndarray,
+                 I_coeff: np.ndarray, values: np.ndarray) -> None:
+        self.nodes = nodes
+        self.names = [n.name for n in nodes]
+        self.lot_counts = lot_counts
+        self.L = L
+        self.I_supply = I_supply
+        self.I_demand = I_demand
+        self.I_coeff = I_coeff
+        self.values = values                       # (nodes, len(EVAL_FIELDS)) の eval_cs_*
+        self.revenue = values[:, _COL["price_sales_shipped"]]
+        self.profit = values[:, _COL["profit"]]
+
+    @property
+    def total_revenue(self) -> float:
+        # 旧 eval_supply_chain_cost と同じく前から順に足す
+        return sum(self.revenue.tolist(), 0)
+
+    @property
+    def total_profit(self) -> float:
+        return sum(self.profit.tolist(), 0)
+
+    def column(self, field: str) -> np.ndarray:
+        """eval_cs_<field> の列（例: column("warehouse_cost")）"""
+        return self.values[:, _COL[field]]
+
+    def node_row(self, name: str) -> Dict[str, float]:
+        i = self.names.index(name)
+        return {f"eval_cs_{f}": float(v) for f, v in zip(EVAL_FIELDS, self.values[i].tolist())}
+
+    def write_back(self, *, revenue_profit: bool = False) -> None:
+        """eval_cs_* と（数え直した場合は）lot_counts / lot_counts_all をノードへ書き戻す"""
+        attrs = [f"eval_cs_{f}" for f in EVAL_FIELDS]
+        rows = self.values.tolist()
+        L = self.L.tolist()
+        for i, n in enumerate(self.nodes):
+            if self.lot_counts is not None:
+                n.lot_counts = self.lot_counts[i]
+                n.lot_counts_all = L[i]
+            for a, v in zip(attrs, rows[i]):
+                setattr(n, a, v)
+            if revenue_profit:
+                n.revenue = rows[i][_COL["price_sales_shipped"]]
+                n.profit = rows[i][_COL["profit"]]
+
+
+def _ratio_matrix(nodes: Sequence[Any]) -> np.ndarray:
+    get = getattr
+    return np.array([[get(n, f"cs_{f}", 0) or 0 for f in EVAL_FIELDS] for n in nodes],
+                    dtype=np.float64).reshape(len(nodes), len(EVAL_FIELDS))
+
+
+def evaluate_nodes_cost(nodes: Iterable[Any], *, count_lots: bool = True,
+                        write_back: bool = True, revenue_profit: bool = False) -> CostEvalResult:
+    """
+    nodes の eval_cs_* をまとめて計算する。
+    - count_lots=True : set_lot_counts と同じく psi4supply の P から L を数え直す
+                        False なら各ノードの lot_counts_all をそのまま使う（EvalPlanSIP_cost 相当）
+    - write_back=False: 計算だけ行い、書き戻しは呼び出し側が result.write_back() で行う
+    """
+    nodes = list(nodes)
+    n = len(nodes)
+    lot_counts: Optional[List[List[int]]] = None
+    if count_lots:
+        lot_counts = [bucket_counts(nd.psi4supply, 3) for nd in nodes]
+        L = np.fromiter((sum(c) for c in lot_counts), dtype=np.float64, count=n)
+    else:
+        L = np.fromiter((nd.lot_counts_all for nd in nodes), dtype=np.float64, count=n)
+
+    # 在庫係数（I_lot_counts_all と同じく両レイヤの短い方の長さまで）
+    I_sup = np.empty(n, dtype=np.float64)
+    I_dem = np.empty(n, dtype=np.float64)
+    for i, nd in enumerate(nodes):
+        k = min(len(nd.psi4demand), len(nd.psi4supply))
+        I_sup[i] = sum(bucket_counts(nd.psi4supply, 2)[:k])
+        I_dem[i] = sum(bucket_counts(nd.psi4demand, 2)[:k])
+    coeff = np.divide(I_sup, I_dem, out=np.zeros(n, dtype=np.float64), where=I_dem != 0)
+
+    values = L[:, None] * _ratio_matrix(nodes)
+    values[:, _COL["warehouse_cost"]] *= 1 + coeff
+    total = values[:, _COL[COST_TOTAL_FIELDS[0]]].copy()
+    for f in COST_TOTAL_FIELDS[1:]:                # 旧コードと同じ順に足す
+        total += values[:, _COL[f]]
+    values[:, _COL["cost_total"]] = total
+    values[:, _COL["profit"]] = values[:, _COL["price_sales_shipped"]] - total
+
+    res = CostEvalResult(nodes, lot_counts, L.astype(np.int64), I_sup, I_dem, coeff, values)
+    if write_back:
+        res.write_back(revenue_profit=revenue_profit)
+    return res
+
+
+def evaluate_tree_cost(roots, *, write_back: bool = True) -> CostEvalResult:
+    """
+    ツリー（root / [root, ...] / {product: root}）全ノードを一括評価する。
+    eval_supply_chain_cost と同じく lot 数を数え直し、node.revenue / node.profit も書き戻す。
+    """
+    return evaluate_nodes_cost(_iter_preorder(roots), count_lots=True,
+                               write_back=write_back, revenue_profit=True)
@@ -61,6 +61,9 @@ from pysi.utils.file_io import *
 from pysi.utils.calendar445 import Calendar445
 from pysi.plan.demand_generate import convert_monthly_to_weekly
 from pysi.plan.operations import *
+from pysi.plan.flow_optimizer import resolve_graph
+from pysi.plan.operations import count_lots_by_year
+from pysi.core.psi_snapshot import take_snapshot, restore_snapshot, save_snapshot, load_snapshot, snapshot_path
 # "plan.demand_processing" is merged in "plan.operations"
 #from plan.demand_processing import *
 #from pysi.plan.demand_processing import set_df_Slots2psi4demand
@@ -72,6 +75,7 @@ from pysi.network.tree import *
 #from PSI_plan.planning_operation import calcS2P, set_S2psi, get_set_childrenP2S2psi, calc_all_psi2i4demand, calcPS2I4demand
 from pysi.evaluate.evaluate_cost_models_v2 import gui_run_initial_propagation, propagate_cost_to_plan_nodes, load_tobe_prices, assign_tobe_prices_to_leaf_nodes, load_asis_prices, assign_asis_prices_to_root_nodes
 from pysi.gui.app_FastNetworkViewer import FastNetworkViewer
+from pysi.gui.network_view import NetworkView, classify_edges
 #from pysi.gui.app_NetworkGraphApp import NetworkGraphApp
 # app.py 先頭の import に追記
 #from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
@@ -128,6 +132,7 @@ except Exception:
 # Planning Engine
 # ********************************
 from pysi.plan.engines import run_engine
+from pysi.gui.psi_chart_data import PSIChartData, chart_series, node_psi_counts, tree_psi_counts
 from pysi.plan import engines as eng
 #@NO USE
 # from pysi.network.node_base import eval_supply_chain_cost
@@ -301,17 +306,8 @@ def make_psi_space_dict(node, node_psi_dict, plan_range):
 # 生産平準化の前処理　ロット・カウント
 # *******************
 def count_lots_yyyy(psi_list, yyyy_str):
-    matrix = psi_list
-    # 共通の文字列をカウントするための変数を初期化
-    count_common_string = 0
-    # Step 1: マトリクス内の各要素の文字列をループで調べる
-    for row in matrix:
-        for element in row:
-            # Step 2: 各要素内の文字列が "2023" を含むかどうかを判定
-            if yyyy_str in element:
-                # Step 3: 含む場合はカウンターを増やす
-                count_common_string += 1
-    return count_common_string
+    # 年別の lot 数は lot_ID 末尾の ISO 年で 1 パス集計（count_lots_by_year）
+    return count_lots_by_year(psi_list, [yyyy_str])[0]
 def is_52_or_53_week_year(year):
     # 指定された年の12月31日を取得
     last_day_of_year = dt.date(year, 12, 31)
@@ -425,9 +421,9 @@ def demand_leveling_on_ship(root_node_outbound, pre_prod_week, year_st, year_end
     # 開始年を取得する
     plan_year_st = year_st  # 開始年のセット in main()要修正
     #for yyyy in range(plan_year_st, plan_year_st + plan_range + 1):
-    for yyyy in range(int(plan_year_st), int(plan_year_st + plan_range + 1)):
-        year_lots = count_lots_yyyy(S_list, str(yyyy))
-        year_lots_list.append(year_lots)
+    # 年別 lot 数は lot 台帳の年列から一括で数える（年ごとの全 lot 走査はしない）
+    year_lots_list = count_lots_by_year(
+        S_list, range(int(plan_year_st), int(plan_year_st + plan_range + 1)))
     #        # 結果を出力
     #       #print(yyyy, " year carrying lots:", year_lots)
     #
@@ -842,38 +838,21 @@ def map_psi_lots2df(node, D_S_flag, psi_lots):
 # **************************
 # collect_psi_data
 # **************************
-def collect_psi_data(node, D_S_flag, week_start, week_end, psi_data):
+def collect_psi_data(node, D_S_flag, week_start, week_end, psi_data, tree_counts=None):
+    """
+    ノードの週次 I/P/S 件数を psi_data に積む。
+    tree_counts（psi_chart_data.TreeCounts）を渡せばツリー走査を共有できる。
+    """
     if D_S_flag not in ["demand", "supply"]:
         print("error: D_S_flag should be 'demand' or 'supply'")
         return
-    psi_lots = []
-    df_plan = map_psi_lots2df(node, D_S_flag, psi_lots)
-    if df_plan.empty:
+    tc = tree_counts if tree_counts is not None else tree_psi_counts(node, D_S_flag)
+    if not tc.subtree_total.get(node.name):
         print(f"[{node.name}] No data for PSI ({D_S_flag})")
         return
-    # week_end の範囲を調整（データ内最大weekに合わせる）
-    max_week = df_plan["week"].max()
-    week_end = min(week_end, max_week)
-    df_filtered = df_plan[
-        (df_plan["node_name"] == node.name) &
-        (df_plan["week"] >= week_start) &
-        (df_plan["week"] <= week_end)
-    ]
-    print(f"[{node.name}] PSI df shape: {df_filtered.shape}")
-    print(df_filtered[df_filtered["s-co-i-p"] == 3].head())  # P
-    print(df_filtered[df_filtered["s-co-i-p"] == 2].head())  # I
-    print(df_filtered[df_filtered["s-co-i-p"] == 0].head())  # S
-    # 分割＆集計
-    line_data_2I = df_filtered[df_filtered["s-co-i-p"] == 2]
-    bar_data_0S = df_filtered[df_filtered["s-co-i-p"] == 0]
-    bar_data_3P = df_filtered[df_filtered["s-co-i-p"] == 3]
-    line_plot_data_2I = line_data_2I.groupby("week")["lot_id"].count()
-    bar_plot_data_3P = bar_data_3P.groupby("week")["lot_id"].count()
-    bar_plot_data_0S = bar_data_0S.groupby("week")["lot_id"].count()
-    # インデックスはintに（描画エラー防止）
-    line_plot_data_2I.index = line_plot_data_2I.index.astype(int)
-    bar_plot_data_3P.index = bar_plot_data_3P.index.astype(int)
-    bar_plot_data_0S.index = bar_plot_data_0S.index.astype(int)
+    line_plot_data_2I, bar_plot_data_3P, bar_plot_data_0S = chart_series(
+        tc.counts[node.name], week_start, week_end
+    )
     # 指標評価
     revenue = round(getattr(node, "eval_cs_price_sales_shipped", 0))
     profit = round(getattr(node, "eval_cs_profit", 0))
@@ -883,27 +862,15 @@ def collect_psi_data(node, D_S_flag, week_start, week_end, psi_data):
         line_plot_data_2I, bar_plot_data_3P, bar_plot_data_0S
     ))
 # node is "node_opt"
-def collect_psi_data_opt(node, node_out, D_S_flag, week_start, week_end, psi_data):
-    if D_S_flag == "demand":
-        psi_lots = []
-        df_demand_plan = map_psi_lots2df(node, D_S_flag, psi_lots)
-        df_init = df_demand_plan
-    elif D_S_flag == "supply":
-        psi_lots = []
-        df_supply_plan = map_psi_lots2df(node, D_S_flag, psi_lots)
-        df_init = df_supply_plan
-    else:
+def collect_psi_data_opt(node, node_out, D_S_flag, week_start, week_end, psi_data, tree_counts=None):
+    if D_S_flag not in ["demand", "supply"]:
         print("error: D_S_flag should be demand or supply")
         return
-    condition1 = df_init["node_name"] == node.name
-    condition2 = (df_init["week"] >= week_start) & (df_init["week"] <= week_end)
-    df = df_init[condition1 & condition2]
-    line_data_2I = df[df["s-co-i-p"].isin([2])]
-    bar_data_0S = df[df["s-co-i-p"] == 0]
-    bar_data_3P = df[df["s-co-i-p"] == 3]
-    line_plot_data_2I = line_data_2I.groupby("week")["lot_id"].count()
-    bar_plot_data_3P = bar_data_3P.groupby("week")["lot_id"].count()
-    bar_plot_data_0S = bar_data_0S.groupby("week")["lot_id"].count()
+    if tree_counts is not None and node.name in tree_counts.counts:
+        counts = tree_counts.counts[node.name]
+    else:
+        counts = node_psi_counts(node, D_S_flag)
+    line_plot_data_2I, bar_plot_data_3P, bar_plot_data_0S = chart_series(counts, week_start, week_end)
     # ノードのREVENUEとPROFITを四捨五入
     # root_out_optからroot_outboundの世界へ変換する
     #@241225 be checked
@@ -1018,6 +985,7 @@ class PSIPlannerApp4save:
         self.pos_E2E = None
         self.flowDict_opt = {} #None
         self.flowCost_opt = {} #None
+        self.flow_net = None   # FlowNetwork（run_optimization で再利用）
         self.total_supply_plan = 0
         # loading files
         self.directory = None
@@ -1372,6 +1340,7 @@ class PSIPlannerApp:
         self.pos_E2E = None
         self.flowDict_opt = {} #None
         self.flowCost_opt = {} #None
+        self.flow_net = None   # FlowNetwork（run_optimization で再利用）
         self.total_supply_plan = 0
         # loading files
         self.directory = None
@@ -1741,6 +1710,18 @@ class PSIPlannerApp:
         self.fig_network   = fig
         self.ax_network    = ax
         self.canvas_network= cv
+    # --- ネットワーク描画レイヤ（ax_network / canvas_network が作り直されたら作り直す） ---
+    def _network_view(self):
+        self._ensure_network_axes()
+        view = getattr(self, "_net_view", None)
+        if view is None or view.ax is not self.ax_network or view.canvas is not self.canvas_network:
+            if view is not None:
+                view.disconnect()
+            view = NetworkView(self.ax_network, self.canvas_network)
+            view.connect_click(self.on_plot_click)   # クリックは 1 回だけ接続
+            view.enable_hover()                      # hover 注釈（ノード名・次数）
+            self._net_view = view
+        return view
     # PSIPlannerApp クラス内に1本だけ
     def _ensure_psi_area(self, parent):
         import tkinter as tk
@@ -2251,7 +2232,8 @@ class PSIPlannerApp:
                 dbp,
                 sid,
                 label=f"{sid or 'BASE'} (GUI)",
-                cost_df_override=getattr(self, "cost_df", None)  # ★ GUIの円グラフに使っている cost_df を優先
+                cost_df_override=getattr(self, "cost_df", None),  # ★ GUIの円グラフに使っている cost_df を優先
+                psi_trees=getattr(self, "prod_tree_dict_OT", None),  # 週次 PSI 数量も保存（比較時に再計画しない）
             )
             print("[OK] saved run:", run_id)
         except Exception as e:
@@ -4243,6 +4225,7 @@ class PSIPlannerApp:
 
     # --- 追加：①②③④⑤を一括実行し、評価とビュー更新まで行う ---
     def _run_planning_sequence(self, *, use_selected_decouples: bool = True):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         import pysi.plan.engines as eng
 
         # roots
@@ -4772,6 +4755,7 @@ class PSIPlannerApp:
 #@250630 STOP GO
 
     def load_data_files(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         directory = filedialog.askdirectory(title="Select Data Directory")
         if directory:
             try:
@@ -5394,6 +5378,7 @@ class PSIPlannerApp:
         # 6. 完了メッセージの表示
         messagebox.showinfo("Save Completed", "Plan data save is completed")
     def load_data(self, load_directory):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         with open(os.path.join(load_directory, 'psi_planner_app.pkl'), "rb") as f:
             loaded_attributes = pickle.load(f)
     #@ STOP this is a sample code for "fixed file"
@@ -6450,6 +6435,7 @@ class PSIPlannerApp:
     #def demand_planning(self):
     #    pass
     def demand_planning(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         # Implement forward planning logic here
         print("Forward planning executed.")
         #@240903@241106
@@ -6462,6 +6448,7 @@ class PSIPlannerApp:
         #self.root.after(1000, self.show_psi_graph)
         #self.show_psi_graph() # this event do not live
     def demand_planning4multi_product(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         # Implement forward planning logic here
         print("demand_planning4multi_product planning executed.")
         #@250730 ADD multi_product Focus on Selected Product # root is "supply_point"
@@ -6586,17 +6573,35 @@ class PSIPlannerApp:
         self.root.after(1000, self.show_psi_by_product("outbound", "supply", self.product_selected))
         #self.root.after(1000, self.show_psi_graph)
     def psi_backup(self, node, status_name):
-        return copy.deepcopy(node)
+        # Node は複製せず、PSI レイヤだけを列指向スナップショットに取る（直前の取得との差分）
+        snap = take_snapshot(node, base=getattr(self, "_psi_last_snapshot", None))
+        self._psi_last_snapshot = snap
+        return node, snap
     def psi_restore(self, node_backup, status_name):
-        return copy.deepcopy(node_backup)
+        # 指紋の違うセルだけを書き戻して、同じ root を返す
+        node, snap = node_backup
+        restore_snapshot(node, snap)
+        return node
     def psi_backup_to_file(self, node, filename):
-        with open(filename, 'wb') as file:
-            pickle.dump(node, file)
+        backup = self.psi_backup(node, filename)
+        if not hasattr(self, "_psi_file_backups"):
+            self._psi_file_backups = {}
+        self._psi_file_backups[filename] = backup
+        save_snapshot(backup[1], snapshot_path(filename))
     def psi_restore_from_file(self, filename):
-        with open(filename, 'rb') as file:
+        # 同じセッションで取ったものはメモリ上の差分から、それ以外は mmap したファイルから戻す
+        backup = getattr(self, "_psi_file_backups", {}).get(filename)
+        if backup is not None:
+            return self.psi_restore(backup, filename)
+        path = snapshot_path(filename)
+        if os.path.isdir(path) and self.root_node_outbound is not None:
+            restore_snapshot(self.root_node_outbound, load_snapshot(path))
+            return self.root_node_outbound
+        with open(filename, 'rb') as file:   # 旧形式（Node の pickle）
             node_backup = pickle.load(file)
         return node_backup
     def supply_planning4multi_product(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         #@250730 ADD multi_product Focus on Selected Product # root is "supply_point"
         self.root_node_outbound_byprod = self.prod_tree_dict_OT[self.product_selected]
         self.root_node_inbound_byprod  = self.prod_tree_dict_IN[self.product_selected]
@@ -6644,6 +6649,7 @@ class PSIPlannerApp:
         self.root.after(1000, self.show_psi_by_product("outbound", "supply", self.product_selected))
         #self.root.after(1000, self.show_psi("outbound", "supply"))
     def supply_planning(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         # Check if the necessary data is loaded
         if self.root_node_outbound is None or self.nodes_outbound is None:
             print("Error: PSI Plan data is not loaded. Please load the data first.")
@@ -6706,6 +6712,7 @@ class PSIPlannerApp:
         self.display_decoupling_patterns()
         # PSI area => move to selected_node in window
     def optimize_network(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         # Check if the necessary data is loaded
         if self.root_node_outbound is None or self.nodes_outbound is None:
             print("Error: PSI Plan data is not loaded. Please load the data first.")
@@ -6927,9 +6934,14 @@ class PSIPlannerApp:
         # ************************************
         # optimize network
         # ************************************
+        # 初回は nx.network_simplex（コールドではこちらが速い）。解いた網は self.flow_net に残し、
+        # 2 回目以降は変わった容量・重み・需要だけ差し替えて前回解から解き直す
         try:
-            flowCost_opt, flowDict_opt = nx.network_simplex(G)
+            self.flow_net, flowCost_opt, flowDict_opt = resolve_graph(
+                G, getattr(self, "flow_net", None), warm_start=self.flowDict_opt or True
+            )
         except Exception as e:
+            self.flow_net = None   # 途中で失敗した網は次回作り直す
             print("Error during optimization:", e)
             return
         self.flowCost_opt = flowCost_opt
@@ -7063,6 +7075,7 @@ class PSIPlannerApp:
 
 
     def _run_engine_gui(self, mode: str, layer: str):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
 
         prod, out_root, in_root = self._get_roots()
         
@@ -7208,36 +7221,13 @@ class PSIPlannerApp:
             fontsize=10
         )
         self.ax_network.axis('off')
-        # ノードの形状と色
-        node_shapes = ['v' if node in self.decouple_node_selected else 'o' for node in G.nodes()]
-        node_colors = ['brown' if node in self.decouple_node_selected else 'lightblue' for node in G.nodes()]
-        # ノード描画
-        for node, shape, color in zip(G.nodes(), node_shapes, node_colors):
-            nx.draw_networkx_nodes(G, pos_E2E, nodelist=[node], node_size=50, node_color=color, node_shape=shape, ax=self.ax_network)
-        # エッジ描画
-        for edge in G.edges():
-            if edge[0] == "procurement_office" or edge[1] == "sales_office":
-                edge_color = 'lightgrey'
-            elif edge in Gdm.edges():
-                edge_color = 'blue'
-            elif edge in Gsp.edges():
-                edge_color = 'green'
-            else:
-                edge_color = 'lightgrey'
-            nx.draw_networkx_edges(G, pos_E2E, edgelist=[edge], edge_color=edge_color, arrows=False, ax=self.ax_network, width=0.5)
-        # 最適化パス（赤線）
-        for from_node, flows in flowDict_opt.items():
-            for to_node, flow in flows.items():
-                if flow > 0:
-                    nx.draw_networkx_edges(self.G, pos_E2E, edgelist=[(from_node, to_node)], ax=self.ax_network, edge_color='red', arrows=False, width=0.5)
-        # ノードラベル
-        node_labels = {node: f"{node}" for node in G.nodes()}
-        nx.draw_networkx_labels(G, pos_E2E, labels=node_labels, font_size=10, ax=self.ax_network)
-        # キャンバス更新
-        self.canvas_network.draw()
-        #@STOP
-        #plt.close(self.fig_network)  # メモリ解放のため閉じる
-        self.canvas_network.mpl_connect('button_press_event', self.on_plot_click)
+        # ノード（形状ごとに 1 collection）・エッジ（色ごとに 1 collection）・最適化パス（赤線）をまとめて描画
+        self._network_view().draw(
+            G, pos_E2E,
+            edge_colors=classify_edges(G, Gdm, Gsp),
+            decouple=self.decouple_node_selected,
+            flow=flowDict_opt, flow_width=0.5,
+        )
     def make_highlight_flow(self, prod_tree_OT, prod_tree_IN):
         """
         指定された product の tree 構造 (outbound + inbound) の root PlanNode から、
@@ -7297,53 +7287,13 @@ class PSIPlannerApp:
         #self._set_network_title()
         #if hasattr(self, "canvas_network"):
         #    self.canvas_network.draw_idle()
-        # ノードの形状と色
-        node_shapes = ['v' if node in self.decouple_node_selected else 'o' for node in G.nodes()]
-        node_colors = ['brown' if node in self.decouple_node_selected else 'lightblue' for node in G.nodes()]
-        # ノード描画
-        for node, shape, color in zip(G.nodes(), node_shapes, node_colors):
-            nx.draw_networkx_nodes(G, pos_E2E, nodelist=[node], node_size=50, node_color=color, node_shape=shape, ax=self.ax_network)
-        # エッジ描画
-        for edge in G.edges():
-            if edge[0] == "procurement_office" or edge[1] == "sales_office":
-                edge_color = 'lightgrey'
-            elif edge in Gdm.edges():
-                edge_color = 'blue'
-            elif edge in Gsp.edges():
-                edge_color = 'green'
-            else:
-                edge_color = 'lightgrey'
-            nx.draw_networkx_edges(G, pos_E2E, edgelist=[edge], edge_color=edge_color, arrows=False, ax=self.ax_network, width=0.5)
-        #@STOP
-        ## 最適化パス（赤線）
-        #for from_node, flows in flowDict_opt.items():
-        #    for to_node, flow in flows.items():
-        #        if flow > 0:
-        #            nx.draw_networkx_edges(self.G, pos_E2E, edgelist=[(from_node, to_node)], ax=self.ax_network, edge_color='red', arrows=False, width=0.5)
-        #@ STOP 描画関数の外に出す
-        ## red line 描画用 flow 構造に変換
-        #highlight_flow = self.make_highlight_flow(prod_tree_OT, prod_tree_IN)
-        # flow に従って赤線を描画
-        for from_node, flows in highlight_flow.items():
-            for to_node, flow in flows.items():
-                if flow > 0:
-                    nx.draw_networkx_edges(
-                        self.G,
-                        pos_E2E,
-                        edgelist=[(from_node, to_node)],
-                        ax=self.ax_network,
-                        edge_color='red',
-                        arrows=False,
-                        width=1.0
-                    )
-        # ノードラベル
-        node_labels = {node: f"{node}" for node in G.nodes()}
-        nx.draw_networkx_labels(G, pos_E2E, labels=node_labels, font_size=10, ax=self.ax_network)
-        # キャンバス更新
-        self.canvas_network.draw()
-        #@STOP
-        #plt.close(self.fig_network)  # メモリ解放のため閉じる
-        self.canvas_network.mpl_connect('button_press_event', self.on_plot_click)
+        # ノード・エッジ・製品フロー（赤線）をまとめて描画
+        self._network_view().draw(
+            G, pos_E2E,
+            edge_colors=classify_edges(G, Gdm, Gsp),
+            decouple=decouple_set,
+            flow=highlight_flow, flow_width=1.0,
+        )
     def show_info_graph(self, node_info, select_node):
         # 既存のウィンドウを再利用または作成
         if self.info_window is None or not tk.Toplevel.winfo_exists(self.info_window):
@@ -7391,14 +7341,18 @@ class PSIPlannerApp:
     def on_plot_click(self, event):
         if event.xdata is None or event.ydata is None:
             return
-        # 最も近いノードを検索
-        min_dist = float('inf')
-        closest_node = None
-        for node, (nx_pos, ny_pos) in self.pos_E2E.items():
-            dist = np.sqrt((event.xdata - nx_pos) ** 2 + (event.ydata - ny_pos) ** 2)
-            if dist < min_dist:
-                min_dist = dist
-                closest_node = node
+        # 最も近いノードを検索（描画レイヤの KD-tree / 一括距離計算）
+        view = getattr(self, "_net_view", None)
+        if view is not None and view.nodes:
+            closest_node, min_dist = view.nearest(event.xdata, event.ydata)
+        else:
+            min_dist = float('inf')
+            closest_node = None
+            for node, (nx_pos, ny_pos) in self.pos_E2E.items():
+                dist = np.sqrt((event.xdata - nx_pos) ** 2 + (event.ydata - ny_pos) ** 2)
+                if dist < min_dist:
+                    min_dist = dist
+                    closest_node = node
         if closest_node and min_dist < 0.5:
             # ノード情報の取得
             select_node = None
@@ -7411,6 +7365,8 @@ class PSIPlannerApp:
                 return
             #@250801 ADD
             self.select_node = select_node
+            if view is not None:
+                view.annotate(closest_node, f"{closest_node}")   # 注釈だけ blit（全体は再描画しない）
             plan_node = select_node.sku_dict[self.product_selected]
             print("select_node plan_node =", select_node.name, plan_node.name)
             # ノード情報文字列の作成
@@ -7894,6 +7850,7 @@ class PSIPlannerApp:
         confirm_button.pack()
         subroot.protocol("WM_DELETE_WINDOW", on_confirm)
     def execute_selected_pattern(self):
+        self._psi_chart_data().invalidate()  # PSI グラフの件数キャッシュを破棄
         decouple_node_names = self.decouple_node_selected
         # PSI計画の状態をリストア
         self.root_node_outbound = self.psi_restore_from_file('psi_backup.pkl')
@@ -8755,9 +8712,8 @@ class PSIPlannerApp:
             S_list = count_lots_on_S_psi4demand(root_node_out_opt, S_list)
             plan_year_st = year_st
             #for yyyy in range(plan_year_st, plan_year_st + plan_range + 1):
-            for yyyy in range(int(plan_year_st), int(plan_year_st + plan_range + 1)):
-                year_lots4S = count_lots_yyyy(S_list, str(yyyy))
-                year_lots_list4S.append(year_lots4S)
+            year_lots_list4S = count_lots_by_year(
+                S_list, range(int(plan_year_st), int(plan_year_st + plan_range + 1)))
             #@241205 STOP NOT change "global_market_potential" at 2nd loading
             ## 値をインスタンス変数に保存
             #self.global_market_potential = year_lots_list4S[1]
@@ -8802,9 +8758,8 @@ class PSIPlannerApp:
             # 開始年を取得する
         plan_year_st = year_st  # 開始年のセット in main()要修正
         #for yyyy in range(plan_year_st, plan_year_st + plan_range + 1):
-        for yyyy in range(int(plan_year_st), int(plan_year_st + plan_range + 1)):
-            year_lots4S = count_lots_yyyy(S_list, str(yyyy))
-            year_lots_list4S.append(year_lots4S)
+        year_lots_list4S = count_lots_by_year(
+            S_list, range(int(plan_year_st), int(plan_year_st + plan_range + 1)))
             #        # 結果を出力
             #       #print(yyyy, " year carrying lots:", year_lots)
             #
@@ -8841,6 +8796,12 @@ class PSIPlannerApp:
     # *************************
     # PSI graph
     # *************************
+    def _psi_chart_data(self) -> PSIChartData:
+        """PSI グラフ用の件数キャッシュ（(product, bound, layer) 単位）"""
+        cache = getattr(self, "_psi_chart_cache", None)
+        if cache is None:
+            cache = self._psi_chart_cache = PSIChartData()
+        return cache
     def show_psi_by_product(self, bound, layer, product_name):
         self._ensure_plan_window()
         self._ensure_psi_area()      # ← これを追加
@@ -8867,16 +8828,16 @@ class PSIPlannerApp:
         if prod_root_node_OT is None:
             print(f"[WARN] No product root found for '{product_name}'. Abort PSI drawing.")
             return
+        # ツリー 1 回走査の件数配列（(product, bound, layer) でキャッシュ）
+        root_sel = prod_root_node_OT if bound == "outbound" else prod_root_node_IN
+        tc = self._psi_chart_data().get(product_name, bound, layer, root_sel)
         def traverse_nodes(node):
             if node is None:
                 return
             for child in getattr(node, "children", []) or []:
                 traverse_nodes(child)
-            collect_psi_data(node, layer, week_start, week_end, psi_data)
-        if bound == "outbound":
-            traverse_nodes(prod_root_node_OT)
-        else:
-            traverse_nodes(prod_root_node_IN)
+            collect_psi_data(node, layer, week_start, week_end, psi_data, tree_counts=tc)
+        traverse_nodes(root_sel)
         # データが空なら描画スキップ（安全）
         if not psi_data:
             print(f"[INFO] show_psi_by_product: psi_data empty for product={product_name}, bound={bound}, layer={layer}")
@@ -9000,10 +8961,11 @@ class PSIPlannerApp:
         week_start = 1
         week_end = self.plan_range * 53
         psi_data = []
+        tc = tree_psi_counts(self.root_node_outbound, "demand")
         def traverse_nodes(node):
             for child in node.children:
                 traverse_nodes(child)
-            collect_psi_data(node, "demand", week_start, week_end, psi_data)
+            collect_psi_data(node, "demand", week_start, week_end, psi_data, tree_counts=tc)
         # ***************************
         # ROOT HANDLE
         # ***************************
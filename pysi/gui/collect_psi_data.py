@@ -19,37 +19,17 @@ def map_psi_lots2df(node, D_S_flag, psi_lots):
 # **************************
 # collect_psi_data
 # **************************
-def collect_psi_data(node, D_S_flag, week_start, week_end, psi_data):
-    if D_S_flag == "demand":
-        psi_lots = []
-        df_demand_plan = map_psi_lots2df(node, D_S_flag, psi_lots)
-        df_init = df_demand_plan
-    elif D_S_flag == "supply":
-        psi_lots = []
-        df_supply_plan = map_psi_lots2df(node, D_S_flag, psi_lots)
-        df_init = df_supply_plan
-    else:
+# 件数は psi_chart_data.tree_psi_counts（ツリー 1 回走査）から取る。
+# 旧 map_psi_lots2df 経由の lot 行展開は使わない（上の関数は互換のため残す）。
+from pysi.gui.psi_chart_data import chart_series, tree_psi_counts
+def collect_psi_data(node, D_S_flag, week_start, week_end, psi_data, tree_counts=None):
+    if D_S_flag not in ("demand", "supply"):
         print("error: D_S_flag should be demand or supply")
         return
-    condition1 = df_init["node_name"] == node.name
-    condition2 = (df_init["week"] >= week_start) & (df_init["week"] <= week_end)
-    df = df_init[condition1 & condition2]
-    line_data_2I = df[df["s-co-i-p"].isin([2])]
-    bar_data_0S = df[df["s-co-i-p"] == 0]
-    bar_data_3P = df[df["s-co-i-p"] == 3]
-    line_plot_data_2I = line_data_2I.groupby("week")["lot_id"].count()
-    bar_plot_data_3P = bar_data_3P.groupby("week")["lot_id"].count()
-    bar_plot_data_0S = bar_data_0S.groupby("week")["lot_id"].count()
-    # ノードのREVENUEとPROFITを四捨五入
-    # root_out_optからroot_outboundの世界へ変換する
-    #@241225 be checked
-    #@ STOP
-    ##@ TEST node_optとnode_originに、revenueとprofit属性を追加
-    #revenue = round(node.revenue)
-    #profit  = round(node.profit)
-    #@241225 STOP "self.nodes_outbound"がscopeにない
-    #node_origin = self.nodes_outbound[node.name]
-    #
+    tc = tree_counts if tree_counts is not None else tree_psi_counts(node, D_S_flag)
+    line_plot_data_2I, bar_plot_data_3P, bar_plot_data_0S = chart_series(
+        tc.counts[node.name], week_start, week_end
+    )
     revenue = round(node.eval_cs_price_sales_shipped)
     profit = round(node.eval_cs_profit)
     # PROFIT_RATIOを計算して四捨五入
@@ -69,14 +49,13 @@ def collect_psi_data(node, D_S_flag, week_start, week_end, psi_data):
         if layer not in ["demand", "supply"]:
             print("error: demand or supply must be defined for PSI layer")
             return
+        root = self.root_node_outbound if bound == "outbound" else self.root_node_inbound
+        tc = tree_psi_counts(root, layer)
         def traverse_nodes(node):
             for child in node.children:
                 traverse_nodes(child)
-            collect_psi_data(node, layer, week_start, week_end, psi_data)
-        if bound == "outbound":
-            traverse_nodes(self.root_node_outbound)
-        else:
-            traverse_nodes(self.root_node_inbound)
+            collect_psi_data(node, layer, week_start, week_end, psi_data, tree_counts=tc)
+        traverse_nodes(root)
         fig, axs = plt.subplots(len(psi_data), 1, figsize=(5, len(psi_data) * 1))  # figsizeの高さをさらに短く設定
         if len(psi_data) == 1:
             axs = [axs]
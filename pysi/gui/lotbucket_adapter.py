@@ -5,16 +5,24 @@ GUI から lot_bucket を直接集計 → 週次の S/CO/I/P を描画するた
 主な提供関数
 - fetch_weekly_buckets(conn, *, scenario, node, product, layer="demand")
     → 週インデックス順に S/CO/I/P の個数（lot数）を返す（不足週は 0 で埋める）
+- fetch_product_buckets(conn, *, scenario, product, layer="demand")
+    → 製品の全ノード分の週次件数を 1 クエリで {node_name: (W, 4) 配列}
+- open_node_buckets(conn, *, scenario, product, layer="demand")
+    → ノードを開いたときだけ lot_id を読む LazyNodeBuckets（キーはノード名）
+- iter_export_rows(conn, *, scenario, product, layer="demand")
+    → エクスポート用に (node, iso_year, iso_week, bucket, lot_id) を逐次返す
 - plot_weekly(series, *, title="", style="lines", ax=None)
     → matplotlib で簡単に可視化（lines or stack）
 CLI テスト例
 python -m pysi.gui.lotbucket_adapter --db var/psi.sqlite --scenario Baseline \
   --node CS_JPN --product JPN_RICE_1 --layer demand --out report.png
+  （--export lots.csv で製品全ノードの lot 行を CSV 出力）
 """
 from __future__ import annotations
 import argparse
 import sqlite3
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
+from pysi.io.lot_bucket_reader import LOT_BUCKET, LazyNodeBuckets, count_buckets, iter_bucket_rows
 BUCKETS = ("S", "CO", "I", "P")
 # ------------------------
 # DB helpers
@@ -71,19 +79,14 @@ def fetch_weekly_buckets(
     weeks = _scenario_week_seq(con, sid)
     # 初期化（全週が必ず入る）
     base = {wi: {"week_index": wi, "iso_year": y, "iso_week": w, **{b:0 for b in BUCKETS}} for wi, y, w in weeks}
-    rows = con.execute(
-        """
-        SELECT lb.week_index, lb.bucket, COUNT(*) AS cnt
-          FROM lot_bucket lb
-         WHERE lb.scenario_id=? AND lb.node_id=? AND lb.product_id=?
-           AND lb.layer=?
-         GROUP BY lb.week_index, lb.bucket
-        """, (sid, nid, pid, layer)
-    ).fetchall()
-    for r in rows:
-        wi = int(r["week_index"]); b = r["bucket"]; c = int(r["cnt"])
-        if wi in base and b in BUCKETS:
-            base[wi][b] = c
+    cnt = count_buckets(
+        con, LOT_BUCKET, weeks=[wi for wi, *_ in weeks],
+        where={"scenario_id": sid, "product_id": pid, "layer": layer, "node_id": nid},
+    ).get(nid)
+    if cnt is not None:
+        for (wi, *_), row in zip(weeks, cnt.tolist()):
+            for b, c in zip(BUCKETS, row):
+                base[wi][b] = c
     # 週インデックス昇順に整形
     series = [base[wi] for wi, *_ in weeks]
     # total（任意）
@@ -91,6 +94,61 @@ def fetch_weekly_buckets(
         s["total"] = sum(s[b] for b in BUCKETS)
         s["label"] = f'{s["iso_year"]}-W{s["iso_week"]:02d}'
     return series
+def _product_scope(con: sqlite3.Connection, scenario: str, product: str, layer: str):
+    if layer not in ("demand", "supply"):
+        raise ValueError("layer must be 'demand' or 'supply'")
+    sid = _one(con, "SELECT id FROM scenario WHERE name=?", (scenario,))
+    if not sid: raise ValueError(f"scenario not found: {scenario}")
+    pid = _one(con, "SELECT id FROM product WHERE name=?", (product,))
+    if not pid: raise ValueError(f"product not found: {product}")
+    sid, pid = int(sid[0]), int(pid[0])
+    weeks = _scenario_week_seq(con, sid)
+    where = {"scenario_id": sid, "product_id": pid, "layer": layer}
+    return sid, pid, weeks, where
+def _node_names(con: sqlite3.Connection) -> Dict[int, str]:
+    return {int(r[0]): r[1] for r in con.execute("SELECT id, name FROM node")}
+def fetch_product_buckets(
+    con: sqlite3.Connection,
+    *,
+    scenario: str,
+    product: str,
+    layer: str = "demand",
+):
+    """
+    製品の全ノード × 週 × バケツ の件数を 1 回の集計で返す。
+    返り値: (weeks, {node_name: int64 配列 (W, 4)})  weeks は [(week_index, iso_year, iso_week), ...]
+    """
+    _, _, weeks, where = _product_scope(con, scenario, product, layer)
+    names = _node_names(con)
+    cnt = count_buckets(con, LOT_BUCKET, weeks=[wi for wi, *_ in weeks], where=where)
+    return weeks, {names.get(nid, str(nid)): arr for nid, arr in cnt.items()}
+def open_node_buckets(
+    con: sqlite3.Connection,
+    *,
+    scenario: str,
+    product: str,
+    layer: str = "demand",
+) -> LazyNodeBuckets:
+    """GUI のツリー用。件数は全ノード一括、lot_id はノードを展開したときだけ読む。"""
+    _, _, weeks, where = _product_scope(con, scenario, product, layer)
+    key_of = {name: nid for nid, name in _node_names(con).items()}
+    return LazyNodeBuckets(con, LOT_BUCKET, weeks=[wi for wi, *_ in weeks],
+                           where=where, key_of=key_of)
+def iter_export_rows(
+    con: sqlite3.Connection,
+    *,
+    scenario: str,
+    product: str,
+    layer: str = "demand",
+    chunk: int = 10000,
+) -> Iterator[Tuple[str, int, int, str, str]]:
+    """(node_name, iso_year, iso_week, bucket, lot_id) を chunk 行ずつ読みながら返す（全件は載せない）"""
+    _, _, weeks, where = _product_scope(con, scenario, product, layer)
+    names = _node_names(con)
+    yw = {wi: (y, w) for wi, y, w in weeks}
+    for nid, wi, b, lot_id in iter_bucket_rows(con, LOT_BUCKET, where=where, chunk=chunk):
+        y, w = yw.get(wi, (None, None))
+        yield names.get(nid, str(nid)), y, w, b, lot_id
 def to_dataframe(series: List[Dict]):
     """pandas があれば DataFrame に（無ければそのまま返す）。"""
     try:
@@ -157,8 +215,20 @@ def _main():
     ap.add_argument("--style", default="lines", choices=["lines","stack"])
     ap.add_argument("--out", help="save to image file")
     ap.add_argument("--show", action="store_true")
+    ap.add_argument("--export", help="製品の全ノードの lot 行を CSV に書き出す")
     args = ap.parse_args()
     con = _open(args.db)
+    if args.export:
+        import csv
+        n = 0
+        with open(args.export, "w", newline="", encoding="utf-8") as f:
+            wr = csv.writer(f)
+            wr.writerow(["node", "iso_year", "iso_week", "bucket", "lot_id"])
+            for row in iter_export_rows(con, scenario=args.scenario,
+                                        product=args.product, layer=args.layer):
+                wr.writerow(row)
+                n += 1
+        print(f"[OK] exported rows={n} -> {args.export}")
     series = fetch_weekly_buckets(con, scenario=args.scenario, node=args.node,
                                   product=args.product, layer=args.layer)
     title = f'{args.scenario} / {args.layer} / {args.node} / {args.product}'
@@ -0,0 +1,286 @@
+# pysi/gui/network_view.py
+# E2E ネットワーク図の描画レイヤ（matplotlib collections + blitting）
+#
+# 旧: draw_network4opt / draw_network4multi_prod がノード 1 個・エッジ 1 本ごとに
+#     nx.draw_networkx_nodes / nx.draw_networkx_edges を呼び、再描画のたびに数千の artist を作る。
+#     クリック時は pos_E2E を Python ループで総当たりし、描画のたびに button_press_event を追加接続していた
+# 新: ノードはマーカー形状ごとに 1 つの PathCollection（scatter）、エッジは色ごとに 1 つの LineCollection、
+#     最適化パス / 製品フローの赤線も 1 つの LineCollection にまとめる（FastNetworkViewer と同じ考え方）。
+#     強調・フロー色は set_segments / set_facecolor / set_array でその場更新し、artist は作り直さない。
+#     hover / click の注釈は animated artist にして、キャッシュした背景に重ねて blit する。
+#     最近傍ノードは KD-tree（scipy があれば）、無ければ numpy の一括距離計算
+#
+#使い方
+#
+#from pysi.gui.network_view import NetworkView, classify_edges
+#view = NetworkView(ax, canvas)
+#view.draw(G, pos_E2E, edge_colors=classify_edges(G, Gdm, Gsp),
+#          decouple=decouple_node_selected, flow=flowDict_opt, flow_width=0.5)
+#view.set_flow(highlight_flow)               # 赤線だけ差し替え（artist は再利用）
+#view.enable_hover(lambda n: f"{n}")         # hover 注釈（blit）
+#node, dist = view.nearest(x, y)
+#view.annotate(node, "text")                 # click 注釈（blit）
+
+from __future__ import annotations
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba, to_rgba_array
+
+try:                                    # 任意依存（無ければ numpy で最近傍）
+    from scipy.spatial import cKDTree
+except Exception:
+    cKDTree = None
+
+EDGE_DEFAULT_COLOR = "lightgrey"
+NODE_COLOR = "lightblue"
+DECOUPLE_COLOR = "brown"
+FLOW_COLOR = "red"
+_KDTREE_MIN_NODES = 256                 # これより少なければ numpy の総当たりの方が速い
+LABEL_MAX_NODES = 500                   # labels=None のとき、これを超えるとラベルを省く（名前は hover で出す）
+
+
+def classify_edges(G, Gdm, Gsp) -> Dict[Tuple[Hashable, Hashable], str]:
+    """エッジ → 色（旧 draw_network4opt のループと同じ判定）"""
+    out = {}
+    for u, v in G.edges():
+        if u == "procurement_office" or v == "sales_office":
+            c = EDGE_DEFAULT_COLOR
+        elif Gdm.has_edge(u, v):
+            c = "blue"
+        elif Gsp.has_edge(u, v):
+            c = "green"
+        else:
+            c = EDGE_DEFAULT_COLOR
+        out[(u, v)] = c
+    return out
+
+
+def _flow_edges(flow: Optional[Mapping]) -> List[Tuple[Hashable, Hashable, float]]:
+    if not flow:
+        return []
+    return [(u, v, float(f)) for u, fs in flow.items() for v, f in fs.items() if f > 0]
+
+
+class NetworkView:
+    """1 つの Axes / FigureCanvas に E2E ネットワークを描く。draw() 以外は artist を作らない"""
+
+    def __init__(self, ax, canvas, *, pick_radius: float = 0.5) -> None:
+        self.ax = ax
+        self.canvas = canvas
+        self.pick_radius = pick_radius
+        self.nodes: List[Hashable] = []
+        self.index: Dict[Hashable, int] = {}
+        self.graph = None
+        self.pos: Dict[Hashable, Any] = {}
+        self.xy = np.zeros((0, 2))
+        self.node_colls: Dict[str, Tuple[Any, np.ndarray]] = {}   # marker → (PathCollection, 行番号)
+        self.edge_colls: Dict[str, LineCollection] = {}           # 色 → LineCollection
+        self.flow_coll: Optional[LineCollection] = None
+        self._base_fc = np.zeros((0, 4))
+        self._kdtree = None
+        self._annot = None
+        self._annot_node = None
+        self._bg = None
+        self._hover_text: Optional[Callable[[Hashable], str]] = None
+        self._cids = [canvas.mpl_connect("draw_event", self._on_draw)]
+
+    # ---- 描画（静的レイヤ） ----
+    def draw(self, G, pos, *, edge_colors: Optional[Mapping] = None, decouple: Iterable = (),
+             flow: Optional[Mapping] = None, flow_width: float = 1.0, edge_width: float = 0.5,
+             node_size: float = 50, labels: Optional[bool] = None, font_size: int = 10) -> None:
+        """
+        ax はクリア済み（タイトル / axis('off') 設定済み）を想定。
+        edge_colors は {(u, v): 色}（省略時は全て lightgrey）、flow は {u: {v: 値}} で値 > 0 を赤線にする。
+        labels=None はノード数が LABEL_MAX_NODES 以下のときだけノード名を描く
+        （文字の描画はノード 1 個ごとの artist になり、数千ノードでは再描画の大半を占めるため）。
+        """
+        ax = self.ax
+        self.graph = G
+        self.pos = pos
+        self.nodes = list(G.nodes())
+        self.index = {n: i for i, n in enumerate(self.nodes)}
+        self.xy = np.array([pos[n] for n in self.nodes], dtype=float).reshape(-1, 2)
+        self._kdtree = (cKDTree(self.xy) if cKDTree is not None and len(self.nodes) >= _KDTREE_MIN_NODES
+                        else None)
+        self._annot_node = None
+
+        # ノード: マーカー形状ごとに 1 つの PathCollection
+        dec = set(decouple or ())
+        is_dec = np.fromiter((n in dec for n in self.nodes), dtype=bool, count=len(self.nodes))
+        self._base_fc = np.where(is_dec[:, None], to_rgba(DECOUPLE_COLOR), to_rgba(NODE_COLOR))
+        self.node_colls = {}
+        for marker, m in (("o", ~is_dec), ("v", is_dec)):
+            idx = np.flatnonzero(m)
+            if len(idx) == 0:
+                continue
+            sc = ax.scatter(self.xy[idx, 0], self.xy[idx, 1], s=node_size, c=self._base_fc[idx],
+                            marker=marker, zorder=2)
+            self.node_colls[marker] = (sc, idx)
+
+        # エッジ: 色ごとに 1 つの LineCollection
+        by_color: Dict[str, list] = {}
+        ec = edge_colors or {}
+        for u, v in G.edges():
+            by_color.setdefault(ec.get((u, v), EDGE_DEFAULT_COLOR), []).append((pos[u], pos[v]))
+        self.edge_colls = {}
+        for color, segs in by_color.items():
+            lc = LineCollection(segs, colors=color, linewidths=edge_width, zorder=1)
+            ax.add_collection(lc)
+            self.edge_colls[color] = lc
+
+        # 赤線（最適化パス / 製品フロー）: 1 つの LineCollection。set_flow で中身だけ差し替える
+        self.flow_coll = LineCollection([], colors=FLOW_COLOR, linewidths=flow_width, zorder=1.5)
+        ax.add_collection(self.flow_coll)
+        self._set_flow_segments(flow)
+
+        if labels is None:
+            labels = len(self.nodes) <= LABEL_MAX_NODES
+        if labels:
+            for n, (x, y) in zip(self.nodes, self.xy):
+                ax.text(x, y, str(n), fontsize=font_size, ha="center", va="center",
+                        zorder=3, clip_on=True)
+
+        if len(self.xy):
+            ax.update_datalim(self.xy)
+            ax.autoscale_view()
+
+        # 注釈は animated（通常の draw では描かれず、blit で重ねる）
+        self._annot = ax.annotate(
+            "", xy=(0, 0), xytext=(10, 10), textcoords="offset points",
+            fontsize=9, color="red", zorder=5, animated=True,
+            bbox=dict(boxstyle="round,pad=0.3", fc="white", alpha=0.8),
+        )
+        self._annot.set_visible(False)
+        self._bg = None
+        self.canvas.draw_idle()
+
+    # ---- その場更新 ----
+    def _set_flow_segments(self, flow: Optional[Mapping], cmap=None) -> None:
+        edges = [(u, v, f) for u, v, f in _flow_edges(flow) if u in self.pos and v in self.pos]
+        self.flow_coll.set_segments([(self.pos[u], self.pos[v]) for u, v, _ in edges])
+        if cmap is None:
+            self.flow_coll.set_array(None)
+            self.flow_coll.set_color(FLOW_COLOR)
+        else:
+            self.flow_coll.set_cmap(cmap)
+            self.flow_coll.set_array(np.array([f for _, _, f in edges], dtype=float))
+            self.flow_coll.autoscale()
+
+    def set_flow(self, flow: Optional[Mapping], *, cmap=None, width: Optional[float] = None) -> None:
+        """赤線を差し替える。cmap を渡すとフロー量で色付け（set_array）"""
+        if self.flow_coll is None:
+            return
+        self._set_flow_segments(flow, cmap)
+        if width is not None:
+            self.flow_coll.set_linewidth(width)
+        self.canvas.draw_idle()
+
+    def set_node_colors(self, colors: Mapping[Hashable, Any]) -> None:
+        """{node: 色} で指定したノードだけ塗り替える（他は元の色）"""
+        fc = self._base_fc.copy()
+        for n, c in colors.items():
+            i = self.index.get(n)
+            if i is not None:
+                fc[i] = to_rgba(c)
+        for sc, idx in self.node_colls.values():
+            sc.set_facecolor(fc[idx])
+        self.canvas.draw_idle()
+
+    def highlight_nodes(self, nodes: Iterable[Hashable], color: str = "red", width: float = 1.5) -> None:
+        """指定ノードの枠線を強調（空なら解除）"""
+        sel = np.zeros(len(self.nodes), dtype=bool)
+        for n in nodes or ():
+            i = self.index.get(n)
+            if i is not None:
+                sel[i] = True
+        for sc, idx in self.node_colls.values():
+            ec = to_rgba_array(sc.get_facecolor())
+            if len(ec) != len(idx):
+                ec = np.broadcast_to(ec[:1], (len(idx), 4)).copy()
+            ec[sel[idx]] = to_rgba(color)
+            sc.set_edgecolor(ec)
+            sc.set_linewidths(np.where(sel[idx], width, 0.0))
+        self.canvas.draw_idle()
+
+    # ---- ピック ----
+    def nearest(self, x: float, y: float) -> Tuple[Optional[Hashable], float]:
+        if not len(self.nodes):
+            return None, float("inf")
+        if self._kdtree is not None:
+            dist, i = self._kdtree.query([x, y])
+            return self.nodes[int(i)], float(dist)
+        d2 = ((self.xy - (x, y)) ** 2).sum(axis=1)
+        i = int(d2.argmin())
+        return self.nodes[i], float(np.sqrt(d2[i]))
+
+    def pick(self, event) -> Optional[Hashable]:
+        """pick_radius 以内の最近傍ノード（無ければ None）"""
+        if event.inaxes is not self.ax or event.xdata is None or event.ydata is None:
+            return None
+        node, dist = self.nearest(event.xdata, event.ydata)
+        return node if dist < self.pick_radius else None
+
+    # ---- 注釈（blitting） ----
+    def _on_draw(self, event) -> None:
+        if self._annot is None or self._annot.axes is not self.ax:
+            self._bg = None
+            return
+        fig = self.ax.figure
+        self._bg = self.canvas.copy_from_bbox(fig.bbox)
+        if self._annot.get_visible():
+            fig.draw_artist(self._annot)
+
+    def _blit(self) -> None:
+        if self._bg is None:               # まだ一度も描かれていない
+            self.canvas.draw_idle()
+            return
+        fig = self.ax.figure
+        self.canvas.restore_region(self._bg)
+        if self._annot.get_visible():
+            fig.draw_artist(self._annot)
+        self.canvas.blit(fig.bbox)
+
+    def annotate(self, node: Optional[Hashable], text: str = "") -> None:
+        """node に注釈を出す（None で消す）。背景は再描画しない"""
+        if self._annot is None:
+            return
+        if node is None or node not in self.index:
+            if not self._annot.get_visible():
+                return
+            self._annot.set_visible(False)
+            self._annot_node = None
+        else:
+            self._annot.xy = tuple(self.xy[self.index[node]])
+            self._annot.set_text(text or str(node))
+            self._annot.set_visible(True)
+            self._annot_node = node
+        self._blit()
+
+    def enable_hover(self, text_fn: Optional[Callable[[Hashable], str]] = None) -> None:
+        if self._hover_text is None:
+            self._cids.append(self.canvas.mpl_connect("motion_notify_event", self._on_move))
+        self._hover_text = text_fn or self._default_hover_text
+
+    def _default_hover_text(self, node: Hashable) -> str:
+        return f"{node}\ndegree: {self.graph.degree[node]}"
+
+    def _on_move(self, event) -> None:
+        if self._hover_text is None or self._annot is None:
+            return
+        node = self.pick(event)
+        if node == self._annot_node:
+            return
+        self.annotate(node, self._hover_text(node) if node is not None else "")
+
+    def connect_click(self, callback: Callable[[Any], None]) -> None:
+        self._cids.append(self.canvas.mpl_connect("button_press_event", callback))
+
+    def disconnect(self) -> None:
+        for cid in self._cids:
+            try:
+                self.canvas.mpl_disconnect(cid)
+            except Exception:
+                pass
+        self._cids = []
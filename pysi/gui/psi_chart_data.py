@@ -0,0 +1,104 @@
+# pysi/gui/psi_chart_data.py
+# PSI グラフ用の「数量」データ供給（lot_ID を 1 件ずつ DataFrame 化しない）
+#
+# 旧: collect_psi_data → map_psi_lots2df がノードごとにサブツリー全 lot を行に展開し、
+#     自ノードだけ抜き出して groupby().count() → ツリー全体で O(nodes^2 × lots)
+# 新: 1 回の post-order 走査で各ノードの 週 × [S, CO, I, P] 件数配列を作る（len() のみ）
+#     PSIStore 付きノードなら counts 配列をそのまま読む。
+#     結果は (product, bound, layer) ごとにキャッシュし、計画が変わったら invalidate() する。
+
+from __future__ import annotations
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pysi.core.psi_store import bucket_counts
+
+N_BUCKETS = 4  # [S, CO, I, P]
+
+
+class TreeCounts:
+    """1 ツリー 1 レイヤ分の件数。order は post-order（子→親）のノード名。"""
+
+    __slots__ = ("order", "counts", "subtree_total")
+
+    def __init__(self) -> None:
+        self.order: List[str] = []
+        self.counts: Dict[str, np.ndarray] = {}        # name -> (weeks, 4) int
+        self.subtree_total: Dict[str, int] = {}         # name -> サブツリー全 lot 数
+
+
+def node_psi_counts(node, layer: str) -> np.ndarray:
+    """ノード 1 つの 週 × [S, CO, I, P] 件数（layer は "demand" / "supply"）"""
+    psi = getattr(node, "psi4demand" if layer == "demand" else "psi4supply", None)
+    if not psi:
+        return np.zeros((0, N_BUCKETS), dtype=np.int64)
+    return np.column_stack([np.asarray(bucket_counts(psi, b), dtype=np.int64)
+                            for b in range(N_BUCKETS)])
+
+
+def tree_psi_counts(root, layer: str) -> TreeCounts:
+    """post-order 1 回でツリー全ノードの件数とサブツリー合計を作る"""
+    tc = TreeCounts()
+    if root is None:
+        return tc
+    st = [(root, False)]
+    while st:
+        n, done = st.pop()
+        if done:
+            c = node_psi_counts(n, layer)
+            tc.order.append(n.name)
+            tc.counts[n.name] = c
+            tc.subtree_total[n.name] = int(c.sum()) + sum(
+                tc.subtree_total.get(ch.name, 0) for ch in getattr(n, "children", []) or []
+            )
+            continue
+        st.append((n, True))
+        for ch in reversed(getattr(n, "children", []) or []):
+            st.append((ch, False))
+    return tc
+
+
+def chart_series(counts: np.ndarray, week_start: int, week_end: int
+                 ) -> Tuple[pd.Series, pd.Series, pd.Series]:
+    """
+    (I, P, S) の週次 Series を返す（旧 groupby("week").count() と同じく件数 > 0 の週のみ）。
+    """
+    out = []
+    hi = min(int(week_end), len(counts) - 1)
+    for b in (2, 3, 0):
+        if hi < week_start:
+            out.append(pd.Series([], dtype=np.int64, name="lot_id"))
+            continue
+        col = counts[week_start:hi + 1, b]
+        nz = np.nonzero(col)[0]
+        out.append(pd.Series(col[nz], index=(nz + week_start).astype(int), name="lot_id"))
+    return out[0], out[1], out[2]
+
+
+class PSIChartData:
+    """
+    (product, bound, layer) → TreeCounts のキャッシュ。
+    ツリーの差し替え（root の入れ替え）は自動で別キーになる。計画の再計算後は invalidate()。
+    """
+
+    def __init__(self) -> None:
+        self._cache: Dict[Tuple[str, str, str], Tuple[weakref.ref, TreeCounts]] = {}
+
+    def invalidate(self, product: Optional[str] = None) -> None:
+        if product is None:
+            self._cache.clear()
+            return
+        for k in [k for k in self._cache if k[0] == product]:
+            del self._cache[k]
+
+    def get(self, product: str, bound: str, layer: str, root) -> TreeCounts:
+        key = (product, bound, layer)
+        hit = self._cache.get(key)
+        if hit is not None and hit[0]() is root:
+            return hit[1]
+        tc = tree_psi_counts(root, layer)
+        self._cache[key] = (weakref.ref(root), tc)
+        return tc
@@ -0,0 +1,292 @@
+# pysi/io/lot_bucket_reader.py
+# lot_bucket（および psi / lot テーブル）の共通リーダ
+#
+# 旧: GUI（fetch_weekly_buckets）・SqlPlanEnv（_attach_psi）・書戻しフォールバック（_build_psibuckets_from_lot）が
+#     それぞれ (scenario, node, product) ごとに独自のクエリを投げ、_attach_psi は全 lot 行をネストした list に展開
+# 新: テーブルごとの列対応を BucketSource にまとめ、読み方を 3 つに揃える
+#     (a) count_buckets      : 1 回の GROUP BY で 製品の全ノード × 週 × バケツ の件数配列 (W, 4)
+#     (b) LazyNodeBuckets    : 件数は (a) で先に出し、lot_id はノードを開いたときだけ読む
+#     (c) iter_bucket_rows   : エクスポート用のストリーミング（fetchmany で chunk ずつ）
+#     いずれも covering index（ensure_covering_indexes）だけで完結し、本表を引かない。
+#     読む側は DDL を発行しない。index はスキーマ作成時と書込み側（lot_bucket の一括書戻し /
+#     upsert_weekly_and_lot）で作る。旧 DB は index が無くても結果は同じ（遅いだけ）。
+#
+#使い方
+#
+#ensure_covering_indexes(conn)                        # スキーマ作成直後に 1 回（読む前に書く側で）
+#where = {"scenario_id": sid, "product_id": pid, "layer": "demand"}
+#cnt = count_buckets(conn, LOT_BUCKET, weeks=week_index_list, where=where)   # {node_id: (W,4)}
+#lazy = LazyNodeBuckets(conn, LOT_BUCKET, weeks=week_index_list, where=where)
+#lazy.lots(node_id)[w][0]                             # ノード展開時に S の lot_id を読む
+#for node_id, wk, bucket, lot_id in iter_bucket_rows(conn, LOT_BUCKET, where=where): ...
+
+from __future__ import annotations
+import sqlite3
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+BUCKETS = ("S", "CO", "I", "P")
+BMAP = {"S": 0, "CO": 1, "I": 2, "P": 3}
+
+
+class BucketSource(NamedTuple):
+    """週 × バケツ × lot_id を持つテーブルの列対応"""
+    table: str
+    node: str                    # ノード列
+    week: str                    # 週キー（SELECT に使う式）
+    week_order: str              # 週の並び（ORDER BY に使う列。index の順に合わせる）
+    bucket: Optional[str]        # バケツ列（None なら全て S）
+    keys: Tuple[str, ...]        # WHERE の等値条件に使える列（index の先頭列）
+    cell_order: str              # 同じ (node, 週) 内の並び
+    index: str                   # covering index 名
+    index_cols: Tuple[str, ...]
+
+
+# lot_bucket(scenario_id, layer, node_id, product_id, week_index, bucket, lot_id)
+# UNIQUE 制約の autoindex は layer → node_id → product_id の順なので、製品全ノードの集計には使えない
+LOT_BUCKET = BucketSource(
+    "lot_bucket", "node_id", "week_index", "week_index", "bucket",
+    ("scenario_id", "product_id", "layer"), "rowid",
+    "idx_lot_bucket_cover",
+    ("scenario_id", "product_id", "layer", "node_id", "week_index", "bucket", "lot_id"),
+)
+# psi(node_name, product_name, iso_index, bucket, lot_id)  … pysi.io.sql_bridge.SCHEMA_SQL
+PSI_TABLE = BucketSource(
+    "psi", "node_name", "iso_index", "iso_index", "bucket",
+    ("product_name",), "rowid",
+    "idx_psi_cover",
+    ("product_name", "node_name", "iso_index", "bucket", "lot_id"),
+)
+# lot(scenario_id, node_id, product_id, iso_year, iso_week, lot_id)  … 週キーは iso_year*100 + iso_week
+LOT_TABLE = BucketSource(
+    "lot", "node_id", "iso_year * 100 + iso_week", "iso_year, iso_week", None,
+    ("scenario_id", "product_id"), "lot_id",
+    "idx_lot_cover",
+    ("scenario_id", "product_id", "node_id", "iso_year", "iso_week", "lot_id"),
+)
+ALL_SOURCES = (LOT_BUCKET, PSI_TABLE, LOT_TABLE)
+
+Weeks = Union[int, Sequence[Any], Mapping[Any, int]]
+
+
+# ----------------------------
+# covering index
+# ----------------------------
+def _table_exists(con: sqlite3.Connection, table: str) -> bool:
+    return con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone() is not None
+
+
+def _index_exists(con: sqlite3.Connection, name: str) -> bool:
+    return con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (name,)
+    ).fetchone() is not None
+
+
+def index_ddl(src: BucketSource) -> str:
+    return (f'CREATE INDEX IF NOT EXISTS "{src.index}" '
+            f'ON "{src.table}"({", ".join(src.index_cols)})')
+
+
+def ensure_covering_indexes(con: sqlite3.Connection,
+                            sources: Sequence[BucketSource] = ALL_SOURCES) -> List[str]:
+    """存在するテーブルにだけ covering index を作る（作成したものの名前を返す）。スキーマ作成時・書込み側で呼ぶ"""
+    made = []
+    for src in sources:
+        if _table_exists(con, src.table) and not _index_exists(con, src.index):
+            con.execute(index_ddl(src))
+            made.append(src.index)
+    if made and con.in_transaction:
+        con.commit()
+    return made
+
+
+# ----------------------------
+# 内部ヘルパ
+# ----------------------------
+def _where_sql(src: BucketSource, where: Mapping[str, Any]) -> Tuple[str, List[Any]]:
+    allowed = set(src.keys) | {src.node}
+    bad = [k for k in where if k not in allowed]
+    if bad:
+        raise ValueError(f"{src.table}: unsupported filter column(s) {bad}; use {sorted(allowed)}")
+    # index の列順に並べる（等値条件なので順序は結果に影響しない）
+    cols = [c for c in src.index_cols if c in where]
+    if not cols:
+        return "", []
+    return " WHERE " + " AND ".join(f"{c}=?" for c in cols), [where[c] for c in cols]
+
+
+def _week_lookup(weeks: Weeks) -> Tuple[int, Optional[Dict[Any, int]]]:
+    """weeks → (週数, 週キー→位置 の dict)。int なら週キーがそのまま位置（dict は None）"""
+    if isinstance(weeks, int):
+        return weeks, None
+    if isinstance(weeks, Mapping):
+        pos = {k: int(v) for k, v in weeks.items()}
+        return (max(pos.values()) + 1 if pos else 0), pos
+    pos = {k: i for i, k in enumerate(weeks)}
+    return len(pos), pos
+
+
+def _pos_of(wk: Any, n_weeks: int, pos: Optional[Dict[Any, int]]) -> Optional[int]:
+    if pos is None:
+        w = int(wk or 0)
+        return w if 0 <= w < n_weeks else None
+    w = pos.get(wk)
+    return w if w is not None and 0 <= w < n_weeks else None
+
+
+def _bucket_idx(b: Optional[str]) -> int:
+    # psi テーブルは bucket が NULL / 小文字のことがある（旧 _attach_psi と同じく S 扱い）
+    return BMAP.get((b or "S").upper(), 0)
+
+
+def _bucket_sel(src: BucketSource) -> str:
+    return src.bucket if src.bucket else "'S'"
+
+
+def _empty_psi(n_weeks: int) -> List[List[List[str]]]:
+    return [[[] for _ in range(4)] for _ in range(n_weeks)]
+
+
+# ----------------------------
+# (a) 件数の一括集計
+# ----------------------------
+def count_buckets(con: sqlite3.Connection, src: BucketSource, *, weeks: Weeks,
+                  where: Mapping[str, Any]) -> Dict[Any, np.ndarray]:
+    """
+    1 回の GROUP BY で {node: int64 配列 (W, 4)} を返す（列は S/CO/I/P）。
+    weeks: 週数（週キー = 位置）/ 週キーの並び / {週キー: 位置}。範囲外の週は捨てる。
+    """
+    n_weeks, pos = _week_lookup(weeks)
+    w_sql, args = _where_sql(src, where)
+    bsel = _bucket_sel(src)
+    sql = (f"SELECT {src.node}, {src.week}, {bsel}, COUNT(*) FROM {src.table}{w_sql} "
+           f"GROUP BY {src.node}, {src.week}, {bsel}")
+    out: Dict[Any, np.ndarray] = {}
+    for node, wk, b, c in con.execute(sql, args):
+        w = _pos_of(wk, n_weeks, pos)
+        if w is None:
+            continue
+        arr = out.get(node)
+        if arr is None:
+            arr = out[node] = np.zeros((n_weeks, 4), dtype=np.int64)
+        arr[w, _bucket_idx(b)] += int(c)
+    return out
+
+
+# ----------------------------
+# (c) ストリーミング
+# ----------------------------
+def iter_bucket_rows(con: sqlite3.Connection, src: BucketSource, *,
+                     where: Mapping[str, Any], chunk: int = 10000
+                     ) -> Iterator[Tuple[Any, Any, str, str]]:
+    """
+    (node, 週キー, bucket, lot_id) を node → 週 → セル内順 で chunk 行ずつ流す。
+    全件をメモリに載せないのでエクスポート向け。
+    """
+    w_sql, args = _where_sql(src, where)
+    # バケツ列では並べない（NULL / 小文字の表記ゆれがあっても同じ週の中は cell_order 順になる）
+    sql = (f"SELECT {src.node}, {src.week}, {_bucket_sel(src)}, lot_id FROM {src.table}{w_sql} "
+           f"ORDER BY {src.node}, {src.week_order}, {src.cell_order}")
+    cur = con.execute(sql, args)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            for r in rows:
+                yield r[0], r[1], r[2], r[3]
+    finally:
+        cur.close()
+
+
+def load_buckets(con: sqlite3.Connection, src: BucketSource, *, weeks: Weeks,
+                 where: Mapping[str, Any], nodes=None, chunk: int = 10000
+                 ) -> Tuple[Dict[Any, List[List[List[str]]]], int]:
+    """
+    iter_bucket_rows を 1 パスで psi 形式 {node: [[S, CO, I, P] × W]} に積む。
+    nodes を渡すとそのノードだけ（他は読み飛ばす）。戻り値は (psi_by_node, 範囲外でスキップした件数)。
+    """
+    n_weeks, pos = _week_lookup(weeks)
+    want = None if nodes is None else set(nodes)
+    out: Dict[Any, List[List[List[str]]]] = {}
+    skipped = 0
+    cur_node, cur_psi = object(), None
+    for node, wk, b, lot_id in iter_bucket_rows(con, src, where=where, chunk=chunk):
+        if node != cur_node:
+            cur_node = node
+            if want is not None and node not in want:
+                cur_psi = None
+            else:
+                cur_psi = out.get(node)
+                if cur_psi is None:
+                    cur_psi = out[node] = _empty_psi(n_weeks)
+        if cur_psi is None:
+            continue
+        w = _pos_of(wk, n_weeks, pos)
+        if w is None:
+            skipped += 1
+            continue
+        cur_psi[w][_bucket_idx(b)].append(lot_id)
+    return out, skipped
+
+
+# ----------------------------
+# (b) ノード単位の遅延ロード
+# ----------------------------
+class LazyNodeBuckets:
+    """
+    製品（where の条件）単位のビュー。
+    - counts() / node_counts(node): 件数だけ（初回に全ノードまとめて 1 クエリ）
+    - lots(node)                  : そのノードの lot_id を初めて参照したときに読む（以後キャッシュ）
+    key_of を渡すと node に名前などの別キーを使える（例: {node_name: node_id}）。
+    """
+
+    def __init__(self, con: sqlite3.Connection, src: BucketSource, *, weeks: Weeks,
+                 where: Mapping[str, Any], key_of: Optional[Mapping[Any, Any]] = None) -> None:
+        self.con = con
+        self.src = src
+        self.weeks = weeks
+        self.n_weeks = _week_lookup(weeks)[0]
+        self.where = dict(where)
+        self.key_of = key_of
+        self._counts: Optional[Dict[Any, np.ndarray]] = None
+        self._lots: Dict[Any, List[List[List[str]]]] = {}
+
+    def _key(self, node):
+        return self.key_of.get(node, node) if self.key_of is not None else node
+
+    def counts(self) -> Dict[Any, np.ndarray]:
+        if self._counts is None:
+            self._counts = count_buckets(self.con, self.src, weeks=self.weeks, where=self.where)
+        return self._counts
+
+    def node_counts(self, node) -> np.ndarray:
+        arr = self.counts().get(self._key(node))
+        return arr if arr is not None else np.zeros((self.n_weeks, 4), dtype=np.int64)
+
+    def is_loaded(self, node) -> bool:
+        return self._key(node) in self._lots
+
+    def lots(self, node) -> List[List[List[str]]]:
+        k = self._key(node)
+        psi = self._lots.get(k)
+        if psi is None:
+            where = dict(self.where)
+            where[self.src.node] = k
+            got, _ = load_buckets(self.con, self.src, weeks=self.weeks, where=where)
+            psi = self._lots[k] = got.get(k) or _empty_psi(self.n_weeks)
+        return psi
+
+    def attach(self, node_obj, attr: str = "psi4demand", node=None) -> None:
+        """node_obj.<attr> に lot_id を読み込んでセット（GUI でノードを開いたとき用）"""
+        setattr(node_obj, attr, self.lots(node if node is not None else node_obj.name))
+
+    def evict(self, node=None) -> None:
+        """読み込んだ lot_id を捨てる（node=None なら全部）"""
+        if node is None:
+            self._lots.clear()
+        else:
+            self._lots.pop(self._key(node), None)
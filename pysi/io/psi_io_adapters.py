@@ -27,6 +27,7 @@ import ast
 import json
 import sqlite3
 from typing import Dict, List, Tuple, Optional
+from pysi.io.lot_bucket_reader import LOT_BUCKET, ensure_covering_indexes
 # PSIバケツの並び（週ごとに [S, CO, I, P]）
 BUCKETS = ("S", "CO", "I", "P")
 BMAP = {"S": 0, "CO": 1, "I": 2, "P": 3}
@@ -153,6 +154,34 @@ def load_leaf_S_and_compute(
 # ----------------------------
 # pSi → DB : 計算結果の書き戻し
 # ----------------------------
+def _normalize_psi(seq, weeks: int) -> List[List[List[str]]]:
+    """
+    外側：週配列の長さを calendar に合わせる
+    内側：各週のバケツ配列を [S,CO,I,P] の 4 要素にそろえ、要素は list として扱う
+    （PSIStore のビューなど list 以外のシーケンスもそのまま読める）
+    """
+    base = list(seq or [])
+    if len(base) < weeks:
+        base += [None] * (weeks - len(base))
+    elif len(base) > weeks:
+        base = base[:weeks]
+    out: List[List[List[str]]] = []
+    for w in range(weeks):
+        wk = base[w]
+        if wk is None or isinstance(wk, (str, bytes)):
+            out.append([[], [], [], []])
+            continue
+        # 0..3 を見る。足りなければ [] でパディング、タプル等は list に変換
+        n = len(wk)
+        week_buckets: List[List[str]] = []
+        for i in range(4):
+            b = wk[i] if i < n else None
+            if b is None or isinstance(b, (str, bytes)):
+                week_buckets.append([])
+            else:
+                week_buckets.append(list(b))
+        out.append(week_buckets)
+    return out
 def write_layer_to_lot_bucket(
     conn: sqlite3.Connection,
     *,
@@ -172,38 +201,11 @@ def write_layer_to_lot_bucket(
     node_id = get_node_id(conn, node_name)
     product_id = get_product_id(conn, product_name)
     psi = node_obj.psi4demand if layer == "demand" else node_obj.psi4supply
-    if not isinstance(psi, list):
+    if psi is None:
         raise ValueError(f"{layer} PSI not initialized on node '{node_name}'")
     # --- 安全パッチ：calendar 週数に合わせて週配列を正規化し、
     #                 各週の [S,CO,I,P] を 4 バケツにパディングする ---
     weeks = conn.execute("SELECT COUNT(*) FROM calendar_iso").fetchone()[0] or 0
-    def _normalize_psi(seq, weeks: int) -> List[List[List[str]]]:
-        """
-        外側：週配列の長さを calendar に合わせる
-        内側：各週のバケツ配列を [S,CO,I,P] の 4 要素にそろえ、要素は list として扱う
-        """
-        base = list(seq or [])
-        if len(base) < weeks:
-            base += [None] * (weeks - len(base))
-        elif len(base) > weeks:
-            base = base[:weeks]
-        out: List[List[List[str]]] = []
-        for w in range(weeks):
-            wk = base[w]
-            if not isinstance(wk, (list, tuple)):
-                out.append([[], [], [], []])
-                continue
-            # 0..3 を見る。足りなければ [] でパディング、タプル等は list に変換
-            week_buckets: List[List[str]] = []
-            for i in range(4):
-                if i < len(wk) and isinstance(wk[i], (list, tuple)):
-                    week_buckets.append(list(wk[i]))
-                elif i < len(wk) and wk[i] is None:
-                    week_buckets.append([])
-                else:
-                    week_buckets.append([])
-            out.append(week_buckets)
-        return out
     psi_norm = _normalize_psi(psi, weeks)
     # --- 安全パッチ ここまで ---
     # 対象スライスを丸ごと置換（冪等・決定性のため推奨）
@@ -255,6 +257,224 @@ def write_both_layers(
     )
     return d, s
 # ----------------------------
+# pSi → DB : ツリー／フォレスト一括書き戻し
+# ----------------------------
+# write_layer_to_lot_bucket はノード×層ごとに COUNT/DELETE/INSERT を別トランザクションで
+# 流すため、ツリー全体だと commit が数千回になる。ここでは
+#   - calendar / node / product の解決を 1 回ずつ
+#   - 既存行との差分（消える行は rowid で DELETE、増える行だけ INSERT）
+#   - 全ノード・全層を 1 トランザクション（SQL 文は固定文字列なので文キャッシュが効く）
+#   - 一時的に WAL / synchronous=NORMAL、大量書込み時は二次インデックスを後で作り直す
+# で書き戻す。PSI が変わっていなければ書込みはほぼゼロ。
+_SQL_BUCKET_SELECT = """SELECT rowid, node_id, week_index, bucket, lot_id
+    FROM lot_bucket WHERE scenario_id=? AND layer=? AND product_id=?"""
+_SQL_BUCKET_DELETE = "DELETE FROM lot_bucket WHERE rowid=?"
+_SQL_BUCKET_INSERT = """INSERT INTO lot_bucket
+    (scenario_id, layer, node_id, product_id, week_index, bucket, lot_id)
+    VALUES(?,?,?,?,?,?,?)
+    ON CONFLICT(scenario_id, layer, node_id, product_id, week_index, bucket, lot_id)
+    DO NOTHING"""
+def _iter_tree(root):
+    st = [root]; seen = set()
+    while st:
+        n = st.pop()
+        if n is None or id(n) in seen:
+            continue
+        seen.add(id(n)); yield n
+        st.extend(getattr(n, "children", []) or [])
+def _lot_bucket_indexes(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """lot_bucket の明示的な二次インデックス（UNIQUE 制約の autoindex は除く）"""
+    return [(r[0], r[1]) for r in conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type='index' AND tbl_name='lot_bucket' AND sql IS NOT NULL"
+    )]
+class _BulkLoad:
+    """
+    一括書込み用のセッション（PRAGMA の一時変更と二次インデックスの後付け）。
+    外側でトランザクションが開いていれば何もしない（journal_mode はトランザクション中に
+    変えられず、DDL を挟むと外側の原子性も崩れるため）。
+    """
+    def __init__(self, conn: sqlite3.Connection, *, pragmas: bool = True):
+        self.conn = conn
+        self.active = pragmas and not conn.in_transaction
+        self._saved: Dict[str, object] = {}
+        self._dropped: List[Tuple[str, str]] = []
+    def __enter__(self) -> "_BulkLoad":
+        if self.active:
+            c = self.conn
+            self._saved = {
+                "journal_mode": c.execute("PRAGMA journal_mode").fetchone()[0],
+                "synchronous": c.execute("PRAGMA synchronous").fetchone()[0],
+            }
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+        return self
+    def defer_indexes(self) -> None:
+        """二次インデックスを落とす（__exit__ で作り直す）"""
+        if not self.active or self._dropped:
+            return
+        self._dropped = _lot_bucket_indexes(self.conn)
+        for name, _ in self._dropped:
+            self.conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+    def __exit__(self, exc_type, exc, tb) -> None:
+        c = self.conn
+        try:
+            for _, sql in self._dropped:
+                c.execute(sql)
+            if self._dropped and c.in_transaction:
+                c.commit()
+        finally:
+            if self._saved:
+                c.execute(f"PRAGMA synchronous={int(self._saved['synchronous'])}")
+                if str(self._saved["journal_mode"]).lower() != "wal":
+                    c.execute(f"PRAGMA journal_mode={self._saved['journal_mode']}")
+def _desired_bucket_rows(nodes, node_ids: Dict[str, int], layer: str, weeks: int):
+    """{(node_id, week_index, bucket, lot_id)} を作る（PSI 未初期化ノードは対象外）"""
+    want = set()
+    covered = set()
+    attr = "psi4demand" if layer == "demand" else "psi4supply"
+    for n in nodes:
+        psi = getattr(n, attr, None)
+        if psi is None:
+            continue
+        nid = node_ids[n.name]
+        covered.add(nid)
+        for w, buckets in enumerate(_normalize_psi(psi, weeks)):
+            for key, idx in BMAP.items():
+                for lot in buckets[idx]:
+                    want.add((nid, w, key, lot))
+    return want, covered
+def _plan_lot_bucket_writes(conn: sqlite3.Connection, *, scenario_id: int, nodes,
+                            product_name: str, layers, diff: bool,
+                            node_ids: Dict[str, int], weeks: int):
+    """
+    書込み計画を作る（読み取りのみ）。
+    戻り値: (deletes[(rowid,)], inserts[row], stats)
+    """
+    for layer in layers:
+        if layer not in ("demand", "supply"):
+            raise ValueError("layer must be 'demand' or 'supply'")
+    nodes = list(nodes)
+    unknown = [n.name for n in nodes if n.name not in node_ids]
+    if unknown:
+        # node 表に無いノードは書かずに飛ばす（ツリー全体の書込みは止めない）
+        print(f"[WARN] {product_name}: {len(unknown)} node(s) not in node table; skipped: {unknown[:10]}")
+        nodes = [n for n in nodes if n.name in node_ids]
+    product_id = get_product_id(conn, product_name)
+    stats = {"inserted": 0, "deleted": 0, "unchanged": 0, "nodes": len(nodes), "skipped": len(unknown)}
+    dels: List[Tuple[int]] = []
+    ins: List[tuple] = []
+    for layer in layers:
+        want, covered = _desired_bucket_rows(nodes, node_ids, layer, weeks)
+        stats[layer] = len(want)
+        if not covered:
+            continue
+        for rowid, nid, w, key, lot in conn.execute(
+            _SQL_BUCKET_SELECT, (scenario_id, layer, product_id)
+        ):
+            if nid not in covered:
+                continue
+            k = (nid, w, key, lot)
+            if diff and k in want:
+                want.discard(k)
+                stats["unchanged"] += 1
+            else:
+                dels.append((rowid,))
+        ins.extend((scenario_id, layer, nid, product_id, w, key, lot)
+                   for nid, w, key, lot in sorted(want))
+    stats["deleted"] = len(dels)
+    stats["inserted"] = len(ins)
+    return dels, ins, stats
+def _apply_lot_bucket_writes(conn: sqlite3.Connection, plans, *,
+                             bulk_pragmas: bool, defer_index_threshold: int) -> None:
+    """計画をまとめて 1 トランザクションで流す（SQL 文は固定なので文キャッシュが効く）"""
+    n_writes = sum(len(d) + len(i) for d, i in plans)
+    if n_writes == 0:
+        return
+    with _BulkLoad(conn, pragmas=bulk_pragmas) as bl:
+        if bl.active:
+            # 読む側（lot_bucket_reader）は DDL を出さないので covering index は書く側で用意する
+            ensure_covering_indexes(conn, (LOT_BUCKET,))
+        if n_writes >= defer_index_threshold:
+            bl.defer_indexes()
+        with conn:
+            for dels, ins in plans:
+                if dels:
+                    conn.executemany(_SQL_BUCKET_DELETE, dels)
+                if ins:
+                    conn.executemany(_SQL_BUCKET_INSERT, ins)
+def _lookup_tables(conn: sqlite3.Connection) -> Tuple[Dict[str, int], int]:
+    node_ids = {r[1]: int(r[0]) for r in conn.execute("SELECT id, name FROM node")}
+    weeks = conn.execute("SELECT COUNT(*) FROM calendar_iso").fetchone()[0] or 0
+    return node_ids, int(weeks)
+def write_nodes_to_lot_bucket(
+    conn: sqlite3.Connection,
+    *,
+    scenario_id: int,
+    nodes,
+    product_name: str,
+    layers=("demand", "supply"),
+    diff: bool = True,
+    bulk_pragmas: bool = True,
+    defer_index_threshold: int = 50_000,
+) -> Dict[str, int]:
+    """
+    複数ノードの pSi を 1 トランザクションで lot_bucket に書き戻す。
+    diff=True  : 既存行と突き合わせ、差分だけ DELETE/INSERT（再実行で不変なら書込みなし）
+    diff=False : 対象ノードのスライスを DELETE してから全件 INSERT（write_layer_to_lot_bucket 相当）
+    node 表に無いノードは警告を出して飛ばす（件数は "skipped"）。
+    戻り値: {"inserted", "deleted", "unchanged", "nodes", "skipped", <layer>: 書戻し後の行数}
+    """
+    node_ids, weeks = _lookup_tables(conn)
+    dels, ins, stats = _plan_lot_bucket_writes(
+        conn, scenario_id=scenario_id, nodes=nodes, product_name=product_name,
+        layers=layers, diff=diff, node_ids=node_ids, weeks=weeks,
+    )
+    _apply_lot_bucket_writes(conn, [(dels, ins)], bulk_pragmas=bulk_pragmas,
+                             defer_index_threshold=defer_index_threshold)
+    return stats
+def write_tree_to_lot_bucket(
+    conn: sqlite3.Connection,
+    *,
+    scenario_id: int,
+    root_node,
+    product_name: str,
+    **kw,
+) -> Dict[str, int]:
+    """ツリー全ノードを一括で書き戻す（write_nodes_to_lot_bucket の薄いラッパ）"""
+    return write_nodes_to_lot_bucket(
+        conn, scenario_id=scenario_id, nodes=_iter_tree(root_node),
+        product_name=product_name, **kw,
+    )
+def write_forest_to_lot_bucket(
+    conn: sqlite3.Connection,
+    *,
+    scenario_id: int,
+    prod_tree_dict: Dict[str, object],
+    layers=("demand", "supply"),
+    diff: bool = True,
+    bulk_pragmas: bool = True,
+    defer_index_threshold: int = 50_000,
+) -> Dict[str, Dict[str, int]]:
+    """
+    {product: root} の全製品を 1 トランザクションで書き戻す。
+    戻り値: {product: stats}
+    """
+    node_ids, weeks = _lookup_tables(conn)
+    out: Dict[str, Dict[str, int]] = {}
+    plans = []
+    for product in sorted(p for p, r in prod_tree_dict.items() if r is not None):
+        dels, ins, stats = _plan_lot_bucket_writes(
+            conn, scenario_id=scenario_id, nodes=_iter_tree(prod_tree_dict[product]),
+            product_name=product, layers=layers, diff=diff,
+            node_ids=node_ids, weeks=weeks,
+        )
+        plans.append((dels, ins))
+        out[product] = stats
+    _apply_lot_bucket_writes(conn, plans, bulk_pragmas=bulk_pragmas,
+                             defer_index_threshold=defer_index_threshold)
+    return out
+# ----------------------------
 # 便利：葉～親まで一気に（任意）
 # ----------------------------
 def run_engine_postorder_and_write(
@@ -266,21 +486,22 @@ def run_engine_postorder_and_write(
     # 休暇シフト・SSは各 Node.calcS2P / 既存 propagate 関数に委譲
     propagate_fn=None,   # 例: pysi.plan.operations.propagate_postorder_with_calcP2S
     write_layers=("demand","supply"),
+    write_scope: str = "root",   # "root" = root ノードのみ（従来どおり） / "tree" = ツリー全ノード
 ) -> Dict[str, int]:
     """
     既に各 leaf に S を注入済み（load_leaf_S_and_computeを別途呼んだ）という前提で、
     ツリー全体の post-order 伝播 → 書き戻しを行う簡易ランナー。
     """
+    if write_scope not in ("root", "tree"):
+        raise ValueError("write_scope must be 'root' or 'tree'")
     if propagate_fn:
         propagate_fn(root_node, layer="demand", replace_parent_S=True)
-    out = {}
-    for layer in write_layers:
-        n = write_layer_to_lot_bucket(
-            conn, scenario_id=scenario_id, node_obj=root_node,
-            product_name=product_name, layer=layer, replace_slice=True
-        )
-        out[layer] = n
-    return out
+    nodes = [root_node] if write_scope == "root" else _iter_tree(root_node)
+    stats = write_nodes_to_lot_bucket(
+        conn, scenario_id=scenario_id, nodes=nodes,
+        product_name=product_name, layers=tuple(write_layers),
+    )
+    return {layer: stats[layer] for layer in write_layers}
 # ----------------------------
 # 最小使用例（参考）
 # ----------------------------
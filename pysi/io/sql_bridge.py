@@ -7,6 +7,7 @@ from pysi.db.sqlite_bridge import (
     upsert_node, upsert_node_product, upsert_tariff,
     persist_node_psi, set_price_tag
 )
+from pysi.evaluate.frame_cache import ensure_change_counters, invalidate_frames
 # ---- ざっくり最小スキーマ（存在しなければ作成） -----------------
 SCHEMA_SQL = r"""
 CREATE TABLE IF NOT EXISTS product(
@@ -67,6 +68,8 @@ CREATE TABLE IF NOT EXISTS psi(
   bucket TEXT,
   lot_id TEXT
 );
+-- covering index（pysi.io.lot_bucket_reader.PSI_TABLE。製品単位の集計・ノード単位の読込が本表を引かない）
+CREATE INDEX IF NOT EXISTS idx_psi_cover ON psi(product_name, node_name, iso_index, bucket, lot_id);
 CREATE TABLE IF NOT EXISTS price_tag(
   node_name TEXT,
   product_name TEXT,
@@ -129,6 +132,7 @@ def persist_all_psi(psi_env, db_path: str):
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     with connect(db_path) as con:
         init_schema(con, schema_sql=SCHEMA_SQL)
+        ensure_change_counters(con)   # frame_cache の版カウンタはスキーマ作成時に張る
         # 製品ごとにツリーを走査
         prod_roots: Dict[str, object] = getattr(psi_env, "prod_tree_dict_OT", {}) or {}
         for product_name, root in prod_roots.items():
@@ -154,6 +158,7 @@ def persist_all_psi(psi_env, db_path: str):
                     p = getattr(n, "offering_price_TOBE", None)
                     if p is not None:
                         set_price_tag(con, n.name, product_name, "TOBE", float(p))
+    invalidate_frames(db_path)   # node_product / price_tag を書いた
 def persist_tariff_table(db_path: str, tariff_table: Dict[tuple, float] | Iterable[tuple]):
     """
     tariff_table: {(product_name, from_node, to_node): rate} もしくは
@@ -161,12 +166,14 @@ def persist_tariff_table(db_path: str, tariff_table: Dict[tuple, float] | Iterab
     """
     with connect(db_path) as con:
         init_schema(con, schema_sql=SCHEMA_SQL)
+        ensure_change_counters(con)   # frame_cache の版カウンタはスキーマ作成時に張る
         if isinstance(tariff_table, dict):
             items = [(k[0], k[1], k[2], v) for k, v in tariff_table.items()]
         else:
             items = list(tariff_table)
         for product_name, from_node, to_node, rate in items:
             upsert_tariff(con, str(product_name), str(from_node), str(to_node), float(rate))
+    invalidate_frames(db_path)
 #@250823 ADD
 # --- geo migration & import helpers ---------------------------------
 import sqlite3, csv
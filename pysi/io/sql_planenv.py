@@ -4,6 +4,7 @@ import sqlite3, json
 import copy  # 先頭付近に追加
 from collections import defaultdict
 from typing import Dict, List, Tuple, Optional
+from pysi.io.lot_bucket_reader import PSI_TABLE, load_buckets
 from pysi.network.node_base import Node  # 既存Node: .name, .children, .add_child(child) を前提
 def _walk_nodes(n):
     st=[n]; seen=set()
@@ -150,25 +151,12 @@ def _attach_psi(con: sqlite3.Connection, root: Node, product_name: str, weeks_co
             for c in getattr(x, "children", []) or []:
                 st.append(c)
     name2node = {n.name: n for n in _walk(root)}
-    # 初期化（全週×4バケツ）
-    for n in name2node.values():
-        n.psi4demand = [[[ ] for _ in range(4)] for __ in range(weeks_count)]
-    # 取込：psi(node_name, product_name, iso_index, bucket, lot_id)
-    # bucketは 'S','CO','I','P'
-    for r in con.execute(
-        "SELECT node_name, iso_index, bucket, lot_id "
-        "FROM psi WHERE product_name=? ORDER BY iso_index",
-        (product_name,)
-    ):
-        nm = r["node_name"]
-        if nm not in name2node:
-            continue
-        w = int(r["iso_index"] or 0)
-        if not (0 <= w < weeks_count):
-            continue
-        b = BUCKET.get((r["bucket"] or "S").upper(), 0)
-        lot_id = r["lot_id"]
-        name2node[nm].psi4demand[w][b].append(lot_id)
+    # psi(node_name, product_name, iso_index, bucket, lot_id) を covering index 順に 1 パスで読む
+    # （bucketは 'S','CO','I','P'。ノード → 週 → バケツ 順に chunk ずつ流すので全行を一度に持たない）
+    loaded, _ = load_buckets(con, PSI_TABLE, weeks=weeks_count,
+                             where={"product_name": product_name}, nodes=name2node)
+    for nm, n in name2node.items():
+        n.psi4demand = loaded.get(nm) or [[[ ] for _ in range(4)] for __ in range(weeks_count)]
 def _attach_price_tags(con: sqlite3.Connection, root: Node, product_name: str):
     """
     price_tag(node_name, product_name, tag in('ASIS','TOBE'), price)
@@ -398,6 +386,32 @@ class SqlPlanEnv:
         r_ot = self.prod_tree_dict_OT.get(product_name)
         r_in = self.prod_tree_dict_IN.get(product_name, r_ot)
         return (r_ot, r_in)
+    def plan_all_products(self, mode: str = "demand", max_workers: int | None = None,
+                          decouple_nodes=None):
+        """
+        全製品を製品単位で並列計画し、結果を手元のツリーへ書き戻す。
+        各 worker は自分の SQLite 接続でツリーを復元する（pysi.plan.parallel_plan）。
+        product_edge が無い DB（旧 node/node_product から構築）は、手元のツリーを worker へ渡す。
+        """
+        from pysi.plan.parallel_plan import (
+            apply_packed_psi, edge_products, plan_forest_parallel, plan_products_parallel,
+        )
+        if not edge_products(self.db_path):
+            print(f"[INFO] {self.db_path}: no product_edge rows; "
+                  "planning in-memory trees (plan_forest_parallel)")
+            return plan_forest_parallel(
+                self.prod_tree_dict_OT, self.prod_tree_dict_IN,
+                mode=mode, max_workers=max_workers, decouple_nodes=decouple_nodes, apply=True,
+            )
+        packed = plan_products_parallel(
+            self.db_path,
+            [p for p in self.product_name_list if self.prod_tree_dict_OT.get(p) is not None],
+            mode=mode, max_workers=max_workers, decouple_nodes=decouple_nodes,
+        )
+        for p, pk in packed.items():
+            apply_packed_psi(self.prod_tree_dict_OT.get(p), pk.get("OUT"))
+            apply_packed_psi(self.prod_tree_dict_IN.get(p), pk.get("IN"))
+        return packed
     def reload(self):
         """DBの最新状態を再読込してツリー/PSI/価格を再構築。"""
         self.product_name_list.clear()
@@ -11,6 +11,7 @@ from pysi.io.psi_io_adapters import (
     get_node_id,
     get_product_id,
 )
+from pysi.io.lot_bucket_reader import LOT_TABLE, load_buckets
 # ******************************************
 # 本物の PlanNode を使う
 # ******************************************
@@ -75,21 +76,14 @@ def _build_psibuckets_from_lot(conn: sqlite3.Connection, scenario_id: int,
     weeks = len(week_seq)
     node_id = get_node_id(conn, node_name)
     product_id = get_product_id(conn, product_name)
-    rows = conn.execute(
-        """SELECT iso_year, iso_week, lot_id
-             FROM lot
-            WHERE scenario_id=? AND node_id=? AND product_id=?
-            ORDER BY iso_year, iso_week, lot_id""",
-        (scenario_id, node_id, product_id)
-    ).fetchall()
-    pSi = [[] for _ in range(weeks)]
-    missed = 0
-    for y, w, lot_id in rows:
-        idx = week_map.get((int(y), int(w)))
-        if idx is None or not (0 <= idx < weeks):
-            missed += 1
-            continue
-        pSi[idx].append(lot_id)
+    # lot(iso_year, iso_week, lot_id) を covering index で読む（週キーは iso_year*100 + iso_week）
+    loaded, missed = load_buckets(
+        conn, LOT_TABLE,
+        weeks={y * 100 + w: i for (y, w), i in week_map.items() if 0 <= i < weeks},
+        where={"scenario_id": scenario_id, "product_id": product_id, "node_id": node_id},
+    )
+    psi = loaded.get(node_id) or []
+    pSi = [list(wk[0]) for wk in psi] + [[] for _ in range(weeks - len(psi))]
     if missed:
         print(f"[WARN] lot→PSI: {node_name}/{product_name} シナリオ外 {missed} 件をスキップ")
     shim = _NodeShim(node_name)
@@ -68,73 +68,137 @@ def _normalize_monthly_demand_df_sku(df: pd.DataFrame) -> pd.DataFrame:
     df = df.dropna(subset=["year"]).copy()
     df["year"] = df["year"].astype(int)
     return df[required]
+# *********************************
+# 月次 → 週次 → lot_id（ベクトル化版の共通部品）
+# *********************************
+# 旧実装は (行×月) ごとに日次 DataFrame を作って concat → ISO週で groupby していた。
+# 各日の値は「月の値そのもの」なので、週次値 = 月の値 × (その月のうちその週に入る日数)。
+# (year, month) → (iso_year, iso_week, 日数) の表を一度だけ作り、merge で一括集計する。
+WEEKLY_COLS = ["product_name", "node_name", "iso_year", "iso_week", "value"]
+_LOT_SEQ: list = []  # "0001", "0002", ...（必要な分だけ伸ばして使い回す）
+def _lot_seq(n: int) -> list:
+    if n > len(_LOT_SEQ):
+        _LOT_SEQ.extend(f"{i:04d}" for i in range(len(_LOT_SEQ) + 1, n + 1))
+    return _LOT_SEQ
+def month_week_days(years) -> pd.DataFrame:
+    """
+    指定年の (year, month) ごとに、含まれる ISO 週と日数を返す。
+    戻り値列: year, month, iso_year, iso_week, ndays
+    """
+    years = sorted({int(y) for y in years})
+    if not years:
+        return pd.DataFrame(columns=["year", "month", "iso_year", "iso_week", "ndays"])
+    dates = pd.date_range(f"{years[0]}-01-01", f"{years[-1]}-12-31", freq="D")
+    dates = dates[dates.year.isin(years)]
+    iso = dates.isocalendar()
+    days = pd.DataFrame({
+        "year":     dates.year.astype(int),
+        "month":    dates.month.astype(int),
+        "iso_year": iso["year"].to_numpy().astype(int),
+        "iso_week": iso["week"].to_numpy().astype(int),
+    })
+    return days.groupby(["year", "month", "iso_year", "iso_week"], as_index=False).size() \
+               .rename(columns={"size": "ndays"})
+def monthly_to_weekly_values(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    正規化済み月次 (product_name,node_name,year,m1..m12) → ISO 週次の value 集計。
+    戻り値列: product_name, node_name, iso_year, iso_week(int), value
+    """
+    months = [f"m{m}" for m in range(1, 13)]
+    vals = df[months].to_numpy(dtype=float)
+    r, c = np.nonzero(vals)
+    if len(r) == 0:
+        return pd.DataFrame(columns=WEEKLY_COLS)
+    melt = pd.DataFrame({
+        "product_name": df["product_name"].to_numpy()[r],
+        "node_name":    df["node_name"].to_numpy()[r],
+        "year":         df["year"].to_numpy().astype(int)[r],
+        "month":        c + 1,
+        "value":        vals[r, c],
+    })
+    mw = month_week_days(melt["year"].unique())
+    j = melt.merge(mw, on=["year", "month"], how="inner")
+    j["value"] = j["value"] * j["ndays"]
+    return (j.groupby(["product_name", "node_name", "iso_year", "iso_week"], as_index=False)["value"]
+             .sum())
+def lot_size_table(pairs: pd.DataFrame, lot_size_lookup) -> pd.DataFrame:
+    """
+    (product_name, node_name) のユニーク組に lot_size を付けた表を作る（最低 1）。
+    lot_size_lookup は callable(product, node) / DataFrame(product_name,node_name,lot_size) /
+    dict{(product, node): lot_size} のいずれか。callable はユニーク組ごとに 1 回だけ呼ぶ。
+    """
+    keys = pairs[["product_name", "node_name"]].drop_duplicates().reset_index(drop=True)
+    if isinstance(lot_size_lookup, pd.DataFrame):
+        t = keys.merge(lot_size_lookup[["product_name", "node_name", "lot_size"]],
+                       on=["product_name", "node_name"], how="left")
+        sizes = pd.to_numeric(t["lot_size"], errors="coerce").fillna(1).to_numpy()
+    else:
+        if isinstance(lot_size_lookup, dict):
+            d = lot_size_lookup
+            lookup = lambda p, n: d.get((p, n), 1)
+        else:
+            lookup = lot_size_lookup
+        sizes = []
+        for p, n in zip(keys["product_name"], keys["node_name"]):
+            try:
+                sizes.append(int(lookup(p, n)))
+            except Exception:
+                sizes.append(1)
+        sizes = np.asarray(sizes, dtype=float)
+    keys["lot_size"] = np.maximum(1, sizes.astype(int))
+    return keys
+def attach_lots(df_weekly: pd.DataFrame, lot_size_lookup) -> pd.DataFrame:
+    """
+    週次 value に lot_size / S_lot(=ceil(value/lot_size)) / lot_id_list を付ける。
+    lot_id は NODE-PRODUCT-YYYYWWNNNN（週単位で 0001 リセット）。
+    """
+    sizes = lot_size_table(df_weekly, lot_size_lookup)
+    out = df_weekly.merge(sizes, on=["product_name", "node_name"], how="left")
+    out["S_lot"] = np.ceil(out["value"].to_numpy(dtype=float)
+                           / out["lot_size"].to_numpy()).astype(int)
+    out["lot_id_list"] = build_lot_id_lists(out)
+    return out
+def _lot_prefixes(df: pd.DataFrame) -> np.ndarray:
+    nn = df["node_name"].map(_sanitize_token)
+    pn = df["product_name"].map(_sanitize_token)
+    yw = df["iso_year"].astype(int).astype(str) + df["iso_week"].astype(int).astype(str).str.zfill(2)
+    return (nn + LOT_SEP + pn + LOT_SEP + yw).to_numpy()
+def build_lot_id_lists(df: pd.DataFrame) -> list:
+    """S_lot 列から行ごとの lot_id リストを一括生成"""
+    counts = df["S_lot"].to_numpy().astype(int)
+    seq = _lot_seq(int(counts.max()) if len(counts) else 0)
+    return [[p + s for s in seq[:c]] if c > 0 else []
+            for p, c in zip(_lot_prefixes(df), counts)]
+def flatten_lot_ids(df: pd.DataFrame):
+    """
+    lot_id を 1 次元に展開する（DB 投入用）。
+    戻り値: (row_index(np.ndarray), lot_ids(list[str]))  row_index は df の位置
+    """
+    counts = np.maximum(df["S_lot"].to_numpy().astype(int), 0)
+    if counts.sum() == 0:
+        return np.zeros(0, dtype=np.int64), []
+    row_idx = np.repeat(np.arange(len(df)), counts)
+    # 行内の連番（0 始まり）
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    within = np.arange(len(row_idx)) - starts
+    seq = _lot_seq(int(counts.max()))
+    prefixes = _lot_prefixes(df)
+    return row_idx, [prefixes[i] + seq[k] for i, k in zip(row_idx.tolist(), within.tolist())]
 def convert_monthly_to_weekly_sku(df: pd.DataFrame, lot_size_lookup) -> tuple[pd.DataFrame, int, int]:
     """
     月次を週次に変換。行ごとの lot_size は lot_size_lookup(product_name, node_name) で解決。
+    （lot_size_lookup は DataFrame / dict でも可。lot_size_table 参照）
     戻り値: (df_weekly, plan_range, plan_year_st)
     """
     # 計画レンジ
-    plan_range, plan_year_st = check_plan_range(df.rename(columns={"year":"year"}))
-    # 縦持ち化
-    df_melt = df.melt(
-        id_vars=["product_name", "node_name", "year"],
-        var_name="month", value_name="value"
-    )
-    # 'm1'→1
-    df_melt["month"] = df_melt["month"].str[1:].astype(int)
-    # 日次にばらし → 週番号で集計
-    frames = []
-    for _, r in df_melt.iterrows():
-        y = int(r["year"]); m = int(r["month"]); v = float(r["value"])
-        if v == 0:
-            continue
-        try:
-            days = pd.Timestamp(y, m, 1).days_in_month
-        except Exception:
-            continue
-        dates = pd.date_range(f"{y}-{m:02d}-01", periods=days, freq="D")
-        frames.append(pd.DataFrame({
-            "product_name": r["product_name"],
-            "node_name":    r["node_name"],
-            "date":         dates,
-            "value":        v
-        }))
-    if frames:
-        df_daily = pd.concat(frames, ignore_index=True)
-    else:
-        df_daily = pd.DataFrame(columns=["product_name","node_name","date","value"])
-    if df_daily.empty:
+    plan_range, plan_year_st = check_plan_range(df)
+    df_weekly = monthly_to_weekly_values(df)
+    if df_weekly.empty:
         # 空でも落ちないように最低限の列を返す
         return (pd.DataFrame(columns=["product_name","node_name","iso_year","iso_week","value","S_lot","lot_id_list"]),
                 plan_range, plan_year_st)
-    iso = df_daily["date"].dt.isocalendar()
-    df_daily["iso_year"] = iso.year.astype(int)
-    df_daily["iso_week"] = iso.week.astype(int)
-    df_weekly = (
-        df_daily.groupby(["product_name","node_name","iso_year","iso_week"], as_index=False)["value"]
-        .sum()
-    )
-    # lot_size を行ごとに解決して S_lot と lot_id を作成
-    def _row_lot_size(row):
-        try:
-            return max(1, int(lot_size_lookup(row["product_name"], row["node_name"])))
-        except Exception:
-            return 1
-    df_weekly["lot_size"] = df_weekly.apply(_row_lot_size, axis=1)
-    df_weekly["S_lot"]    = (df_weekly["value"] / df_weekly["lot_size"]).apply(np.ceil).astype(int)
-    # 既存: df_weekly["S_lot"] = ...
-    # ここから lot_id 生成の関数を差し替え
-    def _mk_lots(row):
-        y   = int(row["iso_year"])
-        w   = int(row["iso_week"])
-        nn  = _sanitize_token(row["node_name"])
-        pn  = _sanitize_token(row["product_name"])
-        cnt = int(row["S_lot"])
-        if cnt <= 0:
-            return []
-        # 形式: NODE-PRODUCT-YYYYWWNNNN
-        return [f"{nn}{LOT_SEP}{pn}{LOT_SEP}{y}{w:02d}{i+1:04d}" for i in range(cnt)]
-    df_weekly["lot_id_list"] = df_weekly.apply(_mk_lots, axis=1)
+    # lot_size は (product,node) のユニーク組ごとに 1 回だけ解決して結合、S_lot と lot_id を一括生成
+    df_weekly = attach_lots(df_weekly, lot_size_lookup)
     # 互換のため: iso_week は "02" 文字列
     df_weekly["iso_week"] = df_weekly["iso_week"].astype(str).str.zfill(2)
     return df_weekly, plan_range, plan_year_st
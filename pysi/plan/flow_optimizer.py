@@ -0,0 +1,472 @@
+# pysi/plan/flow_optimizer.py
+# 最小費用流（供給網の最適化）を配列ベースで解く
+#
+# 旧: 最適化ボタンのたびに G_add_edge_from_tree / Gdm_add_edge_sc2nx_outbound / Gsp_add_edge_sc2nx_inbound で
+#     networkx のグラフを作り直し、nx.network_simplex(G) をゼロから解く
+# 新: FlowNetwork にノード・エッジを 1 回だけ登録して列（tail / head / capacity / weight / demand）に持つ（arrays() で numpy 配列）。
+#     - update_from_graph(G) : 容量・重み・需要の変わった要素だけ差し替える（構造が同じなら CSR も再利用）
+#     - solve(warm_start=…)  : 前回の flowDict_opt（または直前の解）を初期フローにして、
+#                              残余グラフの負閉路の打ち消し + ポテンシャル付き逐次最短路（Dijkstra）で最適化
+#     容量・需要を少し動かしただけなら前回解からの修正だけで済む。
+#
+# 規約は nx.network_simplex と同じ:
+#   node["demand"] = 流入 - 流出（負なら供給）/ edge["capacity"]（無ければ無制限）/ edge["weight"]（無ければ 0）
+#   戻り値は (flowCost, flowDict)。flowDict は {u: {v: flow}} で全ノード・全エッジを含む。
+#
+# 複数製品・複数週は layer（例: 製品名や (製品, 週)）ごとに独立した部分網として 1 つの FlowNetwork に載せ、
+# まとめて解いてから flow_dict(layer) で取り出す（layer 間で容量は共有しない）。
+#
+#使い方
+#
+#net = FlowNetwork.from_graph(G_opt)
+#cost, flow = net.solve()
+#G_opt.edges[u, v]["capacity"] = 30
+#net.update_from_graph(G_opt)                        # 変わった 1 本だけ更新
+#cost, flow = net.solve(warm_start=flow)             # 前回解から再最適化
+#
+# コールド（初回）の 1 発解きは nx.network_simplex の方が速い。FlowNetwork が効くのは同じ網の再最適化なので、
+# GUI のように何度も解き直す場合は resolve_graph() を使う（初回は nx で解き、その解を持った網を返す）。
+#
+#net, cost, flow = resolve_graph(G_opt)              # 初回: nx.network_simplex
+#net, cost, flow = resolve_graph(G_opt, net)         # 2 回目以降: 変わった値だけ差し替えて前回解から
+
+from __future__ import annotations
+import heapq
+from collections import deque
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+UNLIMITED = -1   # arrays() の capacity 列で「無制限」を表す値（内部の list では None）
+
+
+class FlowInfeasible(ValueError):
+    """需要を満たすフローが存在しない（nx.NetworkXUnfeasible 相当）"""
+
+
+class FlowUnbounded(ValueError):
+    """無制限容量の負閉路がある（nx.NetworkXUnbounded 相当）"""
+
+
+def _num(x, default=0):
+    if x is None:
+        return default
+    if isinstance(x, (float, np.floating)) and float(x).is_integer():
+        return int(x)
+    return x.item() if isinstance(x, np.generic) else x
+
+
+class FlowNetwork:
+    """ノード × エッジを列で持つ最小費用流の網。ノードのキーは name または (layer, name)。"""
+
+    def __init__(self) -> None:
+        self._keys: List[Hashable] = []
+        self._index: Dict[Hashable, int] = {}
+        self._node_layer: List[Any] = []
+        self._node_name: List[Any] = []
+        self._demand: List[int] = []
+        self._node_active: List[bool] = []
+        self._tail: List[int] = []
+        self._head: List[int] = []
+        self._cap: List[Optional[int]] = []   # None = 無制限
+        self._weight: List[Any] = []
+        self._edge_active: List[bool] = []
+        self._edge_index: Dict[Tuple[int, int], int] = {}
+        self._csr = None             # (start, arcs)。構造が変わったら None に戻す
+        self.flow: Optional[np.ndarray] = None   # 直前の解（エッジ順）
+        self.flow_cost = None
+        self.changed = 0             # 直近の update_from_graph で変わった要素数
+
+    # ------------------------------------------------------------------
+    # 構築
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _key(layer, name) -> Hashable:
+        return name if layer is None else (layer, name)
+
+    def _node(self, layer, name) -> int:
+        k = self._key(layer, name)
+        i = self._index.get(k)
+        if i is None:
+            i = self._index[k] = len(self._keys)
+            self._keys.append(k)
+            self._node_layer.append(layer)
+            self._node_name.append(name)
+            self._demand.append(0)
+            self._node_active.append(True)
+        return i
+
+    def add_node(self, name, demand: int = 0, *, layer=None) -> None:
+        i = self._node(layer, name)
+        self._demand[i] = int(_num(demand))
+        self._node_active[i] = True
+
+    def add_edge(self, u, v, capacity: Optional[int] = None, weight=0, *, layer=None) -> None:
+        """u → v を登録（既にあれば容量と重みを上書き。nx.DiGraph.add_edge と同じ）"""
+        iu, iv = self._node(layer, u), self._node(layer, v)
+        cap = None if capacity is None else int(_num(capacity))
+        e = self._edge_index.get((iu, iv))
+        if e is None:
+            e = self._edge_index[(iu, iv)] = len(self._tail)
+            self._tail.append(iu)
+            self._head.append(iv)
+            self._cap.append(cap)
+            self._weight.append(_num(weight))
+            self._edge_active.append(True)
+            self._csr = None
+        else:
+            self._cap[e] = cap
+            self._weight[e] = _num(weight)
+            self._edge_active[e] = True
+
+    def add_graph(self, G, *, layer=None) -> "FlowNetwork":
+        """nx.DiGraph 互換のグラフ（nodes(data=True) / edges(data=True)）を layer として載せる"""
+        for n, d in G.nodes(data=True):
+            self.add_node(n, d.get("demand", 0) or 0, layer=layer)
+        for u, v, d in G.edges(data=True):
+            self.add_edge(u, v, d.get("capacity"), d.get("weight", 0) or 0, layer=layer)
+        return self
+
+    @classmethod
+    def from_graph(cls, G, *, layer=None) -> "FlowNetwork":
+        return cls().add_graph(G, layer=layer)
+
+    @classmethod
+    def from_layers(cls, graphs: Dict[Any, Any]) -> "FlowNetwork":
+        """{layer: G}（例: {product: G} / {(product, week): G}）をまとめて 1 つの網にする"""
+        net = cls()
+        for layer, G in graphs.items():
+            net.add_graph(G, layer=layer)
+        return net
+
+    def update_from_graph(self, G, *, layer=None) -> int:
+        """
+        G の現在値に合わせて容量・重み・需要を差し替える（変わった要素数を返す）。
+        G から消えたノード・エッジは休止扱い（容量 0 / flowDict に出さない）にし、
+        新しく増えたものだけ追加する。
+        """
+        changed = 0
+        seen_n, seen_e = set(), set()
+        for n, d in G.nodes(data=True):
+            i = self._index.get(self._key(layer, n))
+            dem = int(_num(d.get("demand", 0) or 0))
+            if i is None:
+                self.add_node(n, dem, layer=layer)
+                i = self._index[self._key(layer, n)]
+                changed += 1
+            elif self._demand[i] != dem or not self._node_active[i]:
+                self._demand[i] = dem
+                self._node_active[i] = True
+                changed += 1
+            seen_n.add(i)
+        for u, v, d in G.edges(data=True):
+            iu = self._index.get(self._key(layer, u))
+            iv = self._index.get(self._key(layer, v))
+            cap = d.get("capacity")
+            cap = None if cap is None else int(_num(cap))
+            w = _num(d.get("weight", 0) or 0)
+            e = self._edge_index.get((iu, iv))
+            if e is None:
+                self.add_edge(u, v, cap, w, layer=layer)
+                e = self._edge_index[(self._index[self._key(layer, u)],
+                                      self._index[self._key(layer, v)])]
+                changed += 1
+            elif self._cap[e] != cap or self._weight[e] != w or not self._edge_active[e]:
+                self._cap[e] = cap
+                self._weight[e] = w
+                self._edge_active[e] = True
+                changed += 1
+            seen_e.add(e)
+        for i, lay in enumerate(self._node_layer):
+            if lay == layer and self._node_active[i] and i not in seen_n:
+                self._node_active[i] = False
+                self._demand[i] = 0
+                changed += 1
+        for e, iu in enumerate(self._tail):
+            if self._node_layer[iu] == layer and self._edge_active[e] and e not in seen_e:
+                self._edge_active[e] = False
+                changed += 1
+        self.changed = changed
+        return changed
+
+    def set_capacity(self, u, v, capacity: Optional[int], *, layer=None) -> None:
+        e = self._edge_of(u, v, layer)
+        self._cap[e] = None if capacity is None else int(_num(capacity))
+
+    def set_weight(self, u, v, weight, *, layer=None) -> None:
+        self._weight[self._edge_of(u, v, layer)] = _num(weight)
+
+    def set_demand(self, name, demand: int, *, layer=None) -> None:
+        self._demand[self._index[self._key(layer, name)]] = int(_num(demand))
+
+    def _edge_of(self, u, v, layer) -> int:
+        return self._edge_index[(self._index[self._key(layer, u)], self._index[self._key(layer, v)])]
+
+    # ------------------------------------------------------------------
+    # 列の参照
+    # ------------------------------------------------------------------
+    @property
+    def n_nodes(self) -> int:
+        return len(self._keys)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self._tail)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """tail / head / capacity（UNLIMITED=-1）/ weight / demand / active の列"""
+        w = np.asarray(self._weight)
+        return {
+            "tail": np.asarray(self._tail, dtype=np.int32),
+            "head": np.asarray(self._head, dtype=np.int32),
+            "capacity": np.asarray([UNLIMITED if c is None else c for c in self._cap], dtype=np.int64),
+            "weight": w if w.dtype.kind == "f" else w.astype(np.int64),
+            "demand": np.asarray(self._demand, dtype=np.int64),
+            "edge_active": np.asarray(self._edge_active, dtype=bool),
+        }
+
+    def _adjacency(self):
+        # 残余グラフの弧: 2e = 順方向（tail→head）, 2e+1 = 逆方向（head→tail）。起点ノードで並べた CSR
+        if self._csr is None:
+            n, m = len(self._keys), len(self._tail)
+            origin = np.empty(2 * m, dtype=np.int64)
+            origin[0::2] = self._tail
+            origin[1::2] = self._head
+            arcs = np.argsort(origin, kind="stable")
+            start = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(origin, minlength=n), out=start[1:])
+            self._csr = (start.tolist(), arcs.tolist())
+        return self._csr
+
+    # ------------------------------------------------------------------
+    # 求解
+    # ------------------------------------------------------------------
+    def _warm_flow(self, warm_start) -> List[int]:
+        m = len(self._tail)
+        if warm_start is None or warm_start is False:
+            return [0] * m
+        if warm_start is True:
+            if self.flow is None:
+                return [0] * m
+            f = self.flow.tolist() + [0] * (m - len(self.flow))
+            return f[:m]
+        f = [0] * m
+        idx, ei = self._index, self._edge_index
+        for u, row in warm_start.items():
+            iu = idx.get(u)
+            if iu is None:
+                continue
+            for v, x in row.items():
+                e = ei.get((iu, idx.get(v)))
+                if e is not None and x:
+                    f[e] = int(x)
+        return f
+
+    def solve(self, warm_start=None) -> Tuple[Any, Dict[Hashable, Dict[Hashable, int]]]:
+        """
+        最小費用流を解いて (flowCost, flowDict) を返す。
+        warm_start: None（ゼロから）/ True（直前の解）/ flowDict（例: 前回の flowDict_opt）
+        初期フローは新しい容量で切り詰めてから使うので、網が変わっていても結果は常に最適解。
+        """
+        n, m = len(self._keys), len(self._tail)
+        demand = [d if a else 0 for d, a in zip(self._demand, self._node_active)]
+        if sum(demand) != 0:
+            raise FlowInfeasible("total node demand is not zero")
+        for e, (c, a) in enumerate(zip(self._cap, self._edge_active)):
+            if a and c is not None and c < 0:
+                u, v = self._keys[self._tail[e]], self._keys[self._head[e]]
+                raise FlowInfeasible(f"edge {(u, v)!r} has negative capacity")
+        start, arcs = self._adjacency()
+
+        # 無制限容量は「全供給 + 有限容量の合計」を上限にする（それを超えるフローは最適解に現れない）
+        finite = sum(c for c, a in zip(self._cap, self._edge_active) if a and c is not None)
+        big = sum(d for d in demand if d > 0) + finite + 1
+        cap = [(big if c is None else c) if a else 0
+               for c, a in zip(self._cap, self._edge_active)]
+        f = self._warm_flow(warm_start)
+        res = [0] * (2 * m)
+        cost = [0] * (2 * m)
+        excess = [-d for d in demand]          # 正 = まだ送り出す量
+        for e in range(m):
+            x = min(max(f[e], 0), cap[e])
+            res[2 * e] = cap[e] - x
+            res[2 * e + 1] = x
+            w = self._weight[e]
+            cost[2 * e] = w
+            cost[2 * e + 1] = -w
+            if x:
+                excess[self._tail[e]] -= x
+                excess[self._head[e]] += x
+        head = [0] * (2 * m)
+        head[0::2] = self._head
+        head[1::2] = self._tail
+
+        try:
+            pi = self._potentials(n, start, arcs, head, res, cost, big)
+        except FlowUnbounded:
+            # nx と同じく「需要を満たせない」を優先して報告する（費用 0 で実行可能性だけ確かめる）
+            self._augment(n, start, arcs, head, list(res), [0] * (2 * m), list(excess), [0] * n)
+            raise
+        self._augment(n, start, arcs, head, res, cost, excess, pi)
+
+        flow = np.asarray(res[1::2], dtype=np.int64)
+        self.flow = flow
+        fl = flow.tolist()
+        total = sum(x * w for x, w in zip(fl, self._weight) if x)
+        self.flow_cost = total
+        # layer 付きの網は (layer, name) キーのまま全体を返す（部分網ごとは flow_dict(layer)）
+        layered = any(lay is not None for lay in self._node_layer)
+        return total, self.flow_dict(all_layers=layered)
+
+    def _potentials(self, n, start, arcs, head, res, cost, big) -> List[Any]:
+        """残余グラフの負閉路を打ち消し、全弧の被約費用が非負になるポテンシャルを返す"""
+        if all(c >= 0 for a, c in enumerate(cost) if res[a] > 0):
+            return [0] * n
+        while True:
+            # 仮想始点（全ノード距離 0）からの SPFA。経路長が n に達したら負閉路
+            dist = [0] * n
+            par = [-1] * n
+            length = [0] * n
+            inq = [True] * n
+            q = deque(range(n))
+            hit = -1
+            while q and hit < 0:
+                u = q.popleft()
+                inq[u] = False
+                du = dist[u]
+                for k in range(start[u], start[u + 1]):
+                    a = arcs[k]
+                    if res[a] <= 0:
+                        continue
+                    v = head[a]
+                    nd = du + cost[a]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        par[v] = a
+                        length[v] = length[u] + 1
+                        if length[v] >= n:
+                            hit = v
+                            break
+                        if not inq[v]:
+                            inq[v] = True
+                            q.append(v)
+            if hit < 0:
+                return dist
+            # 親をたどって閉路上のノードに入り、閉路の弧を集めて打ち消す
+            v = hit
+            for _ in range(n):
+                v = head[par[v] ^ 1]
+            cyc, x = [], v
+            while True:
+                a = par[x]
+                cyc.append(a)
+                x = head[a ^ 1]
+                if x == v:
+                    break
+            delta = min(res[a] for a in cyc)
+            if all(a % 2 == 0 and res[a] + res[a ^ 1] >= big for a in cyc):
+                raise FlowUnbounded("negative cycle with infinite capacity found")
+            for a in cyc:
+                res[a] -= delta
+                res[a ^ 1] += delta
+
+    def _augment(self, n, start, arcs, head, res, cost, excess, pi) -> None:
+        """超過ノード群から不足ノードへ、被約費用の最短路（Dijkstra）で流し込む"""
+        push = heapq.heappush
+        pop = heapq.heappop
+        while True:
+            src = [v for v in range(n) if excess[v] > 0]
+            if not src:
+                return
+            dist: Dict[int, Any] = {}
+            par: Dict[int, int] = {}
+            best = {v: 0 for v in src}
+            heap = [(0, v) for v in src]
+            heapq.heapify(heap)
+            t = -1
+            while heap:
+                d, u = pop(heap)
+                if u in dist:
+                    continue
+                dist[u] = d
+                if excess[u] < 0:
+                    t = u
+                    break
+                pu = pi[u]
+                for k in range(start[u], start[u + 1]):
+                    a = arcs[k]
+                    if res[a] <= 0:
+                        continue
+                    v = head[a]
+                    if v in dist:
+                        continue
+                    nd = d + cost[a] + pu - pi[v]
+                    if v not in best or nd < best[v]:
+                        best[v] = nd
+                        par[v] = a
+                        push(heap, (nd, v))
+            if t < 0:
+                raise FlowInfeasible("no flow satisfies all node demands")
+            dt = dist[t]
+            for v, d in dist.items():
+                pi[v] += d - dt
+            for v in range(n):
+                pi[v] += dt
+            # 経路を復元して流せるだけ流す（始点は距離 0 で確定するので par を持たない）
+            path, x = [], t
+            while x in par:
+                a = par[x]
+                path.append(a)
+                x = head[a ^ 1]
+            delta = min(excess[x], -excess[t])
+            for a in path:
+                if res[a] < delta:
+                    delta = res[a]
+            for a in path:
+                res[a] -= delta
+                res[a ^ 1] += delta
+            excess[x] -= delta
+            excess[t] += delta
+
+    # ------------------------------------------------------------------
+    # 結果
+    # ------------------------------------------------------------------
+    def flow_dict(self, layer=None, *, all_layers: bool = False) -> Dict[Hashable, Dict[Hashable, int]]:
+        """
+        {u: {v: flow}}（nx.network_simplex と同じ形）。
+        layer を指定するとその部分網だけを name キーで返す。all_layers=True ならキーそのまま全体。
+        """
+        fl = self.flow.tolist() if self.flow is not None else [0] * len(self._tail)
+        out: Dict[Hashable, Dict[Hashable, int]] = {}
+        use = (lambda i: self._keys[i]) if all_layers else (lambda i: self._node_name[i])
+        for i, act in enumerate(self._node_active):
+            if act and (all_layers or self._node_layer[i] == layer):
+                out[use(i)] = {}
+        for e, act in enumerate(self._edge_active):
+            if not act:
+                continue
+            iu = self._tail[e]
+            if not all_layers and self._node_layer[iu] != layer:
+                continue
+            out.setdefault(use(iu), {})[use(self._head[e])] = fl[e]
+        return out
+
+
+def resolve_graph(G, net: Optional[FlowNetwork] = None, *, layer=None,
+                  warm_start=True) -> Tuple[FlowNetwork, Any, Dict[Hashable, Dict[Hashable, int]]]:
+    """
+    同じ網を繰り返し解く呼び出し側（GUI の run_optimization など）向け。
+    net が None なら nx.network_simplex で解き、その解を初期フローとして持つ FlowNetwork を作る。
+    net があれば G の現在値で update_from_graph し、warm_start（既定: 直前の解）から解き直す。
+    戻り値: (net, flowCost, flowDict)
+    """
+    if net is None:
+        import networkx as nx
+        cost, flow = nx.network_simplex(G)
+        net = FlowNetwork.from_graph(G, layer=layer)
+        net.flow = np.asarray(net._warm_flow(flow), dtype=np.int64)
+        net.flow_cost = cost
+        return net, cost, flow
+    net.update_from_graph(G, layer=layer)
+    cost, flow = net.solve(warm_start=warm_start)
+    return net, cost, flow
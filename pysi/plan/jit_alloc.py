@@ -0,0 +1,159 @@
+# pysi/plan/jit_alloc.py
+# JIT 割当エンジン：demand S(wd) の lot を supply P(ws) へ「最短誤差 |ws - wd|」で置く
+#
+# - 制約なし      : ws = wd（閉形式）。週ごとに extend 1 回の一括転写
+# - 休暇カレンダ  : 稼働週への最近傍写像を O(weeks) で前計算（同距離は前倒し＝早納を優先）
+# - 週次キャパ    : 前方/後方の「空き週ポインタ」（union-find 風の経路圧縮）で最近傍の空き週へ
+# いずれも O(lots + weeks)。結果は週ごとに lot をまとめてから P へ extend する。
+
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+PSI_S, PSI_P = 0, 3
+
+Capacity = Union[int, Sequence[int], None]
+
+
+def nearest_active_weeks(weeks: int, vacation_weeks: Iterable[int] = ()) -> List[int]:
+    """
+    各週 w → 最寄りの稼働週（休暇でない週）。同距離なら前の週。稼働週が無ければ -1。
+    前方/後方の 2 スイープで O(weeks)。
+    """
+    lv = {int(x) for x in (vacation_weeks or ()) if 0 <= int(x) < weeks}
+    prev = [-1] * weeks
+    last = -1
+    for w in range(weeks):
+        if w not in lv:
+            last = w
+        prev[w] = last
+    out = [-1] * weeks
+    nxt = -1
+    for w in range(weeks - 1, -1, -1):
+        if w not in lv:
+            nxt = w
+        p = prev[w]
+        if p < 0:
+            out[w] = nxt
+        elif nxt < 0 or (w - p) <= (nxt - w):
+            out[w] = p
+        else:
+            out[w] = nxt
+    return out
+
+
+def _capacity_list(capacity: Capacity, weeks: int, vacation_weeks: Iterable[int]) -> List[int]:
+    if isinstance(capacity, (int, float)):
+        cap = [max(0, int(capacity))] * weeks
+    else:
+        cap = [max(0, int(c)) for c in list(capacity)[:weeks]]
+        cap += [0] * (weeks - len(cap))
+    for v in vacation_weeks or ():
+        v = int(v)
+        if 0 <= v < weeks:
+            cap[v] = 0
+    return cap
+
+
+class _FreeWeeks:
+    """残キャパのある週を前後方向に探す（満杯週は隣へ張り替えて経路圧縮）"""
+
+    def __init__(self, cap: List[int]) -> None:
+        n = len(cap)
+        self.cap = cap
+        self.bw = [w if cap[w] > 0 else w - 1 for w in range(n)]
+        self.fw = [w if cap[w] > 0 else w + 1 for w in range(n)]
+        self.n = n
+
+    def _find(self, ptr: List[int], w: int) -> int:
+        root = w
+        while 0 <= root < self.n and ptr[root] != root:
+            root = ptr[root]
+        while 0 <= w < self.n and ptr[w] != root:
+            ptr[w], w = root, ptr[w]
+        return root
+
+    def nearest(self, w: int) -> int:
+        p = self._find(self.bw, w)
+        q = self._find(self.fw, w)
+        has_p = p >= 0
+        has_q = q < self.n
+        if has_p and (not has_q or (w - p) <= (q - w)):
+            return p
+        return q if has_q else -1
+
+    def take(self, w: int) -> None:
+        self.cap[w] -= 1
+        if self.cap[w] <= 0:
+            self.bw[w] = w - 1
+            self.fw[w] = w + 1
+
+
+def jit_assign_psi(psi_demand, psi_supply, weeks: int, *,
+                   vacation_weeks: Optional[Iterable[int]] = None,
+                   capacity: Capacity = None) -> Dict[str, int]:
+    """
+    psi_demand[wd][S] の lot を psi_supply[ws][P] に追加する（既存の P は残す）。
+    戻り値: {"placed": 配置数, "unplaced": キャパ不足で置けなかった数}
+    """
+    W = min(int(weeks), len(psi_demand), len(psi_supply))
+    if W <= 0:
+        return {"placed": 0, "unplaced": 0}
+    lv = list(vacation_weeks or ())
+
+    # 1) 制約なし：閉形式 ws = wd（週ごとに一括 extend）
+    if capacity is None and not lv:
+        placed = 0
+        for w in range(W):
+            lots = psi_demand[w][PSI_S]
+            if lots:
+                psi_supply[w][PSI_P].extend(lots)
+                placed += len(lots)
+        return {"placed": placed, "unplaced": 0}
+
+    # 2) 休暇のみ：最近傍稼働週の写像で一括転写
+    if capacity is None:
+        target = nearest_active_weeks(W, lv)
+        staged: Dict[int, List[str]] = {}
+        placed = unplaced = 0
+        for wd in range(W):
+            lots = psi_demand[wd][PSI_S]
+            if not lots:
+                continue
+            ws = target[wd]
+            if ws < 0:
+                unplaced += len(lots)
+                continue
+            staged.setdefault(ws, []).extend(lots)
+            placed += len(lots)
+        for ws in sorted(staged):
+            psi_supply[ws][PSI_P].extend(staged[ws])
+        return {"placed": placed, "unplaced": unplaced}
+
+    # 3) 週次キャパあり：需要週の昇順に、最寄りの空き週へ 1 lot ずつ
+    free = _FreeWeeks(_capacity_list(capacity, W, lv))
+    staged = {}
+    placed = unplaced = 0
+    for wd in range(W):
+        lots = psi_demand[wd][PSI_S]
+        if not lots:
+            continue
+        for lot_id in lots:
+            ws = free.nearest(wd)
+            if ws < 0:
+                unplaced += 1
+                continue
+            free.take(ws)
+            staged.setdefault(ws, []).append(lot_id)
+            placed += 1
+    for ws in sorted(staged):
+        psi_supply[ws][PSI_P].extend(staged[ws])
+    return {"placed": placed, "unplaced": unplaced}
+
+
+def jit_assign_node(node, weeks: int, capacity: Capacity = None) -> Dict[str, int]:
+    """Node 1 つ分：long_vacation_weeks を休暇カレンダとして使う"""
+    return jit_assign_psi(
+        node.psi4demand, node.psi4supply, weeks,
+        vacation_weeks=getattr(node, "long_vacation_weeks", None) or None,
+        capacity=capacity,
+    )
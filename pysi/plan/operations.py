@@ -7,6 +7,8 @@ from typing import Iterable, List, Optional
 # --- ADD: ISO week → internal index helpers -------------------------------
 from datetime import date
 import ast
+from pysi.core.shift_map import compile_shift_map, apply_shift_map
+from pysi.core.lot_registry import count_lots_by_year_of
 
 def _build_iso_week_index_map(plan_year_st: int, plan_range: int) -> tuple[dict[tuple[int,str], int], int]:
     """
@@ -110,18 +112,16 @@ def get_set_childrenP2S2psi_STOP(node, plan_range):
 # *******************
 # 生産平準化の前処理　ロット・カウント
 # *******************
+def count_lots_by_year(psi_list, years) -> list:
+    """
+    週別 lot リストの並び（psi_list）に含まれる lot 数を年別に数える。
+    年は lot_ID 末尾 YYYYWWNNNN の ISO 年で判定し、全 lot を 1 回だけ見る（lot は登録しない）。
+    """
+    by_year = count_lots_by_year_of(lot for row in psi_list for lot in row)
+    return [by_year.get(int(y), 0) for y in years]
 def count_lots_yyyy(psi_list, yyyy_str):
-    matrix = psi_list
-    # 共通の文字列をカウントするための変数を初期化
-    count_common_string = 0
-    # Step 1: マトリクス内の各要素の文字列をループで調べる
-    for row in matrix:
-        for element in row:
-            # Step 2: 各要素内の文字列が "2023" を含むかどうかを判定
-            if yyyy_str in element:
-                # Step 3: 含む場合はカウンターを増やす
-                count_common_string += 1
-    return count_common_string
+    # 旧: 全 lot への `yyyy_str in element` 部分一致 → 台帳の年列で数える
+    return count_lots_by_year(psi_list, [yyyy_str])[0]
 # sliced df をcopyに変更
 def make_lot_id_list_list(df_weekly, node_name):
     # 指定されたnode_nameがdf_weeklyに存在するか確認
@@ -201,40 +201,27 @@ def set_df_Slots2psi4demand(node, df_weekly):
     # print("psi4supply", node.name, node.psi4supply)
 # 同一node内のS2Pの処理
 def shiftS2P_LV(psiS, shift_week, lv_week):  # LV:long vacations
-    # ss = safety_stock_week
-    sw = shift_week
+    # backward planningで需要を降順でシフト
+    # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする（シフト先は表で一括計算）
     plan_len = len(psiS) - 1  # -1 for week list position
-    for w in range(plan_len, sw, -1):  # backward planningで需要を降順でシフト
-        # my_list = [1, 2, 3, 4, 5]
-        # for i in range(2, len(my_list)):
-        #    my_list[i] = my_list[i-1] + my_list[i-2]
-        # 0:S
-        # 1:CO
-        # 2:I
-        # 3:P
-        eta_plan = w - sw  # sw:shift week (includung safty stock)
-        eta_shift = check_lv_week_bw(lv_week, eta_plan)  # ETA:Estimate Time Arrival
-        # リスト追加 extend
-        # 安全在庫とカレンダ制約を考慮した着荷予定週Pに、w週Sからoffsetする
-        psiS[eta_shift][3].extend(psiS[w][0])  # P made by shifting S with
+    smap = compile_shift_map(len(psiS), shift_week, lv_week, "bw")  # ETA:Estimate Time Arrival
+    apply_shift_map(psiS, psiS, smap, range(plan_len, shift_week, -1), 0, 3)  # P made by shifting S
     return psiS
 # ************************************
 # checking constraint to inactive week , that is "Long Vacation"
 # ************************************
 def check_lv_week_bw(const_lst, check_week):
     num = check_week
-    if const_lst == []:
-        pass
-    else:
-        while num in const_lst:
+    if const_lst:
+        lv = set(const_lst)
+        while num in lv:
             num -= 1
     return num
 def check_lv_week_fw(const_lst, check_week):
     num = check_week
-    if const_lst == []:
-        pass
-    else:
-        while num in const_lst:
+    if const_lst:
+        lv = set(const_lst)
+        while num in lv:
             num += 1
     return num
 # ************************************************
@@ -273,7 +260,7 @@ def _postorder_nodes(root):
     dfs(root)
     return out
 # === pysi/plan/operations.py に追記 ======================================
-from typing import List, Set
+from typing import Dict, List, Set
 BUCKET = {"S":0, "CO":1, "I":2, "P":3}
 def _iter_postorder(root):
     stack = [(root, False)]
@@ -547,7 +534,7 @@ def aggregate_children_P_into_parent_S(
     - LT < 0 is treated as 0.
     """
     psi_p = _psi(parent, layer)
-    if not isinstance(psi_p, list):
+    if psi_p is None:
         return
     W = len(psi_p)
     new_S: List[List[str]] = [[] for _ in range(W)]
@@ -556,7 +543,7 @@ def aggregate_children_P_into_parent_S(
     children = getattr(parent, "children", []) or []
     for child in children:
         psi_c = _psi(child, layer)
-        if not isinstance(psi_c, list):
+        if psi_c is None:
             continue
         Wc = min(W, len(psi_c))
         LT = max(0, int(getattr(child, lt_attr, 0) or 0))
@@ -646,3 +633,135 @@ def propagate_postorder_with_calcP2S(
                 verbose=verbose,
             )
             _calc_S2P(n)
+    # 全体を計画し直したので dirty は全て解消
+    _clear_dirty(root)
+# ----------------------------
+# incremental: dirty ancestor paths only
+# ----------------------------
+#使い方（GUI で 1 葉の需要や LT を変えたとき）
+#
+#leaf.psi4demand[w][0] = [...]         # S を直接編集したら
+#leaf.mark_psi_dirty()                 # ← 明示的に dirty を立てる
+#leaf.set_plan_params(leadtime=3)      # leadtime / SS_days / long_vacation_weeks はここ経由で dirty
+#                                      # （set_S2psi も dirty を立てる）
+#
+#res = propagate_dirty_with_calcP2S(root)
+#res["changed"]  # {node_name: [week, ...]}  GUI 再描画 / DB 書戻しはここだけ
+#
+#mismatch = check_dirty_propagation_equivalence(root)   # 全体計画と同じ結果か確認（木は変更しない）
+def _clear_dirty(root):
+    for n in _iter_postorder(root):
+        n._psi_dirty = False
+def _snapshot_SP(node, layer: str):
+    psi = _psi(node, layer)
+    sup = getattr(node, "psi4supply", None) if layer == "demand" else None
+    if psi is None:
+        return []
+    return [
+        (tuple(psi[w][BUCKET["S"]]), tuple(psi[w][BUCKET["P"]]),
+         tuple(sup[w][BUCKET["S"]]) if sup is not None and w < len(sup) else ())
+        for w in range(len(psi))
+    ]
+def dirty_paths(root) -> List:
+    """
+    dirty な node とその祖先（root まで）を、子→親の順（深い順）で返す。
+    木全体は 1 回だけ走査し、祖先はたどった時点で打ち切る。
+    """
+    depth = {}
+    order: List = []
+    seen: Set[int] = set()
+    for n in _iter_postorder(root):
+        if not getattr(n, "_psi_dirty", False):
+            continue
+        p = n
+        while p is not None and id(p) not in seen:
+            seen.add(id(p))
+            order.append(p)
+            if p is root:
+                break
+            p = getattr(p, "parent", None)
+    for n in order:
+        d, p = 0, n
+        while p is not None and p is not root:
+            d += 1
+            p = getattr(p, "parent", None)
+        depth[id(n)] = d
+    order.sort(key=lambda n: -depth[id(n)])
+    return order
+def _reset_S2P_outputs(node, layer: str = "demand"):
+    """
+    S->P の出力を空にする（layer の P、demand 面なら supply の S / P も）。
+    calcS2P / copy_demand_to_supply は追記型なので、再計算の前に呼ばないと前回の lot に積み増される。
+    """
+    psi = _psi(node, layer)
+    if psi is not None:
+        for cell in psi:
+            cell[BUCKET["P"]] = []
+    sup = getattr(node, "psi4supply", None) if layer == "demand" else None
+    if sup is not None:
+        for cell in sup:
+            cell[BUCKET["S"]] = []
+            cell[BUCKET["P"]] = []
+def propagate_dirty_with_calcP2S(
+    root,
+    *,
+    layer: str = "demand",
+    lt_attr: str = "leadtime",
+    vacation_policy: str = "shift_to_next_open",
+    dedup: bool = True,
+):
+    """
+    dirty な node の祖先パスだけを post-order で再計画する。
+      - 葉      : P / supply S・P を空にしてから S->P
+      - 内部node: 子P -> 親S（replace=True で冪等）-> P / supply S・P を空にしてから S->P
+    子の leadtime 変更は親Sの位置を変えるため、dirty node 自身から root まで全て再計算する。
+    パス外の node は前回の結果をそのまま使う（木が一度きれいに計画済みである前提）。
+    戻り値: {"nodes": [再計算した node 名], "changed": {node名: [変化した週]}}
+    """
+    path = dirty_paths(root)
+    before = {id(n): _snapshot_SP(n, layer) for n in path}
+    for n in path:
+        if getattr(n, "children", []):
+            aggregate_children_P_into_parent_S(
+                n,
+                layer=layer,
+                lt_attr=lt_attr,
+                vacation_policy=vacation_policy,
+                replace_parent_S=True,
+                dedup=dedup,
+            )
+        _reset_S2P_outputs(n, layer)
+        _calc_S2P(n)
+        n._psi_dirty = False
+    changed = {}
+    for n in path:
+        old, new = before[id(n)], _snapshot_SP(n, layer)
+        weeks = [w for w in range(max(len(old), len(new)))
+                 if w >= len(old) or w >= len(new) or old[w] != new[w]]
+        if weeks:
+            changed[n.name] = weeks
+    return {"nodes": [n.name for n in path], "changed": changed}
+def check_dirty_propagation_equivalence(root, *, layer: str = "demand", **kw) -> Dict[str, List[int]]:
+    """
+    差分再計画の結果が「ゼロから計画し直した結果」と一致するかを、木のコピー 2 つで確かめる
+    （root 自体は変更しない）。
+      - 基準: 全 node の P / supply S・P を空にしてから propagate_postorder_with_calcP2S
+      - 対象: propagate_dirty_with_calcP2S
+    全 node の S / P / supply S を比べる。戻り値: {node名: [不一致の週]}（空なら一致）
+    """
+    import copy
+    fresh, inc = copy.deepcopy(root), copy.deepcopy(root)
+    for n in _iter_postorder(fresh):
+        _reset_S2P_outputs(n, layer)
+    propagate_postorder_with_calcP2S(fresh, layer=layer, replace_parent_S=True, **kw)
+    propagate_dirty_with_calcP2S(inc, layer=layer, **kw)
+    inc_by_name = {n.name: n for n in _iter_postorder(inc)}
+    mismatch = {}
+    for n in _iter_postorder(fresh):
+        a = _snapshot_SP(n, layer)
+        b = _snapshot_SP(inc_by_name[n.name], layer)
+        weeks = [w for w in range(max(len(a), len(b)))
+                 if w >= len(a) or w >= len(b) or a[w] != b[w]]
+        if weeks:
+            mismatch[n.name] = weeks
+    return mismatch
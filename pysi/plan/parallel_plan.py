@@ -0,0 +1,262 @@
+# pysi/plan/parallel_plan.py
+# 製品ごとの OUT/IN ツリーを ProcessPoolExecutor で並列に計画する
+#
+# - 製品ツリーは互いに独立（prod_tree_dict_OT / prod_tree_dict_IN）なので製品単位で分配
+# - SQL 版: 各 worker が自分の SQLite 接続を持ち、製品ツリーを DB から復元して計画
+# - メモリ版: PlanEnv などで構築済みのツリーを pickle して worker に渡す
+# - 結果は「コンパクト PSI」（製品内で intern した lot_ID 表 + int32 の CSR 配列）で返す
+# - 返り値は製品名の昇順で並べ直すので、worker 数や完了順に依存しない
+# - decouple_nodes は全製品共通の名前リストか {product: 名前リスト}。
+#   PlanEnv と同じ "DAD" 段（nodes_decouple_all[-3]）は dad_decouple_nodes() で作る
+#
+#使い方
+#
+#from pysi.plan.parallel_plan import plan_products_parallel, apply_packed_psi
+#packed = plan_products_parallel("var/psi.sqlite", mode="demand", max_workers=4)
+#for prod, pk in packed.items():
+#    apply_packed_psi(env.prod_tree_dict_OT[prod], pk["OUT"])
+#plan_forest_parallel(env.prod_tree_dict_OT, env.prod_tree_dict_IN, mode="supply",
+#                     decouple_nodes=dad_decouple_nodes(env.prod_tree_dict_OT))
+
+from __future__ import annotations
+import copy
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from pysi.core.psi_store import LotInterner, PSIStore
+
+MODES = ("demand", "supply")
+LAYERS = ("psi4demand", "psi4supply")
+
+# worker プロセス内でだけ使う接続（initializer で開く）
+_WORKER_CON: Optional[sqlite3.Connection] = None
+
+
+# ---- コンパクト PSI ---------------------------------------------------------
+def _walk(root):
+    st = [root]; seen = set()
+    while st:
+        n = st.pop()
+        if n is None or id(n) in seen:
+            continue
+        seen.add(id(n)); yield n
+        st.extend(getattr(n, "children", []) or [])
+
+
+def pack_tree_psi(root) -> Optional[Dict[str, Any]]:
+    """
+    ツリー全ノードの psi4demand / psi4supply を 1 つの lot_ID 表と CSR 配列に詰める。
+    {"lot_ids": [...], "nodes": {name: {layer: (handles, offsets)}}}
+    """
+    if root is None:
+        return None
+    interner = LotInterner()
+    nodes: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+    for n in sorted(_walk(root), key=lambda x: x.name):
+        layers = {}
+        for attr in LAYERS:
+            psi = getattr(n, attr, None)
+            if psi is None:
+                continue
+            st = PSIStore.from_nested(psi, interner=interner)
+            layers[attr] = (st._handles, st._offsets)
+        nodes[n.name] = layers
+    return {"lot_ids": interner.ids_of(range(len(interner))), "nodes": nodes}
+
+
+def unpack_psi(packed: Dict[str, Any]) -> Dict[str, Dict[str, List[List[List[str]]]]]:
+    """pack_tree_psi の逆変換: {node: {layer: psi(list[week][bucket])}}"""
+    ids = packed["lot_ids"]
+    out: Dict[str, Dict[str, List[List[List[str]]]]] = {}
+    for name, layers in packed["nodes"].items():
+        out[name] = {}
+        for attr, (handles, offsets) in layers.items():
+            weeks = (len(offsets) - 1) // 4
+            h = handles.tolist(); o = offsets.tolist()
+            out[name][attr] = [
+                [[ids[x] for x in h[o[w * 4 + b]:o[w * 4 + b + 1]]] for b in range(4)]
+                for w in range(weeks)
+            ]
+    return out
+
+
+def apply_packed_psi(root, packed: Optional[Dict[str, Any]]) -> None:
+    """worker の計画結果を親プロセス側のツリーへ書き戻す（名前で突き合わせ）"""
+    if root is None or not packed:
+        return
+    psi_by_node = unpack_psi(packed)
+    for n in _walk(root):
+        layers = psi_by_node.get(n.name)
+        if not layers:
+            continue
+        for attr, psi in layers.items():
+            setattr(n, attr, psi)
+
+
+# ---- decouple 点 ------------------------------------------------------------
+def dad_decouple_nodes(prod_tree_dict_OT: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    PlanEnv.supply_planning4multi_product と同じ decouple 点を製品ごとに返す。
+    nodes_decouple_all[-3]（"DAD" 段）。段数が足りない製品は入れない（push_pull の既定に任せる）。
+    """
+    from pysi.plan.engines import make_nodes_decouple_all
+    out: Dict[str, List[str]] = {}
+    for p, root in sorted(prod_tree_dict_OT.items()):
+        if root is None:
+            continue
+        nodes_decouple_all = make_nodes_decouple_all(root)
+        if len(nodes_decouple_all) >= 3:
+            out[p] = nodes_decouple_all[-3]
+    return out
+
+
+def _decouple_for(decouple_nodes, product: str):
+    """{product: names} なら製品分を取り出す（無ければ None = push_pull の既定）"""
+    if isinstance(decouple_nodes, dict):
+        return decouple_nodes.get(product)
+    return decouple_nodes
+
+
+# ---- 計画本体（worker 内で実行） ----------------------------------------------
+def _plan_roots(out_root, in_root, mode: str, decouple_nodes=None):
+    """decouple_nodes はこの製品の名前リスト（dict は呼び出し側で _decouple_for 済み）"""
+    from pysi.network.tree import calc_all_psi2i4demand
+    from pysi.plan.engines import push_pull
+
+    if isinstance(decouple_nodes, dict):
+        # 製品名をノード名と取り違えて push_pull に渡さない
+        raise TypeError("_plan_roots expects one product's decouple node names, not a dict")
+    if mode == "demand":
+        if out_root is not None:
+            calc_all_psi2i4demand(out_root)
+    elif mode == "supply":
+        if out_root is not None:
+            push_pull(out_root, in_root, decouple_nodes=decouple_nodes)
+    else:
+        raise ValueError(f"unknown mode={mode}")
+    return out_root, in_root
+
+
+def _init_sql_worker(db_path: str) -> None:
+    global _WORKER_CON
+    from pysi.io.sql_planenv import _connect
+    _WORKER_CON = _connect(db_path)
+
+
+def _plan_sql_product(product: str, mode: str, decouple_nodes=None) -> Tuple[str, Dict[str, Any]]:
+    from pysi.io.sql_planenv import (
+        _build_product_tree_from_edges, _load_calendar_meta, _safe_attach_all,
+    )
+    con = _WORKER_CON
+    W, _ = _load_calendar_meta(con)
+    roots = {}
+    for bound in ("OUT", "IN"):
+        r = _build_product_tree_from_edges(con, product, bound)
+        if r is not None:
+            _safe_attach_all(con, r, product, W)
+        roots[bound] = r
+    _plan_roots(roots["OUT"], roots["IN"], mode, _decouple_for(decouple_nodes, product))
+    return product, {b: pack_tree_psi(r) for b, r in roots.items()}
+
+
+def _plan_mem_product(product: str, out_root, in_root, mode: str,
+                      decouple_nodes=None) -> Tuple[str, Dict[str, Any]]:
+    _plan_roots(out_root, in_root, mode, _decouple_for(decouple_nodes, product))
+    return product, {"OUT": pack_tree_psi(out_root), "IN": pack_tree_psi(in_root)}
+
+
+# ---- 入口 ------------------------------------------------------------------
+def _sorted_result(pairs: Iterable[Tuple[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    return {p: r for p, r in sorted(pairs, key=lambda x: x[0])}
+
+
+def edge_products(db_path: str) -> List[str]:
+    """product_edge にある製品名（テーブルが無ければ空リスト）"""
+    from pysi.io.sql_planenv import _connect, _list_products_from_edges
+    with _connect(db_path) as con:
+        try:
+            return _list_products_from_edges(con)
+        except sqlite3.OperationalError:
+            return []
+
+
+def plan_products_parallel(db_path: str, products: Optional[List[str]] = None, *,
+                           mode: str = "demand", max_workers: Optional[int] = None,
+                           decouple_nodes=None) -> Dict[str, Dict[str, Any]]:
+    """
+    SQLite の product_edge から製品ツリーを復元し、製品単位で並列に計画する。
+    返り値: {product: {"OUT": packed, "IN": packed}}（製品名昇順）
+    max_workers=1 のときはプロセスを起こさず同じ処理を逐次実行する。
+    decouple_nodes は全製品共通の名前リスト、または {product: 名前リスト}。
+    product_edge が無い/空、または指定製品の辺が無いときは ValueError。
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown mode={mode}")
+    available = edge_products(db_path)
+    if not available:
+        # product_edge が無い/空の DB では worker がツリーを復元できない（黙って空を返さない）
+        raise ValueError(
+            f"{db_path}: product_edge is missing or empty; "
+            "build trees in memory and use plan_forest_parallel() instead"
+        )
+    if products is None:
+        products = available
+    missing = sorted(set(products) - set(available))
+    if missing:
+        raise ValueError(f"{db_path}: no product_edge rows for product(s): {missing}")
+    products = sorted(products)
+    if not products:
+        return {}
+
+    if max_workers == 1:
+        _init_sql_worker(db_path)
+        try:
+            return _sorted_result(_plan_sql_product(p, mode, decouple_nodes) for p in products)
+        finally:
+            _WORKER_CON.close()
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_sql_worker, initargs=(db_path,)) as ex:
+        futs = [ex.submit(_plan_sql_product, p, mode, decouple_nodes) for p in products]
+        return _sorted_result(f.result() for f in futs)
+
+
+def plan_forest_parallel(prod_tree_dict_OT: Dict[str, Any],
+                         prod_tree_dict_IN: Optional[Dict[str, Any]] = None, *,
+                         mode: str = "demand", max_workers: Optional[int] = None,
+                         decouple_nodes=None, apply: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    構築済みのツリー辞書（PlanEnv / SqlPlanEnv）を製品単位で並列計画する。
+    apply=True なら結果を元のツリーへ書き戻す（GUI はそのまま同じ root を参照できる）。
+    decouple_nodes: 全製品共通の名前リスト、または {product: 名前リスト}（dad_decouple_nodes）。
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown mode={mode}")
+    prod_tree_dict_IN = prod_tree_dict_IN or {}
+    products = sorted(p for p, r in prod_tree_dict_OT.items() if r is not None)
+    if not products:
+        return {}
+
+    if max_workers == 1:
+        # 逐次実行はその場でツリーを更新するので、apply=False なら複製を計画する
+        def _roots(p):
+            roots = (prod_tree_dict_OT[p], prod_tree_dict_IN.get(p))
+            return roots if apply else copy.deepcopy(roots)
+        return _sorted_result(
+            _plan_mem_product(p, *_roots(p), mode, decouple_nodes) for p in products
+        )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futs = [ex.submit(_plan_mem_product, p, prod_tree_dict_OT[p],
+                          prod_tree_dict_IN.get(p), mode, decouple_nodes)
+                for p in products]
+        result = _sorted_result(f.result() for f in futs)
+
+    if apply:
+        for p, pk in result.items():
+            apply_packed_psi(prod_tree_dict_OT.get(p), pk.get("OUT"))
+            apply_packed_psi(prod_tree_dict_IN.get(p), pk.get("IN"))
+    return result
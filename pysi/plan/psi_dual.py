@@ -23,6 +23,9 @@
 from __future__ import annotations
 from typing import Dict, List, Any, Tuple, Optional
 
+from pysi.core.psi_state import as_event_queue, remove_lots, take_lots
+from pysi.core.lot_registry import LotRegistry
+
 # PSI バケツの添字（固定）
 PSI_S, PSI_CO, PSI_I, PSI_P = 0, 1, 2, 3
 
@@ -43,7 +46,7 @@ def init_psi_map(nodes: List[str], skus: List[str], weeks: int) -> Dict[Tuple[st
 
 # ---- イベント → P(w) 反映 ----------------------------------------------------
 
-def settle_events_to_P(state: Dict[str, Any], week: int) -> None:
+def settle_events_to_P(state: Dict[str, Any], week: int) -> int:
     """
     state["scheduled"] に溜めた「到着/完成イベント」を当週の P(w) に反映する。
     - demand 層（psi_demand）/ supply 層（psi_supply）両方を対象にできる
@@ -56,24 +59,20 @@ def settle_events_to_P(state: Dict[str, Any], week: int) -> None:
             keys: node, sku, to_week, lots (list[str])
             動作: psi_supply[(node,sku)][week][P] に lots を追加
     ※ キー不足やマップ欠損は無視（落とさずスキップ）
+    ※ state["scheduled"] は to_week 別キュー（旧 list[dict] も自動変換）。当週分だけ触る。
+    戻り値: CO から取り除けなかった lot 数（累計は state["settle_missing_lots"]）
     """
-    scheduled: List[Dict[str, Any]] = list(state.get("scheduled", []))
+    queue = as_event_queue(state)
+    scheduled = queue.pop_week(week)
     if not scheduled:
-        return
+        return 0
+    missing = 0
 
     psiD = state.get("psi_demand") or {}
     psiS = state.get("psi_supply") or {}
 
     rest: List[Dict[str, Any]] = []
     for ev in scheduled:
-        try:
-            to_w = int(ev.get("to_week", -1))
-        except Exception:
-            to_w = -1
-        if to_w != week:
-            rest.append(ev)
-            continue
-
         etype = (ev.get("type") or "").strip().lower()
         try:
             if etype == "receive_demand":
@@ -86,7 +85,7 @@ def settle_events_to_P(state: Dict[str, Any], week: int) -> None:
                     continue
                 # CO(from_week) から lots を取り除き、P(week)へ追加
                 if 0 <= f_w < len(psi):
-                    _remove_ids(psi[f_w][PSI_CO], lots)
+                    missing += _remove_ids(psi[f_w][PSI_CO], lots)
                 if 0 <= week < len(psi):
                     psi[week][PSI_P].extend(lots)
 
@@ -108,29 +107,20 @@ def settle_events_to_P(state: Dict[str, Any], week: int) -> None:
             # 例外は握りつぶす（監査は上位logger側で）
             continue
 
-    state["scheduled"] = rest
+    # 未知タイプは同じ週のバケットへ戻す
+    queue.extend(rest)
+    if missing:
+        state["settle_missing_lots"] = int(state.get("settle_missing_lots", 0)) + missing
+    return missing
 
 
-def _remove_ids(bucket: List[str], ids: List[str]) -> None:
+def _remove_ids(bucket: List[str], ids: List[str]) -> int:
     """
     bucket から ids の中の lot_id を出現回数分だけ取り除く。
-    多重度を尊重（同じIDが複数あれば複数回消す）。
+    多重度を尊重（同じIDが複数あれば複数回消す）。残りの順序は保持し、1 パスで詰め直す。
+    戻り値: bucket に見つからなかった lot 数
     """
-    if not bucket or not ids:
-        return
-    want: Dict[str, int] = {}
-    for lid in ids:
-        want[lid] = want.get(lid, 0) + 1
-
-    i = 0
-    while i < len(bucket):
-        lid = bucket[i]
-        cnt = want.get(lid, 0)
-        if cnt > 0:
-            want[lid] = cnt - 1
-            bucket.pop(i)
-        else:
-            i += 1
+    return remove_lots(bucket, ids)
 
 
 # ---- 週頭：I ロールフォワード & P 取込 ---------------------------------------
@@ -183,6 +173,7 @@ def consume_S_from_I_ids(
         {"src": "WS1", "sku": "RICE_A", "week": w, "n_lots": 5, "wanted": ["L1","L2",...]}
       "src" が無ければ "node" を代わりに見る。
     - fefo=True のときは、lot_pool[lid].exp_week で I(w) を昇順ソートしてから取り出す。
+      lot_pool に LotRegistry を渡した場合は、その期限週の列でソートする。
     - 不足分は SYN ロットを決定論的IDで補填（S側のみに積む。Iには積まない）
     """
     if not shipments:
@@ -216,20 +207,17 @@ def consume_S_from_I_ids(
         Sw = psi[week][PSI_S]
 
         # FEFO：lot_pool から exp_week を参照（なければ末尾に）
-        if fefo and lot_pool:
+        if fefo and isinstance(lot_pool, LotRegistry):
+            Iw[:] = lot_pool.fefo_order(Iw)   # 期限週の列で一括ソート
+        elif fefo and lot_pool:
             Iw.sort(key=lambda lid: getattr(lot_pool.get(lid, None), "exp_week", float("inf")))
 
         # 1) wanted優先（Iから該当IDを見つけ次第 pop → Sへ）
         wanted_ids = s.get("wanted")
         if wanted_ids:
-            wanted = set(str(x) for x in wanted_ids)
-            i = 0
-            while i < len(Iw) and n > 0:
-                if Iw[i] in wanted:
-                    Sw.append(Iw.pop(i))
-                    n -= 1
-                else:
-                    i += 1
+            taken = take_lots(Iw, (str(x) for x in wanted_ids), n)
+            Sw.extend(taken)
+            n -= len(taken)
 
         # 2) 残りは順番どおり先頭から取り出す
         take = min(n, len(Iw))
@@ -2,25 +2,26 @@
 
 def register(bus):
     from pysi.core.tree import get_nodes
+    from pysi.plan.jit_alloc import jit_assign_node
 
     def jit_assign(root, **ctx):
         weeks = ctx.get("calendar", {}).get("weeks", 52)
+        # 任意：{node_name: 週次キャパ(int or list[int])}。無ければ制約なしの閉形式
+        cap_map = ctx.get("jit_capacity") or {}
+        logger = ctx.get("logger")
 
+        # 需要週ごとに、最短誤差（|ws - wd|）の生産週へ lot を一括コピー
+        # （休暇カレンダ long_vacation_weeks / キャパがあれば最近傍の空き週へ）
+        unplaced = 0
         for n in get_nodes(root):
-            # 需要週ごとに、最短誤差（|ws - wd|）の生産週へ lot をコピー
-            for wd in range(weeks):
-                for lot_id in n.psi4demand[wd][0]:
-                    best_ws, best_cost = None, 10**9
-                    for ws in range(weeks):
-                        cost = abs(ws - wd)  # 早納/遅納の対称コスト
-                        if cost < best_cost:
-                            best_ws, best_cost = ws, cost
-                    if best_ws is not None:
-                        n.psi4supply[best_ws][3].append(lot_id)
+            cap = cap_map.get(n.name, getattr(n, "jit_capacity", None))
+            stats = jit_assign_node(n, weeks, capacity=cap)
+            unplaced += stats["unplaced"]
+        if unplaced and logger:
+            logger.warning(f"[jit] {unplaced} lot(s) could not be placed within capacity")
         return root
 
     # ✅ Hook名を pipeline 準拠に変更
     #bus.add_action("plan:post_build", jit_assign, priority=70)
     ## “after_tree_build” で実行するのが手軽（専用フックにしてもOK）
     bus.add_action("after_tree_build", jit_assign, priority=70)
-
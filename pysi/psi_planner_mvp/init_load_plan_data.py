@@ -36,6 +36,7 @@ from pysi.utils.file_io import *
 from pysi.utils.calendar445 import Calendar445
 from pysi.plan.demand_generate import convert_monthly_to_weekly
 from pysi.plan.operations import *
+from pysi.plan.flow_optimizer import resolve_graph
 from pysi.network.node_base import Node, PlanNode, GUINode
 from pysi.network.tree import *
 from pysi.evaluate.evaluate_cost_models_v2 import gui_run_initial_propagation, propagate_cost_to_plan_nodes, load_tobe_prices, assign_tobe_prices_to_leaf_nodes, load_asis_prices, assign_asis_prices_to_root_nodes
@@ -87,6 +88,7 @@ class PSIPlannerApp4save:
         self.pos_E2E = None
         self.flowDict_opt = {} #None
         self.flowCost_opt = {} #None
+        self.flow_net = None   # FlowNetwork（run_optimization で再利用）
         self.total_supply_plan = 0
         # loading files
         self.directory = None
@@ -1455,6 +1457,7 @@ class PSIPlannerApp4save:
         self.pos_E2E = None
         self.flowDict_opt = {} #None
         self.flowCost_opt = {} #None
+        self.flow_net = None   # FlowNetwork（run_optimization で再利用）
         self.total_supply_plan = 0
         # loading files
         self.directory = None
@@ -1751,6 +1754,7 @@ class PSIPlannerApp:
         self.pos_E2E = None
         self.flowDict_opt = {} #None
         self.flowCost_opt = {} #None
+        self.flow_net = None   # FlowNetwork（run_optimization で再利用）
         self.total_supply_plan = 0
         # loading files
         self.directory = None
@@ -4164,9 +4168,14 @@ class PSIPlannerApp:
         # ************************************
         # optimize network
         # ************************************
+        # 初回は nx.network_simplex（コールドではこちらが速い）。解いた網は self.flow_net に残し、
+        # 2 回目以降は変わった容量・重み・需要だけ差し替えて前回解から解き直す
         try:
-            flowCost_opt, flowDict_opt = nx.network_simplex(G)
+            self.flow_net, flowCost_opt, flowDict_opt = resolve_graph(
+                G, getattr(self, "flow_net", None), warm_start=self.flowDict_opt or True
+            )
         except Exception as e:
+            self.flow_net = None   # 途中で失敗した網は次回作り直す
             print("Error during optimization:", e)
             return
         self.flowCost_opt = flowCost_opt
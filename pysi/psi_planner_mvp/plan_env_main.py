@@ -46,6 +46,7 @@ from pysi.plan.operations import *
 # "plan.demand_processing" is merged in "plan.operations"
 #from plan.demand_processing import *
 from pysi.plan.operations import set_df_Slots2psi4demand
+from pysi.core.psi_snapshot import take_snapshot, restore_snapshot, save_snapshot, load_snapshot, snapshot_path
 from pysi.network.node_base import Node, PlanNode, GUINode
 from pysi.evaluate.evaluate_cost_models_v2 import gui_run_initial_propagation, propagate_cost_to_plan_nodes, load_tobe_prices, assign_tobe_prices_to_leaf_nodes, load_asis_prices, assign_asis_prices_to_root_nodes
 # 既存の PlanNode を注入できるようにしておく（未指定なら内蔵の極小版を使う）
@@ -1071,14 +1072,20 @@ class PlanEnv:
         self.root.after(1000, self.show_psi("outbound", "demand"))
         #self.root.after(1000, self.show_psi_graph)
         #self.show_psi_graph() # this event do not live
-    def demand_planning4multi_product(self):
+    def demand_planning4multi_product(self, parallel: bool = False, max_workers: Optional[int] = None):
         # Implement forward planning logic here
         print("demand_planning4multi_product planning executed.")
         #@250730 ADD multi_product Focus on Selected Product # root is "supply_point"
         self.root_node_outbound_byprod = self.prod_tree_dict_OT[self.product_selected]
         self.root_node_inbound_byprod  = self.prod_tree_dict_IN[self.product_selected]
-        #@240903@241106
-        calc_all_psi2i4demand(self.root_node_outbound_byprod)
+        if parallel:
+            # 全製品を製品単位で並列計画し、結果を手元のツリーへ書き戻す（root は同じまま）
+            from pysi.plan.parallel_plan import plan_forest_parallel
+            plan_forest_parallel(self.prod_tree_dict_OT, self.prod_tree_dict_IN,
+                                 mode="demand", max_workers=max_workers, apply=True)
+        else:
+            #@240903@241106
+            calc_all_psi2i4demand(self.root_node_outbound_byprod)
         #self.update_evaluation_results()
         self.update_evaluation_results4multi_product()
         #@241212 add
@@ -1196,17 +1203,34 @@ class PlanEnv:
         #self.root.after(1000, self.show_psi_by_product("outbound", "supply", self.product_selected))
         #self.root.after(1000, self.show_psi_graph)
     def psi_backup(self, node, status_name):
-        return copy.deepcopy(node)
+        # Node は複製せず、PSI レイヤだけを列指向スナップショットに取る（直前の取得との差分）
+        snap = take_snapshot(node, base=getattr(self, "_psi_last_snapshot", None))
+        self._psi_last_snapshot = snap
+        return node, snap
     def psi_restore(self, node_backup, status_name):
-        return copy.deepcopy(node_backup)
+        # 指紋の違うセルだけを書き戻して、同じ root を返す
+        node, snap = node_backup
+        restore_snapshot(node, snap)
+        return node
     def psi_backup_to_file(self, node, filename):
-        with open(filename, 'wb') as file:
-            pickle.dump(node, file)
+        backup = self.psi_backup(node, filename)
+        if not hasattr(self, "_psi_file_backups"):
+            self._psi_file_backups = {}
+        self._psi_file_backups[filename] = backup
+        save_snapshot(backup[1], snapshot_path(filename))
     def psi_restore_from_file(self, filename):
-        with open(filename, 'rb') as file:
+        # 同じセッションで取ったものはメモリ上の差分から、それ以外は mmap したファイルから戻す
+        backup = getattr(self, "_psi_file_backups", {}).get(filename)
+        if backup is not None:
+            return self.psi_restore(backup, filename)
+        path = snapshot_path(filename)
+        if os.path.isdir(path) and self.root_node_outbound is not None:
+            restore_snapshot(self.root_node_outbound, load_snapshot(path))
+            return self.root_node_outbound
+        with open(filename, 'rb') as file:   # 旧形式（Node の pickle）
             node_backup = pickle.load(file)
         return node_backup
-    def supply_planning4multi_product(self):
+    def supply_planning4multi_product(self, parallel: bool = False, max_workers: Optional[int] = None):
         #@250730 ADD multi_product Focus on Selected Product # root is "supply_point"
         self.root_node_outbound_byprod = self.prod_tree_dict_OT[self.product_selected]
         self.root_node_inbound_byprod  = self.prod_tree_dict_IN[self.product_selected]
@@ -1223,6 +1247,16 @@ class PlanEnv:
         #self.root_node_outbound = self.psi_restore_from_file('psi_backup.pkl')
         #@250730 Temporary ADD
         self.decouple_node_selected = []
+        if parallel:
+            # 全製品を並列計画。decouple 点は下の逐次版と同じ nodes_decouple_all[-3]（"DAD"）を製品ごとに渡す
+            from pysi.plan.parallel_plan import dad_decouple_nodes, plan_forest_parallel
+            decouple_by_prod = dad_decouple_nodes(self.prod_tree_dict_OT)
+            print("decouple_node_names by_product", decouple_by_prod)
+            plan_forest_parallel(self.prod_tree_dict_OT, self.prod_tree_dict_IN, mode="supply",
+                                 max_workers=max_workers, decouple_nodes=decouple_by_prod, apply=True)
+            self.update_evaluation_results4multi_product()
+            self.decouple_node_selected = decouple_by_prod.get(self.product_selected, [])
+            return
         if self.decouple_node_selected == []:
             # Search nodes_decouple_all[-2], that is "DAD" nodes
             nodes_decouple_all = make_nodes_decouple_all(self.root_node_outbound_byprod)
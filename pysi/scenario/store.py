@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-import sqlite3, json, datetime as dt
+import os, sqlite3, json, datetime as dt
 from typing import Optional, List, Tuple
 import pandas as pd
 
@@ -756,12 +756,163 @@ def _pick_first_col(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
             return c
     return None
 
+# ---- scenario_result_node の明細 -------------------------------------------------
+_NODE_KEYS = ["product_name", "node_name"]
+_NODE_PRICE_COLS = ["offering_price_ASIS", "offering_price_TOBE"]
+# 保存する指標 → cost_df 側の列名候補（先に見つかったものを使う）
+_NODE_WANT = {
+    "revenue":                ["revenue","price_sales_shipped","cs_price_sales_shipped"],
+    "profit":                 ["profit","cs_profit","gross_profit"],
+    "cost":                   ["cost","total_cost","full_cost","cs_cost_total"],
+    "logistics_costs":        ["logistics_costs","cs_logistics_costs"],
+    "warehouse_cost":         ["warehouse_cost","cs_warehouse_cost"],
+    "manufacturing_overhead": ["manufacturing_overhead","mfg_overhead","cs_mfg_overhead"],
+    "direct_materials_costs": ["direct_materials_costs","materials_costs","cs_direct_materials_costs","direct_materials"],
+    "tax_portion":            ["tax_portion","tariff_portion","cs_tax_portion"],
+}
+_NODE_NUM_COLS = ("price", *_NODE_PRICE_COLS, *_NODE_WANT)
+
+def _node_detail_frame(price_df: Optional[pd.DataFrame], cost_df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """
+    price_df（product × node の価格）に cost_df の指標を 1 回の merge で付ける。
+    cost_df に無い指標は 0.0。price は TOBE>0 → ASIS>0 → 0.0 の順。
+    """
+    vals = None
+    if cost_df is not None and not cost_df.empty and all(k in cost_df.columns for k in _NODE_KEYS):
+        pick = {rep: _pick_first_col(cost_df, cands) for rep, cands in _NODE_WANT.items()}
+        pick = {rep: nm for rep, nm in pick.items() if nm is not None}
+        if pick:
+            vals = cost_df[_NODE_KEYS].copy()
+            for rep, nm in pick.items():
+                vals[rep] = pd.to_numeric(cost_df[nm], errors="coerce").fillna(0.0)
+
+    if price_df is not None and not price_df.empty:
+        df = price_df[_NODE_KEYS + _NODE_PRICE_COLS].copy()
+        if vals is not None:
+            df = df.merge(vals, on=_NODE_KEYS, how="left")
+    else:
+        df = vals if vals is not None else pd.DataFrame(columns=_NODE_KEYS)
+    df = df.reindex(columns=_NODE_KEYS + _NODE_PRICE_COLS + list(_NODE_WANT))
+
+    tobe = pd.to_numeric(df["offering_price_TOBE"], errors="coerce")
+    asis = pd.to_numeric(df["offering_price_ASIS"], errors="coerce")
+    df["price"] = tobe.where(tobe > 0).combine_first(asis.where(asis > 0)).fillna(0.0)
+    num = list(_NODE_NUM_COLS)
+    df[num] = df[num].apply(pd.to_numeric, errors="coerce").fillna(0.0).astype(float)
+    df[_NODE_KEYS] = df[_NODE_KEYS].fillna("")
+    return df
+
+# ---- 週次 PSI 数量スナップショット -------------------------------------------------
+# save_run_results(psi_trees=...) のときだけ、(product, node, layer) × 週 × [S, CO, I, P] の数量を
+# 圧縮 npz（<db のディレクトリ>/runs/<run_id>.psi.npz）に保存し、scenario_result_psi に場所を記録する。
+# 比較画面は load_psi_counts_snapshot で読むだけでよい（再計画しない）。
+PSI_SNAPSHOT_LAYERS = ("psi4demand", "psi4supply")
+
+def _psi_week_counts(psi) -> "np.ndarray":
+    """1 レイヤの (週, 4) 数量"""
+    import numpy as np
+    from pysi.core.psi_store import PSIStore
+    store = getattr(psi, "store", None)
+    if isinstance(store, PSIStore):
+        return np.stack([store.counts(b) for b in range(4)], axis=1).astype(np.int32)
+    arr = np.array([[len(c) for c in week] for week in psi], dtype=np.int32)
+    return arr.reshape(-1, 4)
+
+def _iter_psi_trees(psi_trees):
+    """root / {product: root} → (product, node) を前順で"""
+    forest = psi_trees.items() if isinstance(psi_trees, dict) else [("", psi_trees)]
+    for prod, root in forest:
+        st, seen = [root], set()
+        while st:
+            n = st.pop()
+            if n is None or id(n) in seen:
+                continue
+            seen.add(id(n))
+            yield str(prod), n
+            st.extend(reversed(getattr(n, "children", []) or []))
+
+def psi_snapshot_path(db_path: str, run_id: str) -> str:
+    safe = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(run_id))
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "runs", f"{safe}.psi.npz")
+
+def save_psi_counts_snapshot(con: sqlite3.Connection, db_path: str, run_id: str, psi_trees,
+                             layers=PSI_SNAPSHOT_LAYERS) -> Optional[str]:
+    import numpy as np
+    keys, mats = [], []
+    for prod, n in _iter_psi_trees(psi_trees):
+        for layer in layers:
+            psi = getattr(n, layer, None)
+            if psi is None:
+                continue
+            keys.append((prod, n.name, layer))
+            mats.append(_psi_week_counts(psi))
+    if not keys:
+        return None
+    W = max(m.shape[0] for m in mats)
+    counts = np.zeros((len(mats), W, 4), dtype=np.int32)
+    for i, m in enumerate(mats):
+        counts[i, :m.shape[0]] = m
+    path = psi_snapshot_path(db_path, run_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(
+        path,
+        product_name=np.array([k[0] for k in keys]),
+        node_name=np.array([k[1] for k in keys]),
+        layer=np.array([k[2] for k in keys]),
+        weeks=np.array([m.shape[0] for m in mats], dtype=np.int32),
+        counts=counts,
+    )
+    con.execute("""CREATE TABLE IF NOT EXISTS scenario_result_psi(
+                     run_id TEXT PRIMARY KEY, path TEXT NOT NULL,
+                     n_series INTEGER, weeks INTEGER, created_at TEXT)""")
+    con.execute("INSERT OR REPLACE INTO scenario_result_psi(run_id, path, n_series, weeks, created_at) "
+                "VALUES (?,?,?,?,?)", (str(run_id), path, len(keys), W, _now()))
+    return path
+
+def load_psi_counts_snapshot(db_path: str, run_id: str, *, layer: Optional[str] = None,
+                             as_frame: bool = True):
+    """
+    save_run_results(psi_trees=...) が保存した週次数量を読む（無ければ None）。
+    as_frame=True なら long 形式 DataFrame（product_name, node_name, layer, week, S, CO, I, P）、
+    False なら npz の配列 dict。
+    """
+    import numpy as np
+    con = sqlite3.connect(db_path)
+    try:
+        row = con.execute("SELECT path FROM scenario_result_psi WHERE run_id=?", (str(run_id),)).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        con.close()
+    if not row or not os.path.exists(row[0]):
+        return None
+    with np.load(row[0]) as z:
+        data = {k: z[k] for k in z.files}
+    if layer is not None:
+        m = data["layer"] == layer
+        data = {k: v[m] for k, v in data.items()}
+    if not as_frame:
+        return data
+    R, W = data["counts"].shape[:2]
+    valid = (np.arange(W)[None, :] < data["weeks"][:, None]).ravel()
+    flat = data["counts"].reshape(R * W, 4)[valid]
+    rep = lambda a: np.repeat(a, W)[valid]
+    return pd.DataFrame({
+        "product_name": rep(data["product_name"]),
+        "node_name": rep(data["node_name"]),
+        "layer": rep(data["layer"]),
+        "week": np.tile(np.arange(W), R)[valid],
+        "S": flat[:, 0], "CO": flat[:, 1], "I": flat[:, 2], "P": flat[:, 3],
+    })
+
 def save_run_results(db_path: str,
                      scenario_id: Optional[str],
                      label: Optional[str]=None,
                      note: Optional[str]=None,
                      # ← 追加：GUI から直接渡すためのオーバーライド
-                     cost_df_override: Optional[pd.DataFrame]=None) -> str:
+                     cost_df_override: Optional[pd.DataFrame]=None,
+                     # 計画済みツリー（root / {product: root}）。渡すと週次 PSI 数量の npz も保存
+                     psi_trees=None) -> str:
     con = sqlite3.connect(db_path)
     try:
         # run ヘッダ行の作成（あなたの create_run を利用）
@@ -814,49 +965,9 @@ def save_run_results(db_path: str,
         )
 
         # ========== Node 明細 ==========
-        # price_df から基本列
-        base_cols = ["product_name","node_name","offering_price_ASIS","offering_price_TOBE"]
-        df = price_df[base_cols].copy() if not price_df.empty else pd.DataFrame(columns=base_cols)
-
-        # cost_df から拾えるものを正規化してマージ
-        def _pick_to(df_cost: pd.DataFrame, rep: str, candidates: List[str]) -> pd.DataFrame:
-            if df_cost is None or df_cost.empty:
-                return pd.DataFrame(columns=["product_name","node_name", rep])
-            for nm in candidates:
-                if nm in getattr(df_cost, "columns", []):
-                    part = df_cost[["product_name","node_name", nm]].rename(columns={nm: rep}).copy()
-                    part[rep] = pd.to_numeric(part[rep], errors="coerce").fillna(0.0)
-                    return part
-            # 無いときは空
-            return pd.DataFrame(columns=["product_name","node_name", rep])
-
-        WANT = {
-            "revenue":                ["revenue","price_sales_shipped","cs_price_sales_shipped"],
-            "profit":                 ["profit","cs_profit","gross_profit"],
-            "cost":                   ["cost","total_cost","full_cost","cs_cost_total"],
-            "logistics_costs":        ["logistics_costs","cs_logistics_costs"],
-            "warehouse_cost":         ["warehouse_cost","cs_warehouse_cost"],
-            "manufacturing_overhead": ["manufacturing_overhead","mfg_overhead","cs_mfg_overhead"],
-            "direct_materials_costs": ["direct_materials_costs","materials_costs","cs_direct_materials_costs","direct_materials"],
-            "tax_portion":            ["tax_portion","tariff_portion","cs_tax_portion"],
-        }
-
-        for rep, cands in WANT.items():
-            part = _pick_to(cost_df, rep, cands)
-            if part.empty and not df.empty:
-                # 0.0 の列を作る
-                part = df[["product_name","node_name"]].copy()
-                part[rep] = 0.0
-            df = df.merge(part, on=["product_name","node_name"], how="left") if not df.empty else part
-
-        # 保存用の price 列（NOT NULL を満たす）
-        tobe = pd.to_numeric(df.get("offering_price_TOBE", pd.Series()), errors="coerce")
-        asis = pd.to_numeric(df.get("offering_price_ASIS", pd.Series()), errors="coerce")
-        price = tobe.where(tobe > 0).combine_first(asis.where(asis > 0)).fillna(0.0)
-        df["price"] = price
-
-        df = df.fillna(0.0)
-
+        # WANT ごとの列選択 → 1 回の merge / reindex で明細を作り、executemany で一括 INSERT
+        df = _node_detail_frame(price_df, cost_df)
+        cols = ["product_name", "node_name"] + list(_NODE_NUM_COLS)
         sql = (
             "INSERT INTO scenario_result_node "
             "(run_id, product_name, node_name, "
@@ -866,22 +977,11 @@ def save_run_results(db_path: str,
             " direct_materials_costs, tax_portion) "
             "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
         )
-        for r in df.to_dict("records"):
-            con.execute(sql, (
-                run_id,
-                r.get("product_name",""), r.get("node_name",""),
-                float(r.get("price", 0.0)),
-                float(r.get("offering_price_ASIS", 0.0)),
-                float(r.get("offering_price_TOBE", 0.0)),
-                float(r.get("revenue", 0.0)),
-                float(r.get("profit", 0.0)),
-                float(r.get("cost", 0.0)),
-                float(r.get("logistics_costs", 0.0)),
-                float(r.get("warehouse_cost", 0.0)),
-                float(r.get("manufacturing_overhead", 0.0)),
-                float(r.get("direct_materials_costs", 0.0)),
-                float(r.get("tax_portion", 0.0)),
-            ))
+        con.executemany(sql, ((run_id, *r) for r in df[cols].itertuples(index=False, name=None)))
+
+        # ========== 週次 PSI 数量のスナップショット（任意） ==========
+        if psi_trees is not None:
+            save_psi_counts_snapshot(con, db_path, run_id, psi_trees)
 
         con.commit()
         return run_id
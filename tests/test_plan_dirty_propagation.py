@@ -0,0 +1,51 @@
+# tests/test_plan_dirty_propagation.py
+# 差分再計画（propagate_dirty_with_calcP2S）がゼロからの計画と一致することの回帰テスト
+from pysi.network.node_base import Node
+from pysi.plan.operations import (
+    check_dirty_propagation_equivalence,
+    propagate_dirty_with_calcP2S,
+    propagate_postorder_with_calcP2S,
+)
+
+
+def _planned_tree(weeks: int = 10):
+    r, c = Node("R"), Node("C")
+    r.children.append(c)
+    c.parent = r
+    for n in (r, c):
+        n.SS_days = 7
+        n.leadtime = 1
+        n.set_plan_range_by_weeks(weeks, 2025)
+    c.psi4demand[6][0] = ["L1", "L2"]
+    propagate_postorder_with_calcP2S(r)
+    return r, c
+
+
+def _cells(psi, b):
+    return {w: list(cell[b]) for w, cell in enumerate(psi) if cell[b]}
+
+
+def test_leadtime_change_replaces_instead_of_appending():
+    r, c = _planned_tree()
+    c.set_plan_params(leadtime=2)
+    assert check_dirty_propagation_equivalence(r) == {}
+
+    res = propagate_dirty_with_calcP2S(r)
+
+    assert res["nodes"] == ["C", "R"]
+    assert res["changed"] == {"R": [2, 3, 4]}      # C の需要は変わっていない
+    assert _cells(c.psi4demand, 3) == {5: ["L1", "L2"]}
+    assert _cells(r.psi4demand, 0) == {3: ["L1", "L2"]}
+    assert _cells(r.psi4demand, 3) == {2: ["L1", "L2"]}
+    assert _cells(r.psi4supply, 0) == {3: ["L1", "L2"]}
+    assert _cells(c.psi4supply, 0) == {6: ["L1", "L2"]}
+
+
+def test_repeated_incremental_replan_is_stable():
+    r, c = _planned_tree()
+    for lt in (2, 3, 1):
+        c.set_plan_params(leadtime=lt)
+        assert check_dirty_propagation_equivalence(r) == {}
+        propagate_dirty_with_calcP2S(r)
+    c.mark_psi_dirty()
+    assert propagate_dirty_with_calcP2S(r)["changed"] == {}